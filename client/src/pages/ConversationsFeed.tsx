@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
-import { conversationsAPI, aiGenerationAPI } from '../services/api';
+import { conversationsAPI, aiGenerationAPI, countJobItems, describeJob, JobTimeoutError } from '../services/api';
 import './ConversationsFeed.css';
 
 export default function ConversationsFeed() {
@@ -48,12 +48,24 @@ export default function ConversationsFeed() {
 
     try {
       setGenerating(true);
-      await aiGenerationAPI.generateForUser();
-      alert('Conversations generated successfully! Refreshing...');
+      const { data: job } = await aiGenerationAPI.generateForUser();
+      let finished = await aiGenerationAPI.waitForJob(job.id);
+      if (finished.status === 'failed') {
+        throw new Error('Generation job failed');
+      }
+      const skipped = countJobItems(finished).skipped || 0;
+      if (skipped && confirm("Your usage hasn't changed since the last conversation. Generate a new one anyway?")) {
+        const { data: forced } = await aiGenerationAPI.generateForUser(true);
+        finished = await aiGenerationAPI.waitForJob(forced.id);
+        if (finished.status === 'failed') {
+          throw new Error('Generation job failed');
+        }
+      }
+      alert(`Conversations: ${describeJob(finished)}. Refreshing...`);
       await loadConversations();
     } catch (error: any) {
       console.error('Failed to generate conversations:', error);
-      alert(error.response?.data?.detail || 'Failed to generate conversations. Make sure you have usage data and an OpenAI API key configured.');
+      alert(error instanceof JobTimeoutError ? error.message : error.response?.data?.detail || 'Failed to generate conversations. Make sure you have usage data and an OpenAI API key configured.');
     } finally {
       setGenerating(false);
     }
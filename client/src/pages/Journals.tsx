@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { journalsAPI, aiGenerationAPI } from '../services/api';
+import { journalsAPI, aiGenerationAPI, countJobItems, describeJob, JobTimeoutError } from '../services/api';
 import './Journals.css';
 
 type JournalType = 'device' | 'app';
@@ -42,12 +42,24 @@ export default function Journals() {
 
     try {
       setGenerating(true);
-      await aiGenerationAPI.generateJournals();
-      alert('Journals generated successfully! Refreshing...');
+      const { data: job } = await aiGenerationAPI.generateJournals();
+      let finished = await aiGenerationAPI.waitForJob(job.id);
+      if (finished.status === 'failed') {
+        throw new Error('Generation job failed');
+      }
+      const skipped = countJobItems(finished).skipped || 0;
+      if (skipped && confirm(`${skipped} journals haven't changed since they were last written. Rewrite them anyway?`)) {
+        const { data: forced } = await aiGenerationAPI.generateJournals(true);
+        finished = await aiGenerationAPI.waitForJob(forced.id);
+        if (finished.status === 'failed') {
+          throw new Error('Generation job failed');
+        }
+      }
+      alert(`Journals: ${describeJob(finished)}. Refreshing...`);
       await loadJournals();
     } catch (error: any) {
       console.error('Failed to generate journals:', error);
-      alert(error.response?.data?.detail || 'Failed to generate journals. Make sure you have usage data and an OpenAI API key configured.');
+      alert(error instanceof JobTimeoutError ? error.message : error.response?.data?.detail || 'Failed to generate journals. Make sure you have usage data and an OpenAI API key configured.');
     } finally {
       setGenerating(false);
     }
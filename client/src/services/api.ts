@@ -195,9 +195,48 @@ export const socialAPI = {
 
 // AI Generation API (for testing/manual trigger)
 export const aiGenerationAPI = {
-  generateConversations: () => api.post('/ai-engine/generate-conversations/'),
-  generateJournals: () => api.post('/ai-engine/generate-journals/'),
-  generateForUser: () => api.post('/ai-engine/generate-conversations/'),
+  // force regenerates targets whose inputs haven't changed since their last generation
+  generateConversations: (force = false) => api.post('/ai-engine/generate-conversations/', { force }),
+  generateJournals: (force = false) => api.post('/ai-engine/generate-journals/', { force }),
+  generateForUser: (force = false) => api.post('/ai-engine/generate-conversations/', { force }),
+  getJob: (id: number) => api.get(`/ai-engine/jobs/${id}/`),
+  // Poll a generation job until all of its targets have finished, giving up after timeoutMs
+  waitForJob: async (id: number, intervalMs = 2000, timeoutMs = 10 * 60 * 1000) => {
+    const deadline = Date.now() + timeoutMs;
+    while (Date.now() < deadline) {
+      const { data } = await api.get(`/ai-engine/jobs/${id}/`);
+      if (data.status === 'completed' || data.status === 'failed') {
+        return data;
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+    throw new JobTimeoutError(id);
+  },
+};
+
+export class JobTimeoutError extends Error {
+  constructor(id: number) {
+    super(`Generation job ${id} is taking longer than expected. Check back later.`);
+    this.name = 'JobTimeoutError';
+  }
+}
+
+// Count a job's targets by status
+export const countJobItems = (job: any) => {
+  const counts: Record<string, number> = {};
+  for (const item of job.items || []) {
+    counts[item.status] = (counts[item.status] || 0) + 1;
+  }
+  return counts;
+};
+
+// Summarize a finished job's targets, e.g. "2 generated, 1 unchanged, 1 failed"
+export const describeJob = (job: any) => {
+  const counts = countJobItems(job);
+  const parts = [`${counts.succeeded || 0} generated`];
+  if (counts.skipped) parts.push(`${counts.skipped} unchanged`);
+  if (counts.failed) parts.push(`${counts.failed} failed`);
+  return parts.join(', ');
 };
 
 export default api;
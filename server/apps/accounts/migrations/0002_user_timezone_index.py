@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='timezone',
+            field=models.CharField(db_index=True, default='UTC', max_length=50),
+        ),
+    ]
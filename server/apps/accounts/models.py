@@ -9,7 +9,7 @@ class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = models.EmailField(unique=True)
     display_name = models.CharField(max_length=50, blank=True)
-    timezone = models.CharField(max_length=50, default='UTC')
+    timezone = models.CharField(max_length=50, default='UTC', db_index=True)  # Daily pipeline bucket
     
     # Privacy settings
     allow_friend_requests = models.BooleanField(default=True)
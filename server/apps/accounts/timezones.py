@@ -0,0 +1,52 @@
+"""
+Timezone buckets for the daily pipeline
+
+Users are grouped by their IANA timezone (User.timezone). A bucket is the
+set of timezones whose local midnight falls in the same tick of the
+pipeline dispatcher, so each user's day is processed once it has actually
+ended where they live, and the nightly work is spread over the 24 hours
+instead of landing on one UTC hour. Unknown timezone names count as UTC.
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.contrib.auth import get_user_model
+
+
+@lru_cache(maxsize=None)
+def get_zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def local_date(name: str, at: datetime):
+    """The date in a timezone at an aware datetime"""
+    return at.astimezone(get_zone(name)).date()
+
+
+def user_timezones() -> List[str]:
+    """The distinct timezones of active users"""
+    return list(get_user_model().objects.filter(is_active=True).values_list('timezone', flat=True).distinct())
+
+
+def timezones_past_midnight(start: datetime, end: datetime, timezones=None) -> Dict:
+    """
+    {date: [timezones]} for the timezones whose local midnight falls in (start, end]
+
+    The date is the local day that ended at that midnight.
+    """
+    buckets = {}
+    for name in user_timezones() if timezones is None else timezones:
+        day = local_date(name, start)
+        if local_date(name, end) != day:
+            buckets.setdefault(day, []).append(name)
+    return buckets
+
+
+def bucket_start(at: datetime, minutes: int) -> datetime:
+    """The start of the `minutes`-long tick containing an aware datetime"""
+    at = at.replace(second=0, microsecond=0)
+    return at - timedelta(minutes=(at.hour * 60 + at.minute) % minutes)
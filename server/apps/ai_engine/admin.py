@@ -1,5 +1,49 @@
 from django.contrib import admin
+from .models import ConversationPrompt, AIGenerationLog, GenerationRetry, GenerationBatch, GenerationJob, GenerationJobItem
 
-# AI Engine doesn't have models to register
-# All AI generation is handled through services and tasks
 
+@admin.register(ConversationPrompt)
+class ConversationPromptAdmin(admin.ModelAdmin):
+    list_display = ['name', 'version', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'template']
+
+
+@admin.register(AIGenerationLog)
+class AIGenerationLogAdmin(admin.ModelAdmin):
+    list_display = ['content_type', 'model_used', 'outcome', 'generation_time', 'time_to_first_token',
+                    'prompt_tokens', 'completion_tokens', 'cached_tokens', 'retries', 'created_at']
+    list_filter = ['content_type', 'model_used', 'outcome']
+    date_hierarchy = 'created_at'
+
+
+@admin.register(GenerationRetry)
+class GenerationRetryAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'target_id', 'date', 'status', 'attempts', 'next_attempt_at', 'updated_at']
+    list_filter = ['kind', 'status', 'date']
+    search_fields = ['target_id', 'last_error']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(GenerationBatch)
+class GenerationBatchAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'date', 'provider', 'provider_batch_id', 'status', 'request_count',
+                    'succeeded_count', 'failed_count', 'created_at', 'completed_at']
+    list_filter = ['kind', 'provider', 'status', 'date']
+    search_fields = ['provider_batch_id']
+    exclude = ['items']
+
+
+class GenerationJobItemInline(admin.TabularInline):
+    model = GenerationJobItem
+    extra = 0
+    readonly_fields = ['kind', 'target_id', 'target_name', 'status', 'error_message', 'updated_at']
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'date', 'status', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'date']
+    search_fields = ['user__username']
+    readonly_fields = ['created_at', 'updated_at', 'finished_at']
+    inlines = [GenerationJobItemInline]
@@ -0,0 +1,161 @@
+"""
+Offline batch submission for nightly generation
+
+A night's chat completion requests are written to a JSONL file and handed
+to an OpenAI-compatible batch endpoint, which answers within the completion
+window at a discount and outside the interactive rate limits. The local
+provider is a file-based stand-in that completes batches on the first poll
+with canned responses, for development and tests.
+"""
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, List, Tuple
+from django.conf import settings
+from openai import OpenAI
+
+# Batch API pricing relative to the synchronous endpoint
+BATCH_COST_FACTOR = 0.5
+BATCH_ENDPOINT = '/v1/chat/completions'
+TERMINAL_FAILURE_STATUSES = ('failed', 'expired', 'cancelled')
+
+
+def write_batch_file(entries: List[Tuple[str, Dict]]) -> str:
+    """Write (custom_id, request) pairs as a batch input JSONL file and return its path"""
+    os.makedirs(settings.AI_BATCH_DIR, exist_ok=True)
+    path = os.path.join(settings.AI_BATCH_DIR, f"batch-{uuid.uuid4().hex}.jsonl")
+    with open(path, 'w', encoding='utf-8') as batch_file:
+        for custom_id, request in entries:
+            batch_file.write(json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': {k: v for k, v in request.items() if not k.startswith('_')},
+            }) + '\n')
+    return path
+
+
+def parse_batch_output(text: str) -> Dict[str, Dict]:
+    """
+    Parse batch output/error JSONL into {custom_id: {'status_code', 'body', 'error'}}
+    """
+    results = {}
+    for line in (text or '').splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        response = record.get('response') or {}
+        error = record.get('error') or (response.get('body') or {}).get('error')
+        results[record.get('custom_id')] = {
+            'status_code': response.get('status_code'),
+            'body': response.get('body'),
+            'error': error.get('message') if isinstance(error, dict) else error,
+        }
+    return results
+
+
+class OpenAIBatchProvider:
+    """Batches through an OpenAI-compatible /v1/batches API"""
+
+    name = 'openai'
+
+    def __init__(self):
+        self.client = OpenAI(
+            api_key=settings.AI_BATCH_API_KEY or settings.AI_API_KEY,
+            base_url=settings.AI_BATCH_BASE_URL or settings.AI_BASE_URL
+        )
+
+    def submit(self, path: str) -> str:
+        with open(path, 'rb') as batch_file:
+            uploaded = self.client.files.create(file=batch_file, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=settings.AI_BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> Dict:
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            'status': batch.status,
+            'output_file_id': batch.output_file_id,
+            'error_file_id': batch.error_file_id,
+        }
+
+    def download(self, file_id: str) -> str:
+        return self.client.files.content(file_id).text
+
+
+class LocalBatchProvider:
+    """File-based stand-in that answers every request with a canned completion"""
+
+    name = 'local'
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(settings.AI_BATCH_DIR, 'local')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, file_id: str) -> str:
+        return os.path.join(self.directory, file_id)
+
+    def submit(self, path: str) -> str:
+        batch_id = f"local-{uuid.uuid4().hex}"
+        shutil.copyfile(path, self._path(f"{batch_id}.input.jsonl"))
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> Dict:
+        output_file_id = f"{batch_id}.output.jsonl"
+        if not os.path.exists(self._path(output_file_id)):
+            self._complete(batch_id, output_file_id)
+        return {'status': 'completed', 'output_file_id': output_file_id, 'error_file_id': None}
+
+    def download(self, file_id: str) -> str:
+        with open(self._path(file_id), encoding='utf-8') as output_file:
+            return output_file.read()
+
+    def _complete(self, batch_id: str, output_file_id: str):
+        with open(self._path(f"{batch_id}.input.jsonl"), encoding='utf-8') as input_file, \
+                open(self._path(output_file_id), 'w', encoding='utf-8') as output_file:
+            for line in input_file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                body = record['body']
+                prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages', [])) // 4
+                content = f"[local batch] {record['custom_id']}"
+                output_file.write(json.dumps({
+                    'id': f"resp-{uuid.uuid4().hex}",
+                    'custom_id': record['custom_id'],
+                    'response': {
+                        'status_code': 200,
+                        'body': {
+                            'id': f"chatcmpl-{uuid.uuid4().hex}",
+                            'object': 'chat.completion',
+                            'created': 0,
+                            'model': body['model'],
+                            'choices': [{
+                                'index': 0,
+                                'message': {'role': 'assistant', 'content': content},
+                                'finish_reason': 'stop',
+                            }],
+                            'usage': {
+                                'prompt_tokens': prompt_tokens,
+                                'completion_tokens': len(content) // 4,
+                                'total_tokens': prompt_tokens + len(content) // 4,
+                            },
+                        },
+                    },
+                    'error': None,
+                }) + '\n')
+
+
+def get_batch_provider():
+    """Provider selected by AI_BATCH_PROVIDER"""
+    if settings.AI_BATCH_PROVIDER == 'local':
+        return LocalBatchProvider()
+    return OpenAIBatchProvider()
@@ -0,0 +1,144 @@
+"""
+Prompt and completion token budgets
+
+Prompt tokens are counted locally, with tiktoken when it is installed (and
+its encoding is available offline) or a word/punctuation estimate
+otherwise. Conversation prompts are compacted step by step (see
+COMPACTION_LEVELS in AIGenerationService) until they fit
+AI_CONVERSATION_PROMPT_BUDGET.
+
+Completion limits follow what the model actually writes: max_tokens for a
+content type is the AI_MAX_TOKENS_PERCENTILE of the completion lengths in
+recent AIGenerationLog rows plus AI_MAX_TOKENS_HEADROOM, rounded up to a
+multiple of MAX_TOKENS_STEP so request hashes (and the generation cache)
+stay stable, and never above the built-in limit. The percentiles are
+reloaded at most every AI_MAX_TOKENS_REFRESH seconds per process.
+
+A completion the adaptive cap cut short (finish_reason 'length') is asked
+for once more with the built-in limit, and truncated completions are left
+out of the percentiles so they can't shrink the cap further.
+"""
+import importlib.util
+import math
+import re
+import threading
+import time
+from typing import Dict, Optional
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+MAX_TOKENS_STEP = 32
+# Completion limits never drop below this share of the built-in limit
+MIN_MAX_TOKENS_FRACTION = 0.25
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if importlib.util.find_spec('tiktoken') is not None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                # The encoding is downloaded on first use, which fails offline
+                logger.warning(f"tiktoken unavailable, estimating tokens: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in a text, exact with tiktoken and a close estimate without it"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # BPE vocabularies cover common words in one token and split long ones about every 6 characters
+    return sum(1 + (len(word) - 1) // 6 for word in _WORD_PATTERN.findall(text))
+
+
+class OutputLengths:
+    """Per-process completion length percentiles by content type, from AIGenerationLog"""
+
+    def __init__(self):
+        self._per_unit = {}  # content_type -> percentile of completion tokens per unit, or None
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def per_unit(self, content_type: str) -> Optional[float]:
+        loaded_at = self._loaded_at.get(content_type)
+        if loaded_at is None or time.monotonic() - loaded_at >= settings.AI_MAX_TOKENS_REFRESH:
+            with self._lock:
+                loaded_at = self._loaded_at.get(content_type)
+                if loaded_at is None or time.monotonic() - loaded_at >= settings.AI_MAX_TOKENS_REFRESH:
+                    self._per_unit[content_type] = self._load(content_type)
+                    self._loaded_at[content_type] = time.monotonic()
+        return self._per_unit.get(content_type)
+
+    @staticmethod
+    def _load(content_type: str) -> Optional[float]:
+        from apps.ai_engine.models import AIGenerationLog
+        try:
+            rows = list(AIGenerationLog.objects.filter(
+                content_type=content_type, outcome='success', truncated=False, completion_tokens__isnull=False
+            ).order_by('-created_at').values_list('completion_tokens', 'input_data')[:settings.AI_MAX_TOKENS_SAMPLE])
+        except DatabaseError as e:
+            logger.error(f"Could not load completion lengths for {content_type}: {str(e)}")
+            return None
+        if len(rows) < settings.AI_MAX_TOKENS_MIN_SAMPLES:
+            return None
+        # Packed requests log how many items they hold as input_data['units']
+        lengths = np.array([tokens / max(1, (input_data or {}).get('units', 1)) for tokens, input_data in rows])
+        return float(np.percentile(lengths, settings.AI_MAX_TOKENS_PERCENTILE))
+
+
+_output_lengths = OutputLengths()
+
+
+def max_tokens_for(content_type: str, limit: int, units: int = 1) -> int:
+    """
+    max_tokens for a request of a content type holding `units` items
+
+    `limit` is the built-in per-item limit, used until enough completions
+    have been logged and as the ceiling afterwards.
+    """
+    ceiling = limit * units
+    # Cassette runs keep the built-in limits so recorded requests hash the same
+    if not settings.AI_ADAPTIVE_MAX_TOKENS or settings.AI_CASSETTE_MODE:
+        return ceiling
+    per_unit = _output_lengths.per_unit(content_type)
+    if per_unit is None:
+        return ceiling
+    tokens = per_unit * units * (1 + settings.AI_MAX_TOKENS_HEADROOM)
+    tokens = MAX_TOKENS_STEP * math.ceil(tokens / MAX_TOKENS_STEP)
+    return int(min(ceiling, max(tokens, ceiling * MIN_MAX_TOKENS_FRACTION)))
+
+
+def completion_budget(content_type: str, limit: int, units: int = 1) -> Dict:
+    """The max_tokens request fields: the adaptive cap and, for full_limit_retry, the built-in limit"""
+    return {
+        'max_tokens': max_tokens_for(content_type, limit, units),
+        '_max_tokens_limit': limit * units,
+    }
+
+
+def full_limit_retry(request: Dict, result: Dict) -> Optional[Dict]:
+    """The request again with its built-in limit if the adaptive cap truncated `result`, else None"""
+    limit = request.get('_max_tokens_limit')
+    if result.get('truncated') and limit and request.get('max_tokens', limit) < limit:
+        return {**request, 'max_tokens': limit}
+    return None
+
+
+def reset_output_lengths():
+    """Forget the loaded percentiles (e.g. after changing the settings)"""
+    global _output_lengths
+    _output_lengths = OutputLengths()
@@ -0,0 +1,141 @@
+"""
+Content-addressed cache for AI generations
+
+Results are keyed by a hash of the full chat completion request (model,
+messages and sampling parameters), so an identical request is answered
+from memory instead of the provider. Entries live in a bounded per-process
+LRU with a TTL and, with AI_CACHE_SHARED, also in the Django cache (Redis
+when CACHE_BACKEND points at it) so workers share them.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+
+KEY_PREFIX = 'aigen'
+STATS = ['hits', 'misses', 'tokens_saved', 'cost_saved_micros']
+
+
+def request_key(request: Dict) -> str:
+    """Stable hash of a chat completion request (keys starting with _ are bookkeeping, not hashed)"""
+    request = {k: v for k, v in request.items() if not k.startswith('_')}
+    payload = json.dumps(request, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def input_fingerprint(request: Dict, *scope) -> str:
+    """
+    Hash of what a generation's content depends on, stored with the saved row
+
+    That is the model and the rendered messages, which carry the usage
+    numbers, the participants and whatever prompt templates were in force,
+    plus the target and date in `scope`. Sampling parameters (including the
+    adaptive max_tokens) are left out, so they don't invalidate a result.
+    """
+    return request_key({
+        'model': request.get('model'),
+        'messages': request.get('messages'),
+        'scope': [str(part) for part in scope],
+    })
+
+
+class GenerationCache:
+    """LRU + TTL store of generation results, optionally backed by the shared cache"""
+
+    def __init__(self, max_entries: int, ttl: int, shared: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+
+        if self.shared:
+            result = shared_cache.get(f"{KEY_PREFIX}:{key}")
+            if result:
+                self._store_local(key, result)
+                return result
+        return None
+
+    def set(self, key: str, result: Dict):
+        self._store_local(key, result)
+        if self.shared:
+            shared_cache.set(f"{KEY_PREFIX}:{key}", result, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store_local(self, key: str, result: Dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+generation_cache = GenerationCache(
+    max_entries=settings.AI_CACHE_MAX_ENTRIES,
+    ttl=settings.AI_CACHE_TTL,
+    shared=settings.AI_CACHE_SHARED
+)
+
+
+def _increment(stat: str, amount: int = 1):
+    key = f"{KEY_PREFIX}:stats:{stat}"
+    shared_cache.add(key, 0, None)
+    try:
+        shared_cache.incr(key, amount)
+    except ValueError:
+        shared_cache.set(key, amount, None)
+
+
+def get_cached(request: Dict):
+    """
+    Return (key, result) for a request; result is None on a miss
+
+    Hits come back marked cached, with no tokens or cost spent.
+    """
+    key = request_key(request)
+    result = generation_cache.get(key)
+    if result is None:
+        _increment('misses')
+        return key, None
+
+    _increment('hits')
+    _increment('tokens_saved', result.get('tokens_used', 0))
+    _increment('cost_saved_micros', int(result.get('cost', 0) * 1_000_000))
+    return key, {**result, 'tokens_used': 0, 'cost': 0.0, 'cached': True}
+
+
+def store(key: str, result: Dict):
+    """Cache a successful generation result"""
+    if result.get('success'):
+        generation_cache.set(key, result)
+
+
+def get_stats() -> Dict:
+    values = shared_cache.get_many([f"{KEY_PREFIX}:stats:{stat}" for stat in STATS])
+    stats = {stat: values.get(f"{KEY_PREFIX}:stats:{stat}", 0) for stat in STATS}
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_rate': round(stats['hits'] / lookups, 3) if lookups else 0.0,
+        'tokens_saved': stats['tokens_saved'],
+        'cost_saved': stats['cost_saved_micros'] / 1_000_000,
+        'local_entries': len(generation_cache._entries),
+    }
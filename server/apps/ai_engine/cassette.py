@@ -0,0 +1,94 @@
+"""
+Record / replay of AI provider responses
+
+With AI_CASSETTE_MODE=record every completion is appended to the JSONL
+cassette at AI_CASSETTE_PATH, keyed by the request hash. With replay the
+provider is never called: requests are answered from the cassette and a
+request that was not recorded fails with CassetteMiss. Replayed runs are
+reproducible and need no network, for benchmarks and CI.
+"""
+import json
+import os
+import threading
+from typing import Dict, Optional
+from django.conf import settings
+from apps.ai_engine.cache import request_key
+
+# Request fields that don't change the completion
+TRANSPORT_FIELDS = ('stream', 'stream_options')
+
+
+class CassetteMiss(Exception):
+    """A replayed request has no recorded response"""
+
+
+def cassette_key(request: Dict) -> str:
+    """Request hash shared by the streamed and non-streamed forms of a request"""
+    return request_key({k: v for k, v in request.items() if k not in TRANSPORT_FIELDS})
+
+
+class Cassette:
+    """Recorded completions in a JSONL file, loaded on first use"""
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self._responses = None
+        self._lock = threading.Lock()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._responses is None:
+            responses = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as cassette_file:
+                    for line in cassette_file:
+                        if line.strip():
+                            entry = json.loads(line)
+                            responses[entry['key']] = entry['response']
+            self._responses = responses
+        return self._responses
+
+    def replay(self, request: Dict):
+        """The recorded response as a ChatCompletion"""
+        from openai.types.chat import ChatCompletion
+        key = cassette_key(request)
+        with self._lock:
+            response = self._load().get(key)
+        if response is None:
+            raise CassetteMiss(f"No recorded response for {request.get('model')} request {key[:12]}")
+        return ChatCompletion.model_validate(response)
+
+    def record(self, request: Dict, response):
+        """Append a response (a ChatCompletion or its dict form)"""
+        if hasattr(response, 'model_dump'):
+            response = response.model_dump(mode='json', exclude_unset=True)
+        key = cassette_key(request)
+        with self._lock:
+            self._load()[key] = response
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as cassette_file:
+                cassette_file.write(json.dumps({'key': key, 'model': request.get('model'), 'response': response}) + '\n')
+
+
+_cassette = None
+
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette, or None when AI_CASSETTE_MODE is off"""
+    global _cassette
+    mode = settings.AI_CASSETTE_MODE
+    if mode not in ('record', 'replay'):
+        return None
+    if _cassette is None or (_cassette.path, _cassette.mode) != (settings.AI_CASSETTE_PATH, mode):
+        _cassette = Cassette(settings.AI_CASSETTE_PATH, mode)
+    return _cassette
@@ -0,0 +1,90 @@
+"""
+Process-wide AI provider client
+
+The OpenAI client (and the openai package itself) is only loaded on first
+use, then shared by every call in the process over one keep-alive
+connection pool sized and timed by the AI_HTTP_* settings, with HTTP/2
+when the h2 package is installed. Prefork children (Celery, gunicorn)
+drop the inherited client and build their own, since pooled sockets must
+not be shared across processes.
+
+Async clients are tied to the event loop they run on, so
+new_async_client() builds one per loop with the same pool settings.
+"""
+import importlib.util
+import os
+import threading
+from django.conf import settings
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError:
+        # Newer openai releases are built on httpx2, which keeps the httpx API
+        import httpx2 as httpx
+    return httpx
+
+
+def _pool_options():
+    httpx = _httpx()
+    return {
+        'limits': httpx.Limits(
+            max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY
+        ),
+        'timeout': httpx.Timeout(
+            settings.AI_HTTP_READ_TIMEOUT,
+            connect=settings.AI_HTTP_CONNECT_TIMEOUT
+        ),
+        'http2': settings.AI_HTTP2 and importlib.util.find_spec('h2') is not None,
+    }
+
+
+def get_client():
+    """The shared synchronous client, created on first use in each process"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                from openai import OpenAI, DefaultHttpxClient
+                _client = OpenAI(
+                    api_key=settings.AI_API_KEY,
+                    base_url=settings.AI_BASE_URL,  # DeepSeek uses custom base URL
+                    http_client=DefaultHttpxClient(**_pool_options())
+                )
+                _client_pid = pid
+    return _client
+
+
+def new_async_client():
+    """A new async client with the shared pool settings (close it when done)"""
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(
+        api_key=settings.AI_API_KEY,
+        base_url=settings.AI_BASE_URL,
+        http_client=DefaultAsyncHttpxClient(**_pool_options())
+    )
+
+
+def reset_client():
+    """
+    Forget the shared client without closing it
+
+    Used in forked children: closing would shut down sockets the parent
+    still uses.
+    """
+    global _client, _client_pid, _lock
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_client)
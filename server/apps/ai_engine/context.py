@@ -0,0 +1,292 @@
+"""
+Bulk loading of generation contexts
+
+Each loader takes a batch of users, devices or apps and gathers everything
+their prompts need in a fixed number of queries, however large the batch:
+devices, daily leaderboards (the top apps, with their App and AppCategory),
+usage totals, patterns, relationships and anomalies are each read once for
+the whole batch and grouped in memory. The contexts are small __slots__
+objects carrying the built request plus what saving the result needs,
+including the fingerprint of the request's inputs (see
+ai_engine.cache.input_fingerprint) that lets unchanged targets be skipped.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional
+from django.db.models import Sum
+from apps.ai_engine.cache import input_fingerprint
+from apps.ai_engine.services import AIGenerationService
+from apps.applications.models import AppRelationship, DeviceApp
+from apps.conversations.models import ConversationTrigger
+from apps.devices.models import Device
+from apps.usage.models import AppLeaderboard, AppUsage, UsageAnomaly, UsageData, UsagePattern
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+MAX_DEVICES = 3  # Devices per conversation
+MAX_APPS = 5  # Top apps per conversation
+MAX_JOURNAL_APPS = 3  # Top apps mentioned in a device journal
+
+
+class ConversationContext:
+    """What a user's conversation is generated from and saved with"""
+    __slots__ = ('user', 'date', 'devices', 'device_apps', 'usage_data', 'conversation_type', 'mood',
+                 'triggers', 'anomalies', 'request', 'fingerprint', 'conversation')
+
+    def __init__(self, user, date, devices, device_apps, conversation_type, mood,
+                 triggers=(), anomalies=(), usage_data=None, request=None, fingerprint=''):
+        self.user = user
+        self.date = date
+        self.devices = devices
+        self.device_apps = device_apps
+        self.usage_data = usage_data
+        self.conversation_type = conversation_type
+        self.mood = mood
+        self.triggers = list(triggers)
+        self.anomalies = list(anomalies)
+        self.request = request
+        self.fingerprint = fingerprint
+        self.conversation = None
+
+
+class DeviceJournalContext:
+    """What a device journal is generated from and saved with"""
+    __slots__ = ('device', 'date', 'request', 'fingerprint')
+
+    def __init__(self, device, date, request=None, fingerprint=''):
+        self.device = device
+        self.date = date
+        self.request = request
+        self.fingerprint = fingerprint
+
+
+class AppJournalContext:
+    """What an app journal is generated from and saved with"""
+    __slots__ = ('device_app', 'date', 'usage_stats', 'session_highlights', 'request', 'fingerprint')
+
+    def __init__(self, device_app, date, usage_stats=None, session_highlights=(), request=None, fingerprint=''):
+        self.device_app = device_app
+        self.date = date
+        self.usage_stats = usage_stats
+        self.session_highlights = list(session_highlights)
+        self.request = request
+        self.fingerprint = fingerprint
+
+
+def _daily_boards(user_ids, date) -> Dict:
+    """{user_id: ranked [device_app_id, device_id, minutes] entries} for a day"""
+    return dict(AppLeaderboard.objects.filter(
+        user_id__in=user_ids, window='daily', date=date
+    ).values_list('user_id', 'entries'))
+
+
+def _device_apps(ids) -> Dict:
+    return DeviceApp.objects.select_related('app', 'app__category', 'device').in_bulk(ids)
+
+
+def _conversation_style(usage_data, anomalies, conversation_type, mood):
+    """The conversation type and mood, picked from the day's usage unless given"""
+    if conversation_type is None:
+        conversation_type = 'daily_recap'
+        mood = mood or 'humorous'
+
+        # Adjust based on usage
+        if anomalies or usage_data['total_screen_time'] > 360:  # Unusual day or more than 6 hours
+            conversation_type = 'usage_intervention'
+            mood = 'concerned'
+        elif usage_data['patterns']:
+            conversation_type = 'pattern_discussion'
+    return conversation_type, mood or 'humorous'
+
+
+def load_conversation_contexts(users, date, conversation_type: Optional[str] = None,
+                               mood: Optional[str] = None) -> List[ConversationContext]:
+    """
+    Conversation contexts for a batch of users in at most eight queries
+
+    Users without active devices or app usage on the date are left out.
+    """
+    users = list(users)
+    user_ids = [user.id for user in users]
+
+    devices_by_user = defaultdict(list)
+    for device in Device.objects.filter(user_id__in=user_ids, is_active=True):
+        if len(devices_by_user[device.user_id]) < MAX_DEVICES:
+            devices_by_user[device.user_id].append(device)
+
+    top_entries = {
+        user_id: entries[:MAX_APPS] for user_id, entries in _daily_boards(user_ids, date).items()
+    }
+    device_apps = _device_apps([entry[0] for entries in top_entries.values() for entry in entries])
+
+    totals = {
+        row['device__user_id']: row
+        for row in UsageData.objects.filter(device__user_id__in=user_ids, date=date).values(
+            'device__user_id'
+        ).annotate(total_time=Sum('total_screen_time'), total_unlocks=Sum('unlock_count'))
+    }
+
+    # Co-usage relationships between the participating apps
+    relationships_by_app = defaultdict(list)
+    for relationship in AppRelationship.objects.filter(
+        app_a__in=list(device_apps), app_b__in=list(device_apps)
+    ).select_related('app_a__app', 'app_b__app').order_by('-co_usage_frequency'):
+        relationships_by_app[relationship.app_a_id].append(relationship)
+
+    patterns = defaultdict(list)
+    for user_id, pattern_type in UsagePattern.objects.filter(
+        user_id__in=user_ids, start_date=date
+    ).values_list('user_id', 'pattern_type'):
+        patterns[user_id].append(pattern_type)
+
+    # Anomalies flagged at ingestion that no conversation has covered yet
+    anomalies = defaultdict(list)
+    for anomaly in UsageAnomaly.objects.filter(
+        user_id__in=user_ids, date=date, conversation__isnull=True
+    ).select_related('device', 'device_app__app'):
+        anomalies[anomaly.user_id].append(anomaly)
+    triggers = list(ConversationTrigger.objects.filter(
+        trigger_type='usage_threshold', is_active=True
+    )) if anomalies else []
+
+    contexts = []
+    for user in users:
+        devices = devices_by_user.get(user.id)
+        if not devices:
+            logger.info(f"No active devices for user {user.id}")
+            continue
+        user_apps = []
+        for device_app_id, _, minutes in top_entries.get(user.id, []):
+            device_app = device_apps.get(device_app_id)
+            if device_app:
+                device_app.minutes = minutes
+                user_apps.append(device_app)
+        if not user_apps:
+            logger.info(f"No app usage for user {user.id} on {date}")
+            continue
+
+        try:
+            total = totals.get(user.id, {})
+            app_ids = {device_app.id for device_app in user_apps}
+            usage_data = {
+                'total_screen_time': total.get('total_time') or 0,
+                'unlock_count': total.get('total_unlocks') or 0,
+                'top_apps': [app.display_name for app in user_apps],
+                'patterns': patterns.get(user.id, []),
+                'relationships': [
+                    f"{r.app_a.display_name} & {r.app_b.display_name}: {r.get_relationship_type_display()}"
+                    f" (used together {r.co_usage_frequency:.0%} of the time)"
+                    for r in sorted(
+                        (r for app_id in app_ids for r in relationships_by_app.get(app_id, []) if r.app_b_id in app_ids),
+                        key=lambda r: -r.co_usage_frequency
+                    )
+                ],
+            }
+            user_anomalies = anomalies.get(user.id, [])
+            if user_anomalies:
+                usage_data['notes'] = '; '.join(a.description for a in user_anomalies)
+
+            user_type, user_mood = _conversation_style(usage_data, user_anomalies, conversation_type, mood)
+            user_triggers = triggers if user_anomalies else []
+            request = AIGenerationService.build_conversation_request(
+                devices, user_apps, usage_data, user_type, user_mood, user_triggers
+            )
+            contexts.append(ConversationContext(
+                user, date, devices, user_apps, user_type, user_mood,
+                triggers=user_triggers,
+                anomalies=user_anomalies,
+                usage_data=usage_data,
+                request=request,
+                fingerprint=input_fingerprint(request, user.id, date),
+            ))
+        except Exception as e:
+            logger.error(f"Error preparing conversation for user {user.id}: {str(e)}")
+    return contexts
+
+
+def load_device_journal_contexts(devices, date) -> List[DeviceJournalContext]:
+    """Device journal contexts for devices with usage on a date, in three queries"""
+    devices = list(devices)
+    usage_by_device = {
+        usage.device_id: usage
+        for usage in UsageData.objects.filter(device__in=devices, date=date)
+    }
+
+    # Each device's top apps come from its user's daily board
+    boards = _daily_boards({device.user_id for device in devices}, date)
+    top_entries = {}
+    for device in devices:
+        entries = [entry for entry in boards.get(device.user_id, []) if str(entry[1]) == str(device.id)]
+        top_entries[device.id] = entries[:MAX_JOURNAL_APPS]
+    device_apps = _device_apps([entry[0] for entries in top_entries.values() for entry in entries])
+
+    contexts = []
+    for device in devices:
+        usage = usage_by_device.get(device.id)
+        if not usage:
+            continue
+        try:
+            usage_summary = {
+                'screen_time': usage.total_screen_time,
+                'unlocks': usage.unlock_count
+            }
+
+            # Notable events
+            notable_events = []
+            if usage.unlock_count > 100:
+                notable_events.append("Very active day with lots of unlocks")
+            if usage.total_screen_time > 360:
+                notable_events.append("Heavy usage day")
+
+            top_apps = [device_apps[entry[0]] for entry in top_entries[device.id] if entry[0] in device_apps]
+            request = AIGenerationService.build_device_journal_request(
+                device, date, usage_summary, notable_events, top_apps
+            )
+            contexts.append(DeviceJournalContext(
+                device, date, request=request, fingerprint=input_fingerprint(request, device.id, date)
+            ))
+        except Exception as e:
+            logger.error(f"Error preparing device journal for {device.id}: {str(e)}")
+    return contexts
+
+
+def load_app_journal_contexts(device_apps, date) -> List[AppJournalContext]:
+    """
+    App journal contexts for apps with usage on a date, in one query
+
+    The device apps should come with their App (select_related('app')).
+    """
+    device_apps = list(device_apps)
+    usage_by_app = {
+        usage.device_app_id: usage
+        for usage in AppUsage.objects.filter(device_app__in=device_apps, date=date)
+    }
+
+    contexts = []
+    for device_app in device_apps:
+        app_usage = usage_by_app.get(device_app.id)
+        if not app_usage:
+            continue
+        try:
+            usage_stats = {
+                'time_spent': app_usage.time_spent_minutes,
+                'launch_count': app_usage.launch_count
+            }
+
+            session_highlights = []
+            if app_usage.time_spent_minutes > 120:
+                session_highlights.append("Power user session")
+            if app_usage.launch_count > 20:
+                session_highlights.append("Frequently opened")
+
+            request = AIGenerationService.build_app_journal_request(
+                device_app, date, usage_stats, session_highlights
+            )
+            contexts.append(AppJournalContext(
+                device_app, date, usage_stats, session_highlights,
+                request=request,
+                fingerprint=input_fingerprint(request, device_app.id, date),
+            ))
+        except Exception as e:
+            logger.error(f"Error preparing app journal for {device_app.id}: {str(e)}")
+    return contexts
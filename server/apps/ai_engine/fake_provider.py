@@ -0,0 +1,287 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API
+
+Answers POST .../chat/completions with generated text after a sampled
+latency, so the generation pipeline can be load-tested without a network
+or a provider bill. Latency (fixed, normal or lognormal), completion
+length, random 429s and 500s, RPM/TPM limits with x-ratelimit-* headers
+and streaming are configurable; with a seed the responses and latencies
+are reproducible. JSON-mode requests for packed app journals get one
+journal per numbered app. Like DeepSeek's context cache, prompt prefixes
+seen before are reported as cached tokens in 64-token units. GET /stats
+returns request counters.
+
+Run it with `python manage.py fake_ai_provider`, or in-process (e.g. in CI)
+with start_fake_provider().
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict
+from apps.ai_engine.services import AIGenerationService
+
+CHARS_PER_TOKEN = 4
+PREFIX_CACHE_BLOCK = 64  # Tokens per cached prefix unit
+PREFIX_CACHE_MAX_ENTRIES = 100000
+WORDS = (
+    'scroll notification battery screen charger swipe unlock midnight feed '
+    'streak inbox playlist selfie reminder update wallpaper ringtone signal'
+).split()
+
+
+class FakeProvider:
+    """Response generation and accounting shared by the request handlers"""
+
+    def __init__(self, latency='lognormal', latency_mean=0.8, latency_sigma=0.4, completion_tokens=300,
+                 token_rate=60.0, rate_limit_rate=0.0, error_rate=0.0, rpm=0, tpm=0, seed=None,
+                 prefix_cache=True):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.completion_tokens = completion_tokens
+        self.token_rate = token_rate  # Streamed tokens per second
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.prefix_cache = prefix_cache
+        self._prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window = {'requests': 0, 'tokens': 0}
+        self.stats = {'requests': 0, 'completed': 0, 'streamed': 0, 'rate_limited': 0, 'errors': 0,
+                      'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'completion_tokens': 0}
+
+    def rng(self) -> random.Random:
+        """A per-request generator drawn from the seeded one"""
+        with self._lock:
+            return random.Random(self._random.random())
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Time to first token, in seconds"""
+        if self.latency == 'fixed':
+            return self.latency_mean
+        if self.latency == 'normal':
+            return max(0.0, rng.gauss(self.latency_mean, self.latency_sigma))
+        # Lognormal with the configured mean: long right tail like real providers
+        mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+        return rng.lognormvariate(mu, self.latency_sigma)
+
+    def admit(self, rng: random.Random, tokens: int):
+        """
+        Account for a request; returns (status, headers) where status is None
+        when the request may proceed, or 429 / 500
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            now = time.time()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window = {'requests': 0, 'tokens': 0}
+            reset = 60 - (now - self._window_start)
+
+            headers = {}
+            if self.rpm:
+                headers['x-ratelimit-limit-requests'] = str(self.rpm)
+                headers['x-ratelimit-remaining-requests'] = str(max(0, self.rpm - self._window['requests'] - 1))
+                headers['x-ratelimit-reset-requests'] = f"{reset:.1f}s"
+            if self.tpm:
+                headers['x-ratelimit-limit-tokens'] = str(self.tpm)
+                headers['x-ratelimit-remaining-tokens'] = str(max(0, self.tpm - self._window['tokens'] - tokens))
+                headers['x-ratelimit-reset-tokens'] = f"{reset:.1f}s"
+
+            over_limit = (self.rpm and self._window['requests'] >= self.rpm) or \
+                (self.tpm and self._window['tokens'] + tokens > self.tpm)
+            if over_limit or rng.random() < self.rate_limit_rate:
+                self.stats['rate_limited'] += 1
+                headers['retry-after'] = f"{reset:.1f}" if over_limit else '1'
+                return 429, headers
+            if rng.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, headers
+
+            self._window['requests'] += 1
+            self._window['tokens'] += tokens
+            return None, headers
+
+    def cached_tokens(self, body: Dict, prompt_tokens: int) -> int:
+        """Prompt tokens covered by prefixes of earlier prompts, in whole blocks"""
+        if not self.prefix_cache:
+            return 0
+        prompt = ''.join(f"{m.get('role')}:{m.get('content') or ''}" for m in body.get('messages', []))
+        block = PREFIX_CACHE_BLOCK * CHARS_PER_TOKEN
+        prefixes = [hash(prompt[:end]) for end in range(block, len(prompt) + 1, block)]
+        with self._lock:
+            hits = 0
+            for prefix in prefixes:
+                if prefix not in self._prefixes:
+                    break
+                hits += 1
+            if len(self._prefixes) > PREFIX_CACHE_MAX_ENTRIES:
+                self._prefixes.clear()
+            self._prefixes.update(prefixes)
+        return min(prompt_tokens, hits * PREFIX_CACHE_BLOCK)
+
+    def completion_length(self, rng: random.Random, max_tokens) -> int:
+        tokens = int(rng.gauss(self.completion_tokens, self.completion_tokens / 4))
+        return max(1, min(tokens, max_tokens or tokens))
+
+    def content(self, rng: random.Random, body: Dict, tokens: int) -> str:
+        """Text of about `tokens` tokens, shaped like the pipeline expects"""
+        def words(count):
+            return ' '.join(rng.choice(WORDS) for _ in range(max(1, count)))
+
+        prompt = (body.get('messages') or [{}])[-1].get('content') or ''
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            ids = [int(i) for i in re.findall(r'^\[(\d+)\]', prompt, re.MULTILINE)] or [1]
+            return json.dumps({'journals': [
+                {'id': i, 'mood': rng.choice(AIGenerationService.APP_JOURNAL_MOODS), 'content': words(tokens // len(ids))}
+                for i in ids
+            ]})
+        return words(tokens)
+
+    def record(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int, streamed: bool):
+        with self._lock:
+            self.stats['completed'] += 1
+            self.stats['streamed'] += int(streamed)
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['cached_prompt_tokens'] += cached_tokens
+            self.stats['completion_tokens'] += completion_tokens
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+    provider = None  # Set on the subclass built by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, dict(self.provider.stats))
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        provider = self.provider
+        rng = provider.rng()
+        prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages', [])) // CHARS_PER_TOKEN
+        completion_tokens = provider.completion_length(rng, body.get('max_tokens'))
+        finish_reason = 'length' if completion_tokens == body.get('max_tokens') else 'stop'
+
+        status, headers = provider.admit(rng, prompt_tokens + completion_tokens)
+        if status == 429:
+            self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}}, headers)
+            return
+        if status == 500:
+            time.sleep(provider.sample_latency(rng) / 2)
+            self._send_json(500, {'error': {'message': 'Simulated provider error', 'type': 'server_error'}}, headers)
+            return
+
+        content = provider.content(rng, body, completion_tokens)
+        cached_tokens = provider.cached_tokens(body, prompt_tokens)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        created = int(time.time())
+        time.sleep(provider.sample_latency(rng))
+
+        if body.get('stream'):
+            self._stream(body, content, usage, created, headers, finish_reason)
+        else:
+            time.sleep(completion_tokens / provider.token_rate if provider.token_rate else 0)
+            self._send_json(200, {
+                'id': f"chatcmpl-fake-{rng.getrandbits(48):x}",
+                'object': 'chat.completion',
+                'created': created,
+                'model': body.get('model', 'fake'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': finish_reason,
+                }],
+                'usage': usage,
+            }, headers)
+        provider.record(prompt_tokens, cached_tokens, completion_tokens, bool(body.get('stream')))
+
+    def _stream(self, body, content, usage, created, headers, finish_reason='stop'):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def send(data):
+            payload = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+            self.wfile.flush()
+
+        def chunk(delta=None, finish_reason=None, with_usage=False):
+            return json.dumps({
+                'id': 'chatcmpl-fake-stream',
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': body.get('model', 'fake'),
+                'choices': [] if with_usage else [
+                    {'index': 0, 'delta': delta or {}, 'finish_reason': finish_reason}
+                ],
+                'usage': usage if with_usage else None,
+            })
+
+        pieces = re.findall(r'\S+\s*', content) or [content]
+        interval = usage['completion_tokens'] / self.provider.token_rate / len(pieces) if self.provider.token_rate else 0
+        send(chunk({'role': 'assistant', 'content': ''}))
+        for piece in pieces:
+            send(chunk({'content': piece}))
+            time.sleep(interval)
+        send(chunk(finish_reason=finish_reason))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            send(chunk(with_usage=True))
+        send('[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status, data, headers=None):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def make_server(host='127.0.0.1', port=8900, **options) -> ThreadingHTTPServer:
+    """Build (but don't start) a fake provider server; options go to FakeProvider"""
+    handler = type('Handler', (FakeProviderHandler,), {'provider': FakeProvider(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_fake_provider(host='127.0.0.1', port=0, **options):
+    """
+    Serve a fake provider from a background thread
+
+    Returns (server, base_url); port 0 picks a free port. Call
+    server.shutdown() when done.
+    """
+    server = make_server(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
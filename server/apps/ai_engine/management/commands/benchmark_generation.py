@@ -0,0 +1,95 @@
+"""
+Django management command to benchmark the nightly AI generation pipeline.
+
+Runs generate_daily_conversations and/or generate_daily_journals against the
+configured provider, an in-process fake provider (--fake) or a cassette
+(AI_CASSETTE_MODE=replay), and reports throughput and database cost.
+
+Usage:
+    python manage.py benchmark_generation --fake
+    python manage.py benchmark_generation --fake --kind journals --concurrency 32 --latency-mean 1.5 --seed 1
+    AI_CASSETTE_MODE=replay python manage.py benchmark_generation
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from apps.ai_engine.fake_provider import start_fake_provider
+from apps.ai_engine.tasks import generate_daily_conversations, generate_daily_journals
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark nightly conversation and journal generation end to end'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['conversations', 'journals', 'all'], default='all')
+        parser.add_argument('--concurrency', type=int, default=None, help='Override AI_MAX_CONCURRENCY')
+        parser.add_argument('--no-cache', action='store_true', help='Disable the generation cache')
+        parser.add_argument('--force', action='store_true', help='Regenerate targets whose inputs are unchanged')
+        parser.add_argument('--fake', action='store_true', help='Run against an in-process fake provider')
+        parser.add_argument('--latency-mean', type=float, default=0.8, help='Fake provider mean latency (seconds)')
+        parser.add_argument('--completion-tokens', type=int, default=300, help='Fake provider mean completion length')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of fake 429 responses')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for the fake provider')
+
+    def handle(self, *args, **options):
+        overrides = {'AI_BATCH_MODE': False}
+        if options['concurrency']:
+            overrides['AI_MAX_CONCURRENCY'] = options['concurrency']
+        if options['no_cache']:
+            overrides['AI_CACHE_ENABLED'] = False
+
+        server = None
+        if options['fake']:
+            server, base_url = start_fake_provider(
+                latency_mean=options['latency_mean'],
+                completion_tokens=options['completion_tokens'],
+                token_rate=0,
+                rate_limit_rate=options['rate_limit_rate'],
+                seed=options['seed'],
+            )
+            overrides['AI_BASE_URL'] = base_url
+            self.stdout.write(f'Fake provider at {base_url}')
+
+        tasks = []
+        if options['kind'] in ('conversations', 'all'):
+            tasks.append(('conversations', generate_daily_conversations))
+        if options['kind'] in ('journals', 'all'):
+            tasks.append(('journals', generate_daily_journals))
+
+        try:
+            with override_settings(**overrides):
+                for name, task in tasks:
+                    self.run(name, task, options['force'])
+        finally:
+            if server:
+                stats = server.RequestHandlerClass.provider.stats
+                self.stdout.write(f'Provider stats: {stats}')
+                if stats['prompt_tokens']:
+                    self.stdout.write(
+                        f"Prompt cache hits: {stats['cached_prompt_tokens'] / stats['prompt_tokens']:.0%} of prompt tokens"
+                    )
+                server.shutdown()
+                server.server_close()
+
+    def run(self, name, task, force=False):
+        self.stdout.write(self.style.WARNING(f'\nGenerating {name}...'))
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            result = task(force=force)
+            elapsed = time.perf_counter() - started
+
+        writes = [q for q in queries.captured_queries if q['sql'].lstrip().upper().startswith(WRITE_PREFIXES)]
+        db_time = sum(float(q['time']) for q in queries.captured_queries)
+        write_time = sum(float(q['time']) for q in writes)
+        total = result.get('success', 0) + result.get('errors', 0)
+
+        self.stdout.write(self.style.SUCCESS(f'  {result}'))
+        self.stdout.write(f'  Wall time: {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f} items/s)')
+        self.stdout.write(
+            f'  Queries: {len(queries)} in {db_time:.3f}s '
+            f'({len(writes)} writes in {write_time:.3f}s)'
+        )
@@ -0,0 +1,60 @@
+"""
+Django management command to run a local fake OpenAI-compatible provider.
+
+Usage:
+    python manage.py fake_ai_provider
+    python manage.py fake_ai_provider --port 8900 --latency lognormal --latency-mean 1.2 --rpm 500 --seed 1
+
+Then point AI_BASE_URL at http://127.0.0.1:<port>/v1 (any AI_API_KEY works).
+"""
+
+from django.core.management.base import BaseCommand
+from apps.ai_engine.fake_provider import make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake OpenAI-compatible chat completions server for development and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', choices=['fixed', 'normal', 'lognormal'], default='lognormal',
+                            help='Distribution of the time to first token')
+        parser.add_argument('--latency-mean', type=float, default=0.8, help='Mean time to first token (seconds)')
+        parser.add_argument('--latency-sigma', type=float, default=0.4,
+                            help='Standard deviation (normal) or log-space sigma (lognormal)')
+        parser.add_argument('--completion-tokens', type=int, default=300, help='Mean completion length')
+        parser.add_argument('--token-rate', type=float, default=60.0,
+                            help='Generated tokens per second after the first (0 for instant)')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+        parser.add_argument('--rpm', type=int, default=0, help='Requests per minute limit (0 for none)')
+        parser.add_argument('--tpm', type=int, default=0, help='Tokens per minute limit (0 for none)')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible responses')
+        parser.add_argument('--no-prefix-cache', action='store_true', help="Don't report cached prompt tokens")
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options['host'],
+            options['port'],
+            latency=options['latency'],
+            latency_mean=options['latency_mean'],
+            latency_sigma=options['latency_sigma'],
+            completion_tokens=options['completion_tokens'],
+            token_rate=options['token_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            error_rate=options['error_rate'],
+            rpm=options['rpm'],
+            tpm=options['tpm'],
+            seed=options['seed'],
+            prefix_cache=not options['no_prefix_cache'],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f'Fake AI provider listening on http://{host}:{port}/v1'))
+        self.stdout.write(f'Set AI_BASE_URL=http://{host}:{port}/v1; request stats at /v1/stats')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('\nStopped. Stats: %s' % server.RequestHandlerClass.provider.stats))
+        finally:
+            server.server_close()
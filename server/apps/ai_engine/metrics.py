@@ -0,0 +1,308 @@
+"""
+Generation logging and Prometheus metrics
+
+Every AIGenerationService call produces one AIGenerationLog row (model,
+content type, token counts, wall latency, time to first token, retries and
+outcome). Rows are not written on the request path: they are queued in
+memory and a background thread bulk-inserts them every
+AI_LOG_FLUSH_INTERVAL seconds, or as soon as AI_LOG_BATCH_SIZE rows are
+waiting. When the queue is full (the database is down or slow) rows are
+dropped and counted in the shared cache rather than blocking generation.
+The prompt and generated text are kept for failures and for a
+AI_LOG_CONTENT_SAMPLE_RATE share of successes, so the table doesn't grow
+with the full text of every call.
+
+render_prometheus() summarises the last AI_METRICS_WINDOW seconds of rows
+per model and content type in the Prometheus text exposition format, from
+one aggregate query: throughput, tokens, retries, cost and latency and
+time-to-first-token quantiles. The quantiles are estimated from bucket
+counts the way histogram_quantile() does. Everything windowed is a gauge;
+only the dropped-row count is a counter.
+"""
+import atexit
+import os
+import queue
+import random
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Upper bounds (seconds) of the buckets latency quantiles are estimated from
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+DROPPED_KEY = 'ai:genlog:dropped'
+
+
+class GenerationLogWriter:
+    """Buffers AIGenerationLog rows and bulk-inserts them from a daemon thread"""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._reported_dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, row: Dict):
+        """Queue one row (AIGenerationLog field values); never blocks"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Write every queued row now; returns the number written"""
+        from apps.ai_engine.models import AIGenerationLog
+        self._report_dropped()
+        with self._flush_lock:
+            rows = []
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not rows:
+                return 0
+            try:
+                close_old_connections()
+                AIGenerationLog.objects.bulk_create(
+                    [AIGenerationLog(**row) for row in rows], batch_size=self.batch_size
+                )
+            except Exception as e:
+                self.dropped += len(rows)
+                logger.error(f"Error writing {len(rows)} generation log rows: {str(e)}")
+                return 0
+            self.written += len(rows)
+            return len(rows)
+
+    def _report_dropped(self):
+        """Add the rows dropped since the last report to the count shared by every process"""
+        dropped = self.dropped - self._reported_dropped
+        if not dropped:
+            return
+        try:
+            if not cache.add(DROPPED_KEY, dropped, None):
+                try:
+                    cache.incr(DROPPED_KEY, dropped)
+                except ValueError:  # Evicted between add and incr
+                    cache.add(DROPPED_KEY, dropped, None)
+        except Exception as e:
+            logger.error(f"Error counting dropped generation log rows: {str(e)}")
+            return
+        self._reported_dropped += dropped
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._flush_lock:
+            if self._pid != pid:
+                if self._pid is not None:
+                    # Forked child: rows queued in the parent are the parent's to write
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                    self._wake = threading.Event()
+                    self._reported_dropped = self.dropped
+                self._thread = threading.Thread(target=self._run, name='generation-log-writer', daemon=True)
+                self._thread.start()
+                self._pid = pid
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> GenerationLogWriter:
+    """The process-wide log writer"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = GenerationLogWriter(
+                    settings.AI_LOG_BATCH_SIZE,
+                    settings.AI_LOG_FLUSH_INTERVAL,
+                    settings.AI_LOG_QUEUE_SIZE
+                )
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def record_generation(request: Dict, result: Dict, generation_time: float, outcome: str,
+                      time_to_first_token: Optional[float] = None, retries: int = 0):
+    """Log one generation (request as built by AIGenerationService, result as returned by it)"""
+    if not settings.AI_GENERATION_LOG_ENABLED:
+        return
+    cached = outcome == 'cached'
+    # Cache hits repeat a logged generation; failures are always worth reading
+    keep_content = not cached and (
+        not result.get('success') or random.random() < settings.AI_LOG_CONTENT_SAMPLE_RATE
+    )
+    messages = request.get('messages') or [{}]
+    get_writer().submit({
+        'content_type': request.get('_content_type', ''),
+        'model_used': result.get('model_used') or request.get('model', ''),
+        'prompt_used': (result.get('generation_prompt') or messages[-1].get('content') or '') if keep_content else '',
+        'input_data': {'units': request['_units']} if '_units' in request else {},
+        'generated_content': (result.get('content') or '') if keep_content else '',
+        'generation_time': timedelta(seconds=generation_time),
+        'time_to_first_token': timedelta(seconds=time_to_first_token) if time_to_first_token is not None else None,
+        # Cache hits cost nothing; their tokens were logged with the original generation
+        'tokens_used': 0 if cached else result.get('tokens_used'),
+        'prompt_tokens': None if cached else result.get('prompt_tokens'),
+        'completion_tokens': None if cached else result.get('completion_tokens'),
+        'cached_tokens': None if cached else result.get('cached_tokens'),
+        'retries': retries,
+        'cost': 0 if cached else result.get('cost'),
+        'success': result.get('success', False),
+        'truncated': bool(result.get('truncated')),
+        'outcome': outcome,
+        'error_message': result.get('error', ''),
+    })
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value) -> str:
+    return f"{float(value):.6g}"
+
+
+def _bucket_counts(field: str) -> Dict:
+    """Count aggregates of rows whose `field` is within each latency bucket"""
+    return {
+        f"{field}_le_{i}": Count('pk', filter=Q(**{f"{field}__lte": timedelta(seconds=bound)}))
+        for i, bound in enumerate(LATENCY_BUCKETS)
+    }
+
+
+def _estimate_quantile(q: float, cumulative: List[int], total: int) -> float:
+    """A quantile from cumulative bucket counts, interpolating linearly within the bucket"""
+    rank = q * total
+    lower, below = 0.0, 0
+    for bound, count in zip(LATENCY_BUCKETS, cumulative):
+        if count >= rank:
+            return lower + (bound - lower) * ((rank - below) / (count - below) if count > below else 0.0)
+        lower, below = bound, count
+    return LATENCY_BUCKETS[-1]  # In the +Inf bucket: the highest finite bound is all that is known
+
+
+def render_prometheus(window: Optional[int] = None) -> str:
+    """Prometheus text exposition of the generations logged in the last `window` seconds"""
+    from apps.ai_engine.models import AIGenerationLog
+    window = window or settings.AI_METRICS_WINDOW
+    since = timezone.now() - timedelta(seconds=window)
+    rows = AIGenerationLog.objects.filter(created_at__gte=since).values(
+        'model_used', 'content_type', 'outcome'
+    ).annotate(
+        calls=Count('pk'),
+        completion_tokens_sum=Sum('completion_tokens'),
+        retries_sum=Sum('retries'),
+        cached_tokens_sum=Sum('cached_tokens'),
+        # Only rows from providers that report prompt caching count towards the hit ratio
+        reported_prompt_tokens=Sum('prompt_tokens', filter=Q(cached_tokens__isnull=False)),
+        cost_sum=Sum('cost'),
+        generation_time_sum=Sum('generation_time'),
+        ttft_calls=Count('time_to_first_token'),
+        **_bucket_counts('generation_time'),
+        **_bucket_counts('time_to_first_token'),
+    ).order_by('model_used', 'content_type', 'outcome')
+
+    groups: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        groups.setdefault((row['model_used'], row['content_type']), []).append(row)
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(**labels)} {_number(value)}")
+
+    def total(group, field):
+        return sum(row[field] or 0 for row in group)
+
+    requests, rps, tokens_per_second, latency, latency_mean, calls_within, ttft, retries, cached_tokens, \
+        cache_hit_ratio, cost = [], [], [], [], [], [], [], [], [], [], []
+    for (model, content_type), group in groups.items():
+        labels = {'model': model, 'content_type': content_type}
+        for row in group:
+            requests.append(({**labels, 'outcome': row['outcome']}, row['calls']))
+        rps.append((labels, total(group, 'calls') / window))
+        tokens_per_second.append((labels, total(group, 'completion_tokens_sum') / window))
+        retries.append((labels, total(group, 'retries_sum')))
+        cached_tokens.append((labels, total(group, 'cached_tokens_sum')))
+        if total(group, 'reported_prompt_tokens'):
+            cache_hit_ratio.append((labels, total(group, 'cached_tokens_sum') / total(group, 'reported_prompt_tokens')))
+        cost.append((labels, sum(float(row['cost_sum'] or 0) for row in group)))
+
+        # Cache hits never reach the provider, so they are left out of the latency figures
+        called = [row for row in group if row['outcome'] != 'cached']
+        calls = total(called, 'calls')
+        if not calls:
+            continue
+        latency_mean.append((labels, sum(row['generation_time_sum'].total_seconds() for row in called) / calls))
+        for samples, field, count in (
+            (latency, 'generation_time', calls),
+            (ttft, 'time_to_first_token', total(called, 'ttft_calls')),
+        ):
+            if not count:
+                continue
+            cumulative = [total(called, f"{field}_le_{i}") for i in range(len(LATENCY_BUCKETS))]
+            for q in QUANTILES:
+                samples.append(({**labels, 'quantile': q}, _estimate_quantile(q, cumulative, count)))
+            if field == 'generation_time':
+                for bound, within in zip(LATENCY_BUCKETS, cumulative):
+                    calls_within.append(({**labels, 'le': bound}, within))
+                calls_within.append(({**labels, 'le': '+Inf'}, calls))
+
+    metric('ai_generation_requests', 'gauge', f"Generations in the last {window}s by outcome", requests)
+    metric('ai_generation_throughput_rps', 'gauge', f"Generations per second over the last {window}s", rps)
+    metric('ai_generation_completion_tokens_per_second', 'gauge',
+           f"Completion tokens per second over the last {window}s", tokens_per_second)
+    metric('ai_generation_latency_seconds', 'gauge',
+           f"Estimated quantiles of the wall time of provider calls in the last {window}s, "
+           f"including rate limit waits and retries", latency)
+    metric('ai_generation_latency_mean_seconds', 'gauge',
+           f"Mean wall time of provider calls in the last {window}s", latency_mean)
+    metric('ai_generation_calls_within_seconds', 'gauge',
+           f"Provider calls in the last {window}s that took at most le seconds", calls_within)
+    metric('ai_generation_ttft_seconds', 'gauge',
+           f"Estimated quantiles of the time to first token of streamed calls in the last {window}s", ttft)
+    metric('ai_generation_retries', 'gauge', f"Rate limit retries in the last {window}s", retries)
+    metric('ai_generation_cached_prompt_tokens', 'gauge',
+           f"Prompt tokens served from the provider's prompt cache in the last {window}s", cached_tokens)
+    metric('ai_generation_prompt_cache_hit_ratio', 'gauge',
+           f"Share of prompt tokens served from the provider's prompt cache in the last {window}s", cache_hit_ratio)
+    metric('ai_generation_cost_dollars', 'gauge', f"Estimated cost of generations in the last {window}s", cost)
+    metric('ai_generation_log_dropped_total', 'counter', 'Log rows dropped by all processes', [
+        ({}, cache.get(DROPPED_KEY, 0))
+    ])
+    return '\n'.join(lines) + '\n'
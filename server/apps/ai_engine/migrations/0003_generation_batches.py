@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0002_generation_retries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('conversations', 'Conversations'), ('journals', 'Journals')], max_length=20)),
+                ('date', models.DateField()),
+                ('provider', models.CharField(max_length=20)),
+                ('provider_batch_id', models.CharField(blank=True, max_length=100)),
+                ('items', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('submitted', 'Submitted'), ('ingesting', 'Ingesting'), ('ingested', 'Ingested'), ('failed', 'Failed')], default='submitted', max_length=10)),
+                ('request_count', models.IntegerField(default=0)),
+                ('succeeded_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
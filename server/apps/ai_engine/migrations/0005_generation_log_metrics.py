@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0004_generation_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='cached_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='outcome',
+            field=models.CharField(choices=[('success', 'Success'), ('cached', 'Cached'), ('error', 'Error'), ('rate_limited', 'Rate Limited'), ('circuit_open', 'Circuit Open')], default='success', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='retries',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='time_to_first_token',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='aigenerationlog',
+            name='content_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='aigenerationlog',
+            name='generated_content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='aigenerationlog',
+            name='input_data',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='aigenerationlog',
+            name='prompt_used',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='aigenerationlog',
+            index=models.Index(fields=['created_at'], name='ai_engine_a_created_3fa057_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0005_generation_log_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationbatch',
+            name='ingested_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0006_batch_ingested_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigenerationlog',
+            name='truncated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
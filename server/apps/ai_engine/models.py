@@ -24,22 +24,37 @@ class ConversationPrompt(models.Model):
 
 class AIGenerationLog(models.Model):
     """Log of AI generation requests for debugging and optimization"""
-    content_type = models.CharField(max_length=20)  # 'conversation', 'journal_device', 'journal_app'
-    content_id = models.CharField(max_length=50)  # UUID or ID of generated content
+    OUTCOME_CHOICES = [
+        ('success', 'Success'),
+        ('cached', 'Cached'),
+        ('error', 'Error'),
+        ('rate_limited', 'Rate Limited'),
+        ('circuit_open', 'Circuit Open'),
+    ]
+    
+    content_type = models.CharField(max_length=20)  # 'conversation', 'device_journal', 'app_journal', 'app_journals'
+    content_id = models.CharField(max_length=50, blank=True)  # UUID or ID of generated content
     
     # Request details
     model_used = models.CharField(max_length=50)
-    prompt_used = models.TextField()
-    input_data = models.JSONField()
+    prompt_used = models.TextField(blank=True)
+    input_data = models.JSONField(default=dict, blank=True)
     
     # Response details
-    generated_content = models.TextField()
-    generation_time = models.DurationField()
+    generated_content = models.TextField(blank=True)
+    generation_time = models.DurationField()  # Wall time including rate limit waits and retries
+    time_to_first_token = models.DurationField(null=True, blank=True)
     tokens_used = models.IntegerField(null=True, blank=True)
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    cached_tokens = models.IntegerField(null=True, blank=True)  # Prompt tokens served from the provider's cache
+    retries = models.IntegerField(default=0)
     cost = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     
     # Quality metrics
     success = models.BooleanField(default=True)
+    truncated = models.BooleanField(default=False)  # Stopped by max_tokens (finish_reason 'length')
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, default='success')
     error_message = models.TextField(blank=True)
     user_rating = models.IntegerField(null=True, blank=True)
     
@@ -49,7 +64,158 @@ class AIGenerationLog(models.Model):
         indexes = [
             models.Index(fields=['content_type', 'created_at']),
             models.Index(fields=['model_used', 'success']),
+            models.Index(fields=['created_at']),
         ]
     
     def __str__(self):
         return f"{self.content_type} - {self.model_used} - {self.created_at}"
+
+
+class GenerationRetry(models.Model):
+    """A failed generation waiting to be retried with backoff"""
+    KIND_CHOICES = [
+        ('conversation', 'Conversation'),
+        ('device_journal', 'Device Journal'),
+        ('app_journal', 'App Journal'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    target_id = models.CharField(max_length=50)  # User, Device or DeviceApp ID
+    date = models.DateField()
+    options = models.JSONField(default=dict, blank=True)  # e.g. conversation_type, mood
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'target_id', 'date'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_generation_retry'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.target_id} - {self.date} ({self.status}, {self.attempts} attempts)"
+
+
+class GenerationJob(models.Model):
+    """A manual generation request, run as one Celery task per target"""
+    KIND_CHOICES = [
+        ('conversations', 'Conversations'),
+        ('journals', 'Journals'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='generation_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    date = models.DateField()
+    options = models.JSONField(default=dict, blank=True)  # e.g. conversation_type, mood, force
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # Repeated triggers coalesce onto the job already in progress
+            models.UniqueConstraint(
+                fields=['user', 'kind', 'date'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_generation_job'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} job for {self.user} - {self.date} ({self.status})"
+
+
+class GenerationJobItem(models.Model):
+    """One target of a GenerationJob"""
+    KIND_CHOICES = GenerationRetry.KIND_CHOICES
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('skipped', 'Skipped'),  # Inputs unchanged since the last generation
+        ('failed', 'Failed'),
+    ]
+    
+    job = models.ForeignKey(GenerationJob, on_delete=models.CASCADE, related_name='items')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    target_id = models.CharField(max_length=50)  # User, Device or DeviceApp ID
+    target_name = models.CharField(max_length=200, blank=True)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    error_message = models.TextField(blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.kind} {self.target_id} ({self.status})"
+
+
+class GenerationBatch(models.Model):
+    """A night's generation requests submitted through the provider's batch API"""
+    KIND_CHOICES = [
+        ('conversations', 'Conversations'),
+        ('journals', 'Journals'),
+    ]
+    STATUS_CHOICES = [
+        ('submitted', 'Submitted'),
+        ('ingesting', 'Ingesting'),
+        ('ingested', 'Ingested'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    date = models.DateField()
+    provider = models.CharField(max_length=20)  # 'openai' or 'local'
+    provider_batch_id = models.CharField(max_length=100, blank=True)
+    
+    # custom_id -> what to save each result as (see ai_engine.tasks.ingest_generation_batch)
+    items = models.JSONField(default=dict)
+    # custom_ids whose results are saved, so ingestion never saves an item twice
+    ingested_ids = models.JSONField(default=list, blank=True)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='submitted')
+    request_count = models.IntegerField(default=0)
+    succeeded_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    # When ingestion claimed the batch, renewed after every chunk
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.kind} batch {self.provider_batch_id or self.pk} - {self.date} ({self.status})"
@@ -0,0 +1,262 @@
+"""
+Compiled conversation prompt templates
+
+Prompts come from the database: an active ConversationTemplate per
+conversation_type supplies the system prompt and, optionally, the user
+prompt layout, and active ConversationPrompt rows override the built-in
+fragments by name ('conversation_base', 'type:<conversation_type>',
+'mood:<mood>'). Everything is loaded once per process into a PromptSet whose
+templates are pre-parsed into render functions; system prompts, which only
+depend on the conversation type and mood, are rendered once per pair.
+
+Prompts are laid out for the providers' prefix caches: the system prompt
+holds only what every conversation shares (the rules), participants are
+listed in a fixed order, and the per-request conversation type and mood
+come last in the user prompt, after the usage data. Templates whose system
+prompt uses the type or mood placeholders keep them there instead.
+
+The version of the prompts is read from the database itself: the row
+count and latest updated_at of both models, two aggregate queries.
+Processes compare their PromptSet against it at most every
+AI_PROMPT_VERSION_CHECK_INTERVAL seconds and reload when it changed, so an
+edit made in any process (e.g. the admin) reaches Celery workers within an
+interval, and rendering a prompt never touches the database. Saving or
+deleting either model also drops the saving process's PromptSet at once
+(see ai_engine.signals).
+"""
+import threading
+import time
+from string import Formatter
+from typing import Callable, Dict, Optional
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Max
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+BASE_PROMPT = """You are a creative AI that generates entertaining conversations between personified devices and apps.
+
+Rules:
+1. Each device and app has a distinct personality - stay consistent with their character
+2. Reference actual usage data naturally in dialogue
+3. Make it funny but insightful
+4. Format as a script with character names
+5. Keep it under 500 words
+6. Use the specified mood and conversation type
+
+Character Format Example:
+iPhone: *sighs* So, we need to talk about yesterday...
+Instagram: OMG what happened?!
+"""
+
+CONVERSATION_TYPES = {
+    'daily_recap': 'Create a daily recap where devices discuss the day\'s usage',
+    'usage_intervention': 'Devices express concern about excessive usage',
+    'pattern_discussion': 'Discuss detected usage patterns',
+    'goal_check_in': 'Check in on user\'s digital wellness goals',
+    'app_drama': 'Apps argue about screen time and attention',
+    'device_gossip': 'Devices gossip about the user\'s habits',
+    'productivity_roast': 'Devices roast the user about procrastination',
+    'social_comparison': 'Compare usage with friends',
+    'milestone_celebration': 'Celebrate an achievement or milestone',
+    'friend_visit': 'A friend\'s device visits and interacts',
+    'emergency_meeting': 'Urgent meeting about concerning behavior'
+}
+
+MOOD_DESCRIPTIONS = {
+    'humorous': 'Keep it light and funny',
+    'supportive': 'Be encouraging and positive',
+    'dramatic': 'Amp up the drama and exaggeration',
+    'sarcastic': 'Use witty sarcasm and dry humor',
+    'educational': 'Focus on insights and learning',
+    'gossipy': 'Make it juicy and gossipy',
+    'competitive': 'Turn it into a competition',
+    'concerned': 'Express genuine concern',
+    'celebratory': 'Celebrate successes',
+    'chaotic': 'Make it wild and unpredictable'
+}
+
+DEFAULT_SYSTEM_TEMPLATE = "{base_prompt}"
+DIRECTION_TEMPLATE = "Conversation Type: {conversation_context}\nMood: {mood_description}"
+
+# Placeholders a ConversationTemplate may use
+DIRECTION_FIELDS = {'conversation_type', 'conversation_context', 'mood', 'mood_description'}
+SYSTEM_FIELDS = {'base_prompt'} | DIRECTION_FIELDS
+USER_FIELDS = {
+    'participants', 'usage', 'relationships', 'triggers', 'notes', 'direction',
+    'screen_time_hours', 'unlock_count', 'top_apps', 'patterns',
+}
+
+
+class TemplateError(ValueError):
+    """A template that can't be compiled"""
+
+
+def compile_template(text: str, fields) -> Callable[[Dict], str]:
+    """
+    Pre-parse a str.format-style template into a render function
+
+    Only the given placeholder names are allowed; positional, attribute and
+    index placeholders are rejected.
+    """
+    segments = []
+    try:
+        parsed = list(Formatter().parse(text))
+    except ValueError as e:
+        raise TemplateError(str(e))
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            segments.append((literal, None, None))
+        if field is None:
+            continue
+        if field not in fields:
+            raise TemplateError(f"Unknown placeholder {{{field}}}; allowed: {', '.join(sorted(fields))}")
+        if conversion:
+            raise TemplateError(f"Conversions are not supported in {{{field}!{conversion}}}")
+        segments.append((None, field, spec or ''))
+
+    used = {field for _, field, _ in segments if field is not None}
+    if not used:
+        constant = ''.join(literal for literal, _, _ in segments)
+
+        def render(values: Dict) -> str:
+            return constant
+    else:
+        def render(values: Dict) -> str:
+            return ''.join(
+                literal if field is None else format(values.get(field, ''), spec)
+                for literal, field, spec in segments
+            )
+    render.fields = used
+    return render
+
+
+def _with_direction(render: Callable[[Dict], str]) -> Callable[[Dict], str]:
+    """Append the direction to a user template that has no {direction} placeholder"""
+    def render_with_direction(values: Dict) -> str:
+        text = render(values)
+        return f"{text}\n\n{values['direction']}" if values.get('direction') else text
+    render_with_direction.fields = render.fields | {'direction'}
+    return render_with_direction
+
+
+class PromptSet:
+    """Compiled prompts for one version of the prompt tables"""
+
+    def __init__(self, version, fragments: Dict[str, str], templates: Dict[str, Dict]):
+        self.version = version
+        self.fragments = fragments
+        self.system_templates = {}
+        self.user_templates = {}
+        for conversation_type, template in templates.items():
+            try:
+                self.system_templates[conversation_type] = compile_template(
+                    template['system_prompt'] or DEFAULT_SYSTEM_TEMPLATE, SYSTEM_FIELDS
+                )
+                if template['user_prompt_template'].strip():
+                    render = compile_template(template['user_prompt_template'], USER_FIELDS)
+                    self.user_templates[conversation_type] = render if 'direction' in render.fields \
+                        else _with_direction(render)
+            except TemplateError as e:
+                logger.error(f"Ignoring conversation template {template['name']!r}: {str(e)}")
+                self.system_templates.pop(conversation_type, None)
+                self.user_templates.pop(conversation_type, None)
+        self._default_system = compile_template(DEFAULT_SYSTEM_TEMPLATE, SYSTEM_FIELDS)
+        self._direction = compile_template(DIRECTION_TEMPLATE, DIRECTION_FIELDS)
+        self._system_prompts = {}
+        self._directions = {}
+
+    def _values(self, conversation_type: str, mood: str) -> Dict:
+        return {
+            'base_prompt': self.fragments.get('conversation_base', BASE_PROMPT),
+            'conversation_type': conversation_type,
+            'conversation_context': self.fragments.get(
+                f"type:{conversation_type}",
+                CONVERSATION_TYPES.get(conversation_type, 'Have a general conversation')
+            ),
+            'mood': mood,
+            'mood_description': self.fragments.get(f"mood:{mood}", MOOD_DESCRIPTIONS.get(mood, 'Be entertaining')),
+        }
+
+    def system_prompt(self, conversation_type: str, mood: str) -> str:
+        key = (conversation_type, mood)
+        prompt = self._system_prompts.get(key)
+        if prompt is None:
+            render = self.system_templates.get(conversation_type, self._default_system)
+            prompt = render(self._values(conversation_type, mood))
+            self._system_prompts[key] = prompt
+        return prompt
+
+    def direction(self, conversation_type: str, mood: str) -> str:
+        """The conversation type and mood for the end of the user prompt; empty when the system prompt has them"""
+        key = (conversation_type, mood)
+        direction = self._directions.get(key)
+        if direction is None:
+            render = self.system_templates.get(conversation_type, self._default_system)
+            direction = '' if render.fields & DIRECTION_FIELDS else \
+                self._direction(self._values(conversation_type, mood))
+            self._directions[key] = direction
+        return direction
+
+    def user_template(self, conversation_type: str) -> Optional[Callable[[Dict], str]]:
+        """The compiled user prompt layout for a type, or None for the built-in one"""
+        return self.user_templates.get(conversation_type)
+
+
+def load_prompt_set(version) -> PromptSet:
+    """Read the active prompts and templates (two queries)"""
+    from apps.ai_engine.models import ConversationPrompt
+    from apps.conversations.models import ConversationTemplate
+
+    fragments = dict(ConversationPrompt.objects.filter(is_active=True).values_list('name', 'template'))
+    templates = {}
+    # Oldest first, so the most recently updated template of a type wins
+    for template in ConversationTemplate.objects.filter(is_active=True).order_by('updated_at').values(
+        'name', 'conversation_type', 'system_prompt', 'user_prompt_template'
+    ):
+        templates[template['conversation_type']] = template
+    return PromptSet(version, fragments, templates)
+
+
+def current_version():
+    """Row count and latest update of the prompts and templates (two aggregate queries)"""
+    from apps.ai_engine.models import ConversationPrompt
+    from apps.conversations.models import ConversationTemplate
+
+    return tuple(
+        tuple(model.objects.aggregate(rows=Count('pk'), updated=Max('updated_at')).values())
+        for model in (ConversationPrompt, ConversationTemplate)
+    )
+
+
+def reset_prompt_set():
+    """Reload this process's prompts on next use"""
+    global _prompt_set
+    _prompt_set = None
+
+
+_prompt_set = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_prompt_set() -> PromptSet:
+    """The process's prompts, reloaded when the version in the database moves"""
+    global _prompt_set, _checked_at
+    prompt_set = _prompt_set
+    if prompt_set is not None and time.monotonic() - _checked_at < settings.AI_PROMPT_VERSION_CHECK_INTERVAL:
+        return prompt_set
+
+    with _lock:
+        try:
+            version = current_version()
+            if _prompt_set is None or _prompt_set.version != version:
+                _prompt_set = load_prompt_set(version)
+        except DatabaseError as e:
+            # e.g. tables not migrated yet: keep what we have (or the built-in prompts) and try again next interval
+            logger.error(f"Could not load prompt templates: {str(e)}")
+            if _prompt_set is None:
+                _prompt_set = PromptSet(None, {}, {})
+        _checked_at = time.monotonic()
+        return _prompt_set
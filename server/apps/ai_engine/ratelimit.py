@@ -0,0 +1,301 @@
+"""
+Shared rate limiting for AI provider calls
+
+Each model has two token buckets, requests per minute and tokens per minute,
+refilled continuously. Callers take one request and an estimated token count
+before calling the provider and wait until both buckets can cover it. The
+buckets live in Redis (AI_RATE_LIMIT_REDIS_URL) so every worker shares them;
+without it a per-process in-memory store is used. Limits start from
+AI_RATE_LIMIT_RPM / AI_RATE_LIMIT_TPM and are replaced by the provider's
+x-ratelimit-* headers once seen; a 429 blocks the model for its retry-after.
+Every Redis update is a single script, so concurrent workers never
+interleave a read and a write. The async variants run the store calls in a
+worker thread so the blocking Redis client never stalls the event loop.
+"""
+import asyncio
+import re
+import threading
+import time
+from typing import Dict, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+BUCKET_TTL = 3600
+CHARS_PER_TOKEN = 4
+
+# KEYS[1] bucket hash; ARGV: now, default rpm, default tpm, requests, tokens
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts', 'blocked_until', 'rpm', 'tpm')
+local rpm = tonumber(state[5]) or tonumber(ARGV[2])
+local tpm = tonumber(state[6]) or tonumber(ARGV[3])
+local want_requests = tonumber(ARGV[4])
+local want_tokens = math.min(tonumber(ARGV[5]), tpm)
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local requests = math.min(rpm, (tonumber(state[1]) or rpm) + elapsed * rpm / 60)
+local tokens = math.min(tpm, (tonumber(state[2]) or tpm) + elapsed * tpm / 60)
+local wait = math.max(0, (tonumber(state[4]) or 0) - now)
+if requests < want_requests then wait = math.max(wait, (want_requests - requests) * 60 / rpm) end
+if tokens < want_tokens then wait = math.max(wait, (want_tokens - tokens) * 60 / tpm) end
+if wait == 0 then
+    requests = requests - want_requests
+    tokens = tokens - want_tokens
+end
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return tostring(wait)
+"""
+
+# KEYS[1] bucket hash; ARGV: rpm, tpm, remaining requests, remaining tokens ('' if unknown)
+OBSERVE_SCRIPT = """
+if ARGV[1] ~= '' then redis.call('HSET', KEYS[1], 'rpm', ARGV[1]) end
+if ARGV[2] ~= '' then redis.call('HSET', KEYS[1], 'tpm', ARGV[2]) end
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens')
+if ARGV[3] ~= '' and (tonumber(state[1]) == nil or tonumber(ARGV[3]) < tonumber(state[1])) then
+    redis.call('HSET', KEYS[1], 'requests', ARGV[3])
+end
+if ARGV[4] ~= '' and (tonumber(state[2]) == nil or tonumber(ARGV[4]) < tonumber(state[2])) then
+    redis.call('HSET', KEYS[1], 'tokens', ARGV[4])
+end
+return 1
+"""
+
+# KEYS[1] bucket hash; ARGV: tokens to give back (negative to charge)
+ADJUST_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'tokens') == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', ARGV[1])
+end
+return 1
+"""
+
+# KEYS[1] bucket hash; ARGV: blocked until (epoch seconds), ttl
+BLOCK_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+if tonumber(ARGV[1]) > current then
+    redis.call('HSET', KEYS[1], 'blocked_until', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class LocalBucketStore:
+    """In-memory buckets for a single process (development and tests)"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model: str, rpm: float, tpm: float, requests: int, tokens: int, now: float) -> float:
+        with self._lock:
+            bucket = self._buckets.setdefault(model, {})
+            rpm = bucket.get('rpm', rpm)
+            tpm = bucket.get('tpm', tpm)
+            tokens = min(tokens, tpm)
+            elapsed = max(0.0, now - bucket.get('ts', now))
+            available_requests = min(rpm, bucket.get('requests', rpm) + elapsed * rpm / 60)
+            available_tokens = min(tpm, bucket.get('tokens', tpm) + elapsed * tpm / 60)
+
+            wait = max(0.0, bucket.get('blocked_until', 0) - now)
+            if available_requests < requests:
+                wait = max(wait, (requests - available_requests) * 60 / rpm)
+            if available_tokens < tokens:
+                wait = max(wait, (tokens - available_tokens) * 60 / tpm)
+            if wait == 0:
+                available_requests -= requests
+                available_tokens -= tokens
+
+            bucket.update(requests=available_requests, tokens=available_tokens, ts=now)
+            return wait
+
+    def adjust(self, model: str, tokens: float):
+        with self._lock:
+            bucket = self._buckets.setdefault(model, {})
+            if 'tokens' in bucket:
+                bucket['tokens'] += tokens
+
+    def observe(self, model: str, rpm=None, tpm=None, remaining_requests=None, remaining_tokens=None):
+        with self._lock:
+            bucket = self._buckets.setdefault(model, {})
+            if rpm is not None:
+                bucket['rpm'] = rpm
+            if tpm is not None:
+                bucket['tpm'] = tpm
+            if remaining_requests is not None:
+                bucket['requests'] = min(bucket.get('requests', remaining_requests), remaining_requests)
+            if remaining_tokens is not None:
+                bucket['tokens'] = min(bucket.get('tokens', remaining_tokens), remaining_tokens)
+
+    def block(self, model: str, until: float):
+        with self._lock:
+            bucket = self._buckets.setdefault(model, {})
+            bucket['blocked_until'] = max(bucket.get('blocked_until', 0), until)
+
+
+class RedisBucketStore:
+    """Buckets shared by all workers through Redis"""
+
+    def __init__(self, url: str):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._observe = self.redis.register_script(OBSERVE_SCRIPT)
+        self._adjust = self.redis.register_script(ADJUST_SCRIPT)
+        self._block = self.redis.register_script(BLOCK_SCRIPT)
+
+    @staticmethod
+    def _key(model: str) -> str:
+        return f"ai:ratelimit:{model}"
+
+    def acquire(self, model: str, rpm: float, tpm: float, requests: int, tokens: int, now: float) -> float:
+        return float(self._acquire(keys=[self._key(model)], args=[now, rpm, tpm, requests, tokens, BUCKET_TTL]))
+
+    def adjust(self, model: str, tokens: float):
+        self._adjust(keys=[self._key(model)], args=[tokens])
+
+    def observe(self, model: str, rpm=None, tpm=None, remaining_requests=None, remaining_tokens=None):
+        args = ['' if value is None else value for value in (rpm, tpm, remaining_requests, remaining_tokens)]
+        self._observe(keys=[self._key(model)], args=args)
+
+    def block(self, model: str, until: float):
+        self._block(keys=[self._key(model)], args=[until, BUCKET_TTL])
+
+
+def estimate_tokens(request: Dict) -> int:
+    """Rough prompt size (about 4 characters per token) plus the completion budget"""
+    prompt_chars = sum(len(message.get('content') or '') for message in request.get('messages', []))
+    return prompt_chars // CHARS_PER_TOKEN + request.get('max_tokens', 0)
+
+
+def _parse_int(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_duration(value) -> Optional[float]:
+    """Parse retry-after / reset values such as '2', '1.5s', '6m0s' or '250ms'"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', str(value))
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+class RateLimitTimeout(Exception):
+    """Capacity did not become available within AI_RATE_LIMIT_MAX_WAIT"""
+
+
+class RateLimiter:
+    """Per-model RPM/TPM token buckets in front of the AI provider"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _take(self, model: str, tokens: int) -> float:
+        try:
+            return self.store.acquire(
+                model,
+                settings.AI_RATE_LIMIT_RPM,
+                settings.AI_RATE_LIMIT_TPM,
+                1,
+                tokens,
+                time.time()
+            )
+        except Exception as e:
+            # Never block generation on the limiter's own backend
+            logger.error(f"Rate limiter unavailable for {model}: {str(e)}")
+            return 0.0
+
+    def acquire(self, model: str, tokens: int):
+        """Block until a request of `tokens` estimated tokens may be sent"""
+        deadline = time.monotonic() + settings.AI_RATE_LIMIT_MAX_WAIT
+        while True:
+            wait = self._take(model, tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"No {model} capacity within {settings.AI_RATE_LIMIT_MAX_WAIT}s")
+            time.sleep(wait)
+
+    async def acquire_async(self, model: str, tokens: int):
+        """Async variant of acquire for the concurrent generation path"""
+        deadline = time.monotonic() + settings.AI_RATE_LIMIT_MAX_WAIT
+        while True:
+            wait = await sync_to_async(self._take, thread_sensitive=False)(model, tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"No {model} capacity within {settings.AI_RATE_LIMIT_MAX_WAIT}s")
+            await asyncio.sleep(wait)
+
+    def settle(self, model: str, estimated: int, actual: Optional[int]):
+        """Return (or charge) the difference between estimated and actual tokens"""
+        if actual is None or actual == estimated:
+            return
+        try:
+            self.store.adjust(model, estimated - actual)
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable for {model}: {str(e)}")
+
+    async def settle_async(self, model: str, estimated: int, actual: Optional[int]):
+        await sync_to_async(self.settle, thread_sensitive=False)(model, estimated, actual)
+
+    def observe_headers(self, model: str, headers):
+        """Adopt the provider's advertised limits and remaining capacity"""
+        if not headers:
+            return
+        values = {
+            'rpm': _parse_int(headers.get('x-ratelimit-limit-requests')),
+            'tpm': _parse_int(headers.get('x-ratelimit-limit-tokens')),
+            'remaining_requests': _parse_int(headers.get('x-ratelimit-remaining-requests')),
+            'remaining_tokens': _parse_int(headers.get('x-ratelimit-remaining-tokens')),
+        }
+        if all(value is None for value in values.values()):
+            return
+        try:
+            self.store.observe(model, **values)
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable for {model}: {str(e)}")
+
+    async def observe_headers_async(self, model: str, headers):
+        await sync_to_async(self.observe_headers, thread_sensitive=False)(model, headers)
+
+    def penalize(self, model: str, headers=None):
+        """Stop sending to a model after a 429 until its retry-after passes"""
+        retry_after = None
+        if headers:
+            retry_after = parse_duration(headers.get('retry-after')) or parse_duration(
+                headers.get('x-ratelimit-reset-requests')
+            )
+        retry_after = retry_after or settings.AI_RATE_LIMIT_DEFAULT_BACKOFF
+        logger.warning(f"Rate limited by provider for {model}, pausing {retry_after:.1f}s")
+        try:
+            self.store.block(model, time.time() + retry_after)
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable for {model}: {str(e)}")
+
+    async def penalize_async(self, model: str, headers=None):
+        await sync_to_async(self.penalize, thread_sensitive=False)(model, headers)
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter, backed by Redis when AI_RATE_LIMIT_REDIS_URL is set"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        url = settings.AI_RATE_LIMIT_REDIS_URL
+        _rate_limiter = RateLimiter(RedisBucketStore(url) if url else LocalBucketStore())
+    return _rate_limiter
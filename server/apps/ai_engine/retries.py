@@ -0,0 +1,148 @@
+"""
+Failure handling for AI generations
+
+A per-provider circuit breaker stops calls after repeated provider failures
+and lets a single probe through once the reset timeout passes. Retryable
+failures are persisted as GenerationRetry jobs and picked up again with
+exponential backoff and jitter by the retry_failed_generations task.
+"""
+import random
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from urllib.parse import urlparse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from apps.ai_engine.models import GenerationRetry
+from apps.ai_engine.ratelimit import RateLimitTimeout
+import logging
+
+logger = logging.getLogger('ai_engine')
+
+
+class CircuitOpenError(Exception):
+    """The provider's circuit is open; the call was not attempted"""
+
+
+def is_provider_failure(error) -> bool:
+    """Errors that indicate the provider itself is unhealthy"""
+    from openai import APIConnectionError, APIStatusError
+    return isinstance(error, APIConnectionError) or (
+        isinstance(error, APIStatusError) and error.status_code >= 500
+    )
+
+
+def is_retryable(error) -> bool:
+    """Errors worth retrying later, as opposed to bad requests"""
+    from openai import RateLimitError
+    return is_provider_failure(error) or isinstance(
+        error, (RateLimitError, RateLimitTimeout, CircuitOpenError)
+    )
+
+
+def failure_outcome(error) -> str:
+    """AIGenerationLog outcome for a failed generation"""
+    from openai import RateLimitError
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, (RateLimitError, RateLimitTimeout)):
+        return 'rate_limited'
+    return 'error'
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker whose state is kept in the Django cache"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._failures_key = f"ai:circuit:{name}:failures"
+        self._open_key = f"ai:circuit:{name}:open_until"
+        self._probe_key = f"ai:circuit:{name}:probe"
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now"""
+        open_until = cache.get(self._open_key)
+        if not open_until:
+            return True
+        if time.time() < open_until:
+            return False
+        # Half-open: one probe per reset window
+        return cache.add(self._probe_key, 1, settings.AI_CIRCUIT_RESET_TIMEOUT)
+
+    async def allow_async(self) -> bool:
+        return await sync_to_async(self.allow, thread_sensitive=False)()
+
+    def is_open(self) -> bool:
+        open_until = cache.get(self._open_key)
+        return bool(open_until) and time.time() < open_until
+
+    def record_success(self):
+        state = cache.get_many([self._failures_key, self._open_key])
+        if state:
+            if self._open_key in state:
+                logger.info(f"Circuit for {self.name} closed")
+            cache.delete_many([self._failures_key, self._open_key, self._probe_key])
+
+    async def record_success_async(self):
+        await sync_to_async(self.record_success, thread_sensitive=False)()
+
+    def record_failure(self):
+        timeout = settings.AI_CIRCUIT_RESET_TIMEOUT * 10
+        cache.add(self._failures_key, 0, timeout)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            # The counter expired or was evicted since the add; start it again
+            failures = 1 if cache.add(self._failures_key, 1, timeout) else cache.incr(self._failures_key)
+        if failures >= settings.AI_CIRCUIT_FAILURE_THRESHOLD or cache.get(self._open_key):
+            cache.set(self._open_key, time.time() + settings.AI_CIRCUIT_RESET_TIMEOUT, None)
+            cache.delete(self._probe_key)
+            logger.warning(
+                f"Circuit for {self.name} open for {settings.AI_CIRCUIT_RESET_TIMEOUT}s after {failures} failures"
+            )
+
+    async def record_failure_async(self):
+        await sync_to_async(self.record_failure, thread_sensitive=False)()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Breaker for the configured provider (keyed by its host)"""
+    return CircuitBreaker(urlparse(settings.AI_BASE_URL).netloc or settings.AI_BASE_URL)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with equal jitter, in seconds"""
+    delay = min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def schedule_retry(kind: str, target_id, date, error: str, options=None):
+    """
+    Record a failed generation for a later retry
+
+    An existing pending job for the same target and date is bumped instead of
+    duplicated; jobs out of attempts are marked failed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = GenerationRetry.objects.select_for_update().filter(
+            kind=kind, target_id=str(target_id), date=date, status='pending'
+        ).first()
+        if job is None:
+            job = GenerationRetry(kind=kind, target_id=str(target_id), date=date, options=options or {})
+        job.attempts += 1
+        job.last_error = error or ''
+        if job.attempts >= settings.AI_RETRY_MAX_ATTEMPTS:
+            job.status = 'failed'
+            logger.error(f"Giving up on {kind} {target_id} for {date} after {job.attempts} attempts: {error}")
+        else:
+            job.next_attempt_at = now + timedelta(seconds=backoff_delay(job.attempts))
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # Another worker queued the same target concurrently
+            pass
+    return job
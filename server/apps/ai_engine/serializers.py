@@ -0,0 +1,30 @@
+from rest_framework import serializers
+from .models import GenerationJob, GenerationJobItem
+
+
+class GenerationJobItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GenerationJobItem
+        fields = ['id', 'kind', 'target_id', 'target_name', 'status', 'error_message', 'updated_at']
+        read_only_fields = fields
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    """Job status with per-target progress"""
+    items = GenerationJobItemSerializer(many=True, read_only=True)
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = GenerationJob
+        fields = [
+            'id', 'kind', 'date', 'options', 'status', 'progress', 'items',
+            'created_at', 'updated_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        counts = {'total': 0, 'pending': 0, 'running': 0, 'succeeded': 0, 'skipped': 0, 'failed': 0}
+        for item in obj.items.all():
+            counts['total'] += 1
+            counts[item.status] += 1
+        return counts
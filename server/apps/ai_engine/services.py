@@ -1,21 +1,27 @@
 """
 AI Service for generating conversations, journals, and insights using OpenAI
 """
-from openai import OpenAI
 from django.conf import settings
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+from apps.ai_engine import cache as generation_cache
+from apps.ai_engine.ratelimit import get_rate_limiter, estimate_tokens
+from apps.ai_engine.retries import (
+    get_circuit_breaker, is_provider_failure, is_retryable, failure_outcome, CircuitOpenError
+)
+from apps.ai_engine.cassette import get_cassette
+from apps.ai_engine.client import get_client, new_async_client
+from apps.ai_engine.prompts import get_prompt_set
+from apps.ai_engine.metrics import record_generation
+from apps.ai_engine.budget import count_tokens, completion_budget, full_limit_retry
+import asyncio
+import json
+import re
+import time
 import logging
 
 logger = logging.getLogger('ai_engine')
 
-# Initialize OpenAI client (compatible with DeepSeek)
-client = OpenAI(
-    api_key=settings.AI_API_KEY,
-    base_url=settings.AI_BASE_URL  # DeepSeek uses custom base URL
-)
-
-
 class AIGenerationService:
     """Service for AI content generation"""
     
@@ -24,6 +30,12 @@ class AIGenerationService:
     DEFAULT_TEMPERATURE = 0.8
     DEFAULT_MAX_TOKENS = 1000
     
+    # Conversation prompt layouts, tried in order until the user prompt fits AI_CONVERSATION_PROMPT_BUDGET:
+    # repeated persona descriptions written once, then one-line abbreviated personas,
+    # then personality types only with long lists cut to COMPACT_LIST_LIMIT items
+    COMPACTION_LEVELS = ['deduplicated', 'abbreviated', 'minimal']
+    COMPACT_LIST_LIMIT = 3
+    
     @staticmethod
     def generate_conversation(
         devices: List,
@@ -47,168 +59,530 @@ class AIGenerationService:
         Returns:
             Dictionary with conversation content and metadata
         """
-        try:
-            # Build system prompt
-            system_prompt = AIGenerationService._build_conversation_system_prompt(
-                conversation_type, mood
-            )
-            
-            # Build user prompt with context
-            user_prompt = AIGenerationService._build_conversation_user_prompt(
-                devices, apps, usage_data, triggers
-            )
-            
-            # Call AI API (OpenAI/DeepSeek compatible)
-            response = client.chat.completions.create(
-                model=AIGenerationService.DEFAULT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=AIGenerationService.DEFAULT_TEMPERATURE,
-                max_tokens=AIGenerationService.DEFAULT_MAX_TOKENS
-            )
-            
-            conversation_content = response.choices[0].message.content
-            
-            # Calculate cost (approximate)
-            prompt_tokens = response.usage.prompt_tokens
-            completion_tokens = response.usage.completion_tokens
-            total_tokens = response.usage.total_tokens
-            
-            # Cost calculation based on provider
-            # DeepSeek pricing: ~$0.27 per 1M input tokens, ~$1.10 per 1M output tokens
-            # GPT-4 pricing: $0.03 per 1K input tokens, $0.06 per 1K output tokens
-            if 'deepseek' in AIGenerationService.DEFAULT_MODEL.lower():
-                cost = (prompt_tokens * 0.27 + completion_tokens * 1.10) / 1_000_000
-            else:
-                cost = (prompt_tokens * 0.03 + completion_tokens * 0.06) / 1000
-            
-            logger.info(f"Generated conversation: {total_tokens} tokens, ${cost:.4f}")
-            
-            return {
-                'content': conversation_content,
-                'model_used': response.model,
-                'generation_prompt': user_prompt,
-                'tokens_used': total_tokens,
-                'cost': cost,
-                'success': True
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating conversation: {str(e)}")
-            return {
-                'content': '',
-                'error': str(e),
-                'success': False
-            }
+        request = AIGenerationService.build_conversation_request(
+            devices, apps, usage_data, conversation_type, mood, triggers
+        )
+        
+        # Call AI API (OpenAI/DeepSeek compatible); conversations are never served from cache
+        result = AIGenerationService.generate(request, use_cache=False)
+        if result['success']:
+            logger.info(f"Generated conversation: {result['tokens_used']} tokens, ${result['cost']:.4f}")
+        return result
     
     @staticmethod
-    def _build_conversation_system_prompt(conversation_type: str, mood: str) -> str:
-        """Build the system prompt for conversation generation"""
+    def build_conversation_request(
+        devices: List,
+        apps: List,
+        usage_data: Dict,
+        conversation_type: str = 'daily_recap',
+        mood: str = 'humorous',
+        triggers: Optional[List] = None
+    ) -> Dict:
+        """Build the chat completion request for a conversation"""
+        # Build system prompt
+        system_prompt = AIGenerationService._build_conversation_system_prompt(
+            conversation_type, mood
+        )
         
-        base_prompt = """You are a creative AI that generates entertaining conversations between personified devices and apps.
-
-Rules:
-1. Each device and app has a distinct personality - stay consistent with their character
-2. Reference actual usage data naturally in dialogue
-3. Make it funny but insightful
-4. Format as a script with character names
-5. Keep it under 500 words
-6. Use the specified mood and conversation type
-
-Character Format Example:
-iPhone: *sighs* So, we need to talk about yesterday...
-Instagram: OMG what happened?!
-"""
+        # Build user prompt with context
+        user_prompt = AIGenerationService._build_conversation_user_prompt(
+            devices, apps, usage_data, triggers, conversation_type, mood
+        )
         
-        conversation_types = {
-            'daily_recap': 'Create a daily recap where devices discuss the day\'s usage',
-            'usage_intervention': 'Devices express concern about excessive usage',
-            'pattern_discussion': 'Discuss detected usage patterns',
-            'goal_check_in': 'Check in on user\'s digital wellness goals',
-            'app_drama': 'Apps argue about screen time and attention',
-            'device_gossip': 'Devices gossip about the user\'s habits',
-            'productivity_roast': 'Devices roast the user about procrastination',
-            'social_comparison': 'Compare usage with friends',
-            'milestone_celebration': 'Celebrate an achievement or milestone',
-            'friend_visit': 'A friend\'s device visits and interacts',
-            'emergency_meeting': 'Urgent meeting about concerning behavior'
+        return {
+            'model': AIGenerationService.DEFAULT_MODEL,
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            'temperature': AIGenerationService.DEFAULT_TEMPERATURE,
+            **completion_budget('conversation', AIGenerationService.DEFAULT_MAX_TOKENS),
+            '_content_type': 'conversation'
         }
+    
+    @staticmethod
+    def _calculate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """Approximate cost of a request; cached_tokens are prompt tokens billed at the prompt cache rate"""
+        # Cost calculation based on provider
+        # DeepSeek pricing: ~$0.27 per 1M input tokens ($0.07 on a cache hit), ~$1.10 per 1M output tokens
+        # GPT-4 pricing: $0.03 per 1K input tokens (half on a cache hit), $0.06 per 1K output tokens
+        uncached = prompt_tokens - cached_tokens
+        if 'deepseek' in model.lower():
+            return (uncached * 0.27 + cached_tokens * 0.07 + completion_tokens * 1.10) / 1_000_000
+        return (uncached * 0.03 + cached_tokens * 0.015 + completion_tokens * 0.06) / 1000
+    
+    @staticmethod
+    def _cached_tokens(usage) -> Optional[int]:
+        """Prompt tokens the provider served from its prompt cache, when it reports them"""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None)
+        if cached is None:
+            cached = getattr(usage, 'prompt_cache_hit_tokens', None)  # DeepSeek
+        return cached
+    
+    @staticmethod
+    def _usage_result(request: Dict, content: str, model_used: str, usage, finish_reason: Optional[str] = None) -> Dict:
+        """Generation result for a completed response and its usage block"""
+        cached_tokens = AIGenerationService._cached_tokens(usage) if usage else None
+        return {
+            'content': content,
+            'truncated': finish_reason == 'length',  # Stopped by max_tokens
+            'model_used': model_used,
+            'generation_prompt': request['messages'][-1]['content'],
+            'tokens_used': usage.total_tokens if usage else 0,
+            'prompt_tokens': usage.prompt_tokens if usage else None,
+            'completion_tokens': usage.completion_tokens if usage else None,
+            'cached_tokens': cached_tokens,
+            'cost': AIGenerationService._calculate_cost(
+                request['model'],
+                usage.prompt_tokens if usage else 0,
+                usage.completion_tokens if usage else 0,
+                cached_tokens or 0
+            ),
+            'success': True
+        }
+    
+    @staticmethod
+    def _build_result(request: Dict, response) -> Dict:
+        """Turn a chat completion response into a generation result"""
+        choice = response.choices[0]
+        return AIGenerationService._usage_result(
+            request, choice.message.content, response.model, response.usage, choice.finish_reason
+        )
+    
+    @staticmethod
+    def _payload(request: Dict) -> Dict:
+        """The request as sent to the provider, without the _-prefixed bookkeeping keys"""
+        return {k: v for k, v in request.items() if not k.startswith('_')}
+    
+    @staticmethod
+    def _failure_result(error: Exception) -> Dict:
+        """Generation result for an error; retryable marks transient provider failures"""
+        return {
+            'content': '',
+            'error': str(error),
+            'retryable': is_retryable(error),
+            'success': False
+        }
+    
+    @staticmethod
+    def _complete(api_client, request: Dict, stats: Optional[Dict] = None):
+        """
+        Call the provider within the shared rate limits
+        
+        Waits for RPM/TPM capacity first, feeds the response's rate-limit
+        headers back to the limiter and waits out 429s instead of failing.
+        Raises CircuitOpenError without calling while the provider is down.
+        Replays (or records) through the cassette when AI_CASSETTE_MODE is set.
+        The number of 429 retries is counted in stats['retries'] when given.
+        """
+        from openai import RateLimitError
+        cassette = get_cassette()
+        if cassette and cassette.replaying and not request.get('stream'):
+            return cassette.replay(request)
+        limiter = get_rate_limiter()
+        breaker = get_circuit_breaker()
+        model = request['model']
+        estimated = estimate_tokens(request)
         
-        mood_descriptions = {
-            'humorous': 'Keep it light and funny',
-            'supportive': 'Be encouraging and positive',
-            'dramatic': 'Amp up the drama and exaggeration',
-            'sarcastic': 'Use witty sarcasm and dry humor',
-            'educational': 'Focus on insights and learning',
-            'gossipy': 'Make it juicy and gossipy',
-            'competitive': 'Turn it into a competition',
-            'concerned': 'Express genuine concern',
-            'celebratory': 'Celebrate successes',
-            'chaotic': 'Make it wild and unpredictable'
+        for attempt in range(settings.AI_RATE_LIMIT_RETRIES + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {breaker.name}")
+            limiter.acquire(model, estimated)
+            try:
+                raw = api_client.with_options(max_retries=0).chat.completions.with_raw_response.create(
+                    **AIGenerationService._payload(request)
+                )
+            except RateLimitError as e:
+                limiter.penalize(model, e.response.headers)
+                if attempt == settings.AI_RATE_LIMIT_RETRIES:
+                    raise
+                if stats is not None:
+                    stats['retries'] = attempt + 1
+                continue
+            except Exception as e:
+                if is_provider_failure(e):
+                    breaker.record_failure()
+                raise
+            
+            breaker.record_success()
+            limiter.observe_headers(model, raw.headers)
+            response = raw.parse()
+            if not request.get('stream'):
+                # Streams are settled (and recorded) by the caller once the usage chunk arrives
+                limiter.settle(model, estimated, response.usage.total_tokens if response.usage else None)
+                if cassette and cassette.recording:
+                    cassette.record(request, response)
+            return response
+    
+    @staticmethod
+    async def _complete_async(api_client, request: Dict, stats: Optional[Dict] = None):
+        """Async variant of _complete"""
+        from openai import RateLimitError
+        cassette = get_cassette()
+        if cassette and cassette.replaying and not request.get('stream'):
+            return cassette.replay(request)
+        limiter = get_rate_limiter()
+        breaker = get_circuit_breaker()
+        model = request['model']
+        estimated = estimate_tokens(request)
+        
+        for attempt in range(settings.AI_RATE_LIMIT_RETRIES + 1):
+            if not await breaker.allow_async():
+                raise CircuitOpenError(f"Circuit open for {breaker.name}")
+            await limiter.acquire_async(model, estimated)
+            try:
+                raw = await api_client.with_options(max_retries=0).chat.completions.with_raw_response.create(
+                    **AIGenerationService._payload(request)
+                )
+            except RateLimitError as e:
+                await limiter.penalize_async(model, e.response.headers)
+                if attempt == settings.AI_RATE_LIMIT_RETRIES:
+                    raise
+                if stats is not None:
+                    stats['retries'] = attempt + 1
+                continue
+            except Exception as e:
+                if is_provider_failure(e):
+                    await breaker.record_failure_async()
+                raise
+            
+            await breaker.record_success_async()
+            await limiter.observe_headers_async(model, raw.headers)
+            response = raw.parse()
+            if not request.get('stream'):
+                # Streams are settled (and recorded) by the caller once the usage chunk arrives
+                await limiter.settle_async(model, estimated, response.usage.total_tokens if response.usage else None)
+                if cassette and cassette.recording:
+                    cassette.record(request, response)
+            return response
+    
+    @staticmethod
+    def generate(request: Dict, use_cache: bool = True) -> Dict:
+        """
+        Run one request built by a build_*_request method
+        
+        Identical requests are answered from the generation cache and the
+        result stored in it, unless use_cache is False: requests that must
+        not be answered from the cache (conversations) don't fill it either.
+        Every call is logged as an AIGenerationLog (see ai_engine.metrics).
+        """
+        started = time.monotonic()
+        stats = {'retries': 0}
+        caching = use_cache and settings.AI_CACHE_ENABLED
+        try:
+            key, cached = generation_cache.get_cached(request) if caching else (None, None)
+            if cached:
+                record_generation(request, cached, time.monotonic() - started, 'cached')
+                return cached
+            
+            response = AIGenerationService._complete(get_client(), request, stats)
+            result = AIGenerationService._build_result(request, response)
+            retry = full_limit_retry(request, result)
+            if retry:
+                # The adaptive cap cut the completion short: ask once more with the built-in limit
+                record_generation(request, result, time.monotonic() - started, 'success', retries=stats['retries'])
+                response = AIGenerationService._complete(get_client(), retry, stats)
+                result = AIGenerationService._build_result(retry, response)
+            if caching:
+                generation_cache.store(key, result)
+            record_generation(request, result, time.monotonic() - started, 'success', retries=stats['retries'])
+            return result
+        except Exception as e:
+            logger.error(f"Error generating {request.get('model')} completion: {str(e)}")
+            result = AIGenerationService._failure_result(e)
+            record_generation(request, result, time.monotonic() - started, failure_outcome(e), retries=stats['retries'])
+            return result
+    
+    @staticmethod
+    async def stream(request: Dict, result: Dict):
+        """
+        Run one request with stream=True, yielding content deltas as they arrive
+        
+        An async generator over its own async client, so a stream never ties
+        up a thread while it waits on the provider. Once it is exhausted,
+        `result` holds the generation result for the full response, shaped
+        like generate()'s. Streams bypass the generation cache, and ask for
+        the built-in max_tokens: a stream the user has watched can't be
+        retried if the adaptive cap truncates it.
+        """
+        request = {
+            **request,
+            'max_tokens': request.get('_max_tokens_limit', request.get('max_tokens')),
+            'stream': True,
+            'stream_options': {'include_usage': True}
         }
+        started = time.monotonic()
+        cassette = get_cassette()
+        if cassette and cassette.replaying:
+            # A replayed response arrives as a single delta
+            try:
+                response = cassette.replay(request)
+            except Exception as e:
+                logger.error(f"Error streaming {request['model']} completion: {str(e)}")
+                result.update(AIGenerationService._failure_result(e))
+                record_generation(request, result, time.monotonic() - started, failure_outcome(e))
+                return
+            result.update(AIGenerationService._build_result(request, response))
+            ttft = time.monotonic() - started
+            yield result['content']
+            record_generation(request, result, time.monotonic() - started, 'success', ttft)
+            return
         
-        conversation_context = conversation_types.get(conversation_type, 'Have a general conversation')
-        mood_context = mood_descriptions.get(mood, 'Be entertaining')
+        parts = []
+        usage = None
+        model_used = request['model']
+        finish_reason = None
+        ttft = None
+        stats = {'retries': 0}
+        api_client = new_async_client()
+        try:
+            response = await AIGenerationService._complete_async(api_client, request, stats)
+            try:
+                async for chunk in response:
+                    model_used = chunk.model or model_used
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if ttft is None:
+                            ttft = time.monotonic() - started
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await response.close()
+        except Exception as e:
+            logger.error(f"Error streaming {request['model']} completion: {str(e)}")
+            result.update(AIGenerationService._failure_result(e))
+            record_generation(request, result, time.monotonic() - started, failure_outcome(e), ttft, stats['retries'])
+            return
+        finally:
+            await api_client.close()
         
-        return f"{base_prompt}\n\nConversation Type: {conversation_context}\nMood: {mood_context}"
+        await get_rate_limiter().settle_async(
+            request['model'], estimate_tokens(request), usage.total_tokens if usage else None
+        )
+        if cassette and cassette.recording:
+            cassette.record(request, {
+                'id': 'chatcmpl-stream',
+                'object': 'chat.completion',
+                'created': 0,
+                'model': model_used,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(parts)},
+                    'finish_reason': finish_reason or 'stop',
+                }],
+                'usage': usage.model_dump(mode='json') if usage else None,
+            })
+        result.update(AIGenerationService._usage_result(request, ''.join(parts), model_used, usage, finish_reason))
+        record_generation(request, result, time.monotonic() - started, 'success', ttft, stats['retries'])
+    
+    @staticmethod
+    def generate_many(requests: List[Dict], concurrency: Optional[int] = None,
+                      use_cache: bool = True) -> List[Dict]:
+        """
+        Run many chat completion requests concurrently
+        
+        Requests go through the async client with at most `concurrency`
+        (AI_MAX_CONCURRENCY by default) in flight. Results come back in
+        request order, shaped like the synchronous generate_* results.
+        Cached requests are answered without a provider call; with use_cache
+        False the cache is neither read nor filled.
+        """
+        if not requests:
+            return []
+        
+        caching = use_cache and settings.AI_CACHE_ENABLED
+        results = [None] * len(requests)
+        keys = [None] * len(requests)
+        if caching:
+            for i, request in enumerate(requests):
+                started = time.monotonic()
+                keys[i], results[i] = generation_cache.get_cached(request)
+                if results[i]:
+                    record_generation(request, results[i], time.monotonic() - started, 'cached')
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            generated = asyncio.run(AIGenerationService._generate_many(
+                [requests[i] for i in pending], concurrency or settings.AI_MAX_CONCURRENCY
+            ))
+            for i, result in zip(pending, generated):
+                results[i] = result
+                if caching:
+                    generation_cache.store(keys[i], result)
+        return results
+    
+    @staticmethod
+    async def _generate_many(requests: List[Dict], concurrency: int) -> List[Dict]:
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async with new_async_client() as async_client:
+            async def generate(request):
+                stats = {'retries': 0}
+                async with semaphore:
+                    started = time.monotonic()
+                    try:
+                        response = await AIGenerationService._complete_async(async_client, request, stats)
+                        result = AIGenerationService._build_result(request, response)
+                        retry = full_limit_retry(request, result)
+                        if retry:
+                            record_generation(request, result, time.monotonic() - started, 'success',
+                                              retries=stats['retries'])
+                            response = await AIGenerationService._complete_async(async_client, retry, stats)
+                            result = AIGenerationService._build_result(retry, response)
+                        outcome = 'success'
+                    except Exception as e:
+                        logger.error(f"Error in concurrent generation: {str(e)}")
+                        result = AIGenerationService._failure_result(e)
+                        outcome = failure_outcome(e)
+                record_generation(request, result, time.monotonic() - started, outcome, retries=stats['retries'])
+                return result
+            
+            return await asyncio.gather(*(generate(request) for request in requests))
+    
+    @staticmethod
+    def _build_conversation_system_prompt(conversation_type: str, mood: str) -> str:
+        """Build the system prompt for conversation generation (see ai_engine.prompts)"""
+        return get_prompt_set().system_prompt(conversation_type, mood)
     
     @staticmethod
     def _build_conversation_user_prompt(
         devices: List,
         apps: List,
         usage_data: Dict,
-        triggers: Optional[List] = None
+        triggers: Optional[List] = None,
+        conversation_type: Optional[str] = None,
+        mood: str = 'humorous'
     ) -> str:
-        """Build the user prompt with all context"""
+        """
+        Build the user prompt with all context, laid out by the type's template if it has one
         
-        prompt_parts = []
+        The prompt is compacted (see COMPACTION_LEVELS) until it fits
+        AI_CONVERSATION_PROMPT_BUDGET tokens; the most compact layout is used
+        when none fits. The conversation type and mood go last, so requests
+        share as long a prefix as possible (see ai_engine.prompts).
+        """
+        prompt_set = get_prompt_set()
+        render = prompt_set.user_template(conversation_type)
+        direction = prompt_set.direction(conversation_type, mood)
+        for compaction in AIGenerationService.COMPACTION_LEVELS:
+            sections = AIGenerationService._conversation_prompt_sections(
+                devices, apps, usage_data, triggers, compaction
+            )
+            sections['direction'] = f"\n\n{direction}" if direction else ''
+            if render:
+                prompt = render({
+                    **sections,
+                    'direction': direction,
+                    'screen_time_hours': round((usage_data.get('total_screen_time') or 0) / 60, 1),
+                    'unlock_count': usage_data.get('unlock_count') or 0,
+                    'top_apps': ', '.join(usage_data.get('top_apps') or []),
+                    'patterns': ', '.join(usage_data.get('patterns') or []),
+                })
+            else:
+                prompt_parts = [sections[name] for name in (
+                    'participants', 'usage', 'relationships', 'triggers', 'notes', 'direction'
+                ) if sections[name]]
+                prompt_parts.append("\n\nGenerate the conversation now:")
+                prompt = "\n".join(prompt_parts)
+            if count_tokens(prompt) <= settings.AI_CONVERSATION_PROMPT_BUDGET:
+                break
+        return prompt
+    
+    @staticmethod
+    def _conversation_prompt_sections(
+        devices: List,
+        apps: List,
+        usage_data: Dict,
+        triggers: Optional[List] = None,
+        compaction: str = 'deduplicated'
+    ) -> Dict[str, str]:
+        """The user prompt's sections at a compaction level; empty strings for those without data"""
+        abbreviated = compaction in ('abbreviated', 'minimal')
+        minimal = compaction == 'minimal'
+        limit = AIGenerationService.COMPACT_LIST_LIMIT if minimal else None
         
-        # Participants
-        prompt_parts.append("=== PARTICIPANTS ===")
+        # Participants, in a fixed order so a user's prompts start the same way from day to day
+        devices = sorted(devices, key=lambda device: (device.name, str(device.pk)))
+        apps = sorted(apps, key=lambda app: (app.display_name, str(app.pk)))
+        prompt_parts = ["=== PARTICIPANTS ==="]
+        described = {}  # Persona description -> first device it was written for
         for device in devices:
-            prompt_parts.append(
-                f"\n{device.name} ({device.platform}):"
-                f"\n- Personality: {device.personality_type}"
-                f"\n- Description: {device.personality_description}"
-            )
+            description = device.personality_description
+            if minimal:
+                prompt_parts.append(f"{device.name} ({device.platform}): {device.personality_type}")
+            elif abbreviated:
+                prompt_parts.append(
+                    f"{device.name} ({device.platform}): {device.personality_type} - {description.split(',')[0]}"
+                )
+            else:
+                if description in described:
+                    description = f"same as {described[description]}"
+                else:
+                    described[description] = device.name
+                prompt_parts.append(
+                    f"\n{device.name} ({device.platform}):"
+                    f"\n- Personality: {device.personality_type}"
+                    f"\n- Description: {description}"
+                )
         
         for app in apps:
-            prompt_parts.append(
-                f"\n{app.display_name}:"
-                f"\n- Personality: {app.effective_personality}"
-                f"\n- Type: {app.app.category.name if app.app.category else 'Unknown'}"
-            )
+            category = app.app.category.name if app.app.category else 'Unknown'
+            if minimal:
+                prompt_parts.append(f"{app.display_name}: {app.effective_personality}")
+            elif abbreviated:
+                prompt_parts.append(f"{app.display_name}: {app.effective_personality}, {category}")
+            else:
+                prompt_parts.append(
+                    f"\n{app.display_name}:"
+                    f"\n- Personality: {app.effective_personality}"
+                    f"\n- Type: {category}"
+                )
+        sections = {'participants': "\n".join(prompt_parts)}
         
         # Usage Context
-        prompt_parts.append("\n\n=== USAGE DATA ===")
+        prompt_parts = ["\n\n=== USAGE DATA ==="]
         if usage_data.get('total_screen_time'):
             hours = usage_data['total_screen_time'] / 60
             prompt_parts.append(f"Total Screen Time: {hours:.1f} hours")
         
+        # Participants are listed by name, so the ranking lives here
         if usage_data.get('top_apps'):
-            prompt_parts.append(f"Most Used Apps: {', '.join(usage_data['top_apps'])}")
+            prompt_parts.append(f"Most Used Apps: {', '.join(usage_data['top_apps'][:limit])}")
         
         if usage_data.get('unlock_count'):
             prompt_parts.append(f"Phone Unlocks: {usage_data['unlock_count']} times")
         
         if usage_data.get('patterns'):
-            prompt_parts.append(f"Detected Patterns: {', '.join(usage_data['patterns'])}")
+            prompt_parts.append(f"Detected Patterns: {', '.join(usage_data['patterns'][:limit])}")
+        sections['usage'] = "\n".join(prompt_parts)
+        
+        sections['relationships'] = ''
+        if usage_data.get('relationships'):
+            prompt_parts = ["\n\n=== RELATIONSHIPS ==="]
+            for relationship in usage_data['relationships'][:limit]:
+                prompt_parts.append(f"- {relationship}")
+            sections['relationships'] = "\n".join(prompt_parts)
         
         # Triggers
+        sections['triggers'] = ''
         if triggers:
-            prompt_parts.append("\n\n=== TRIGGERS ===")
-            for trigger in triggers:
+            prompt_parts = ["\n\n=== TRIGGERS ==="]
+            for trigger in triggers[:limit]:
                 prompt_parts.append(f"- {trigger.description}")
+            sections['triggers'] = "\n".join(prompt_parts)
         
-        # Additional context
-        if usage_data.get('notes'):
-            prompt_parts.append(f"\n\nAdditional Context: {usage_data['notes']}")
+        # Additional context; anomaly notes repeat the triggers, so minimal prompts keep only the first
+        notes = usage_data.get('notes') or ''
+        if minimal:
+            notes = notes.split('; ')[0]
+        sections['notes'] = f"\n\nAdditional Context: {notes}" if notes else ''
         
-        prompt_parts.append("\n\nGenerate the conversation now:")
-        
-        return "\n".join(prompt_parts)
+        return sections
     
     @staticmethod
     def generate_device_journal(
@@ -231,63 +605,65 @@ Instagram: OMG what happened?!
         Returns:
             Dictionary with journal content and metadata
         """
-        try:            
-            print(f"servcic -started generating journal for device")
-
-            system_prompt = f"""You are {device.name}, a {device.platform} device with a {device.personality_type} personality.
-            
-Your personality: {device.personality_description}
-
-Write a personal journal entry about today from your perspective as a device. Be introspective and stay in character.
-Keep it under 300 words. Write in first person."""
-            
-            # Build context
-            context_parts = [f"Date: {date}"]
-            
-            if usage_summary.get('screen_time'):
-                hours = usage_summary['screen_time'] / 60
-                context_parts.append(f"I was used for {hours:.1f} hours today")
-            
-            if usage_summary.get('unlocks'):
-                context_parts.append(f"Unlocked {usage_summary['unlocks']} times")
-            
-            if notable_events:
-                context_parts.append(f"Notable events: {', '.join(notable_events)}")
-            
-            if mentioned_apps:
-                app_names = [app.display_name for app in mentioned_apps]
-                context_parts.append(f"Active apps: {', '.join(app_names)}")
-            
-            user_prompt = "\n".join(context_parts) + "\n\nWrite your journal entry:"
-            
-            response = client.chat.completions.create(
-                model=settings.AI_JOURNAL_MODEL,  # Use cheaper/faster model for journals
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=400
-            )
-            
-            content = response.choices[0].message.content
-            print(device)
+        request = AIGenerationService.build_device_journal_request(
+            device, date, usage_summary, notable_events, mentioned_apps
+        )
+        result = AIGenerationService.generate(request)
+        if result['success']:
             logger.info(f"Generated device journal for {device.name}")
-            
-            return {
-                'content': content,
-                'model_used': response.model,
-                'generation_prompt': user_prompt,
-                'success': True
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating device journal: {str(e)}")
-            return {
-                'content': '',
-                'error': str(e),
-                'success': False
-            }
+        return result
+    
+    # Journal system prompts hold no per-request values; who is writing comes first in the user prompt
+    DEVICE_JOURNAL_SYSTEM_PROMPT = """Write a personal journal entry about today from your perspective as a device. Be introspective and stay in character.
+Keep it under 300 words. Write in first person."""
+    
+    APP_JOURNAL_SYSTEM_PROMPT = """Write a brief journal entry (150 words max) about today from your perspective. Stay in character and be entertaining."""
+    
+    @staticmethod
+    def build_device_journal_request(
+        device,
+        date,
+        usage_summary: Dict,
+        notable_events: List[str],
+        mentioned_apps: List = None
+    ) -> Dict:
+        """Build the chat completion request for a device journal entry"""
+        # The system prompt is the same for every device, so providers can cache it
+        system_prompt = AIGenerationService.DEVICE_JOURNAL_SYSTEM_PROMPT
+        
+        # Build context
+        context_parts = [
+            f"You are {device.name}, a {device.platform} device with a {device.personality_type} personality.",
+            f"Your personality: {device.personality_description}",
+            f"Date: {date}"
+        ]
+        
+        if usage_summary.get('screen_time'):
+            hours = usage_summary['screen_time'] / 60
+            context_parts.append(f"I was used for {hours:.1f} hours today")
+        
+        if usage_summary.get('unlocks'):
+            context_parts.append(f"Unlocked {usage_summary['unlocks']} times")
+        
+        if notable_events:
+            context_parts.append(f"Notable events: {', '.join(notable_events)}")
+        
+        if mentioned_apps:
+            app_names = [app.display_name for app in mentioned_apps]
+            context_parts.append(f"Active apps: {', '.join(app_names)}")
+        
+        user_prompt = "\n".join(context_parts) + "\n\nWrite your journal entry:"
+        
+        return {
+            'model': settings.AI_JOURNAL_MODEL,  # Use cheaper/faster model for journals
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            'temperature': 0.8,
+            **completion_budget('device_journal', 400),
+            '_content_type': 'device_journal'
+        }
     
     @staticmethod
     def generate_app_journal(
@@ -308,51 +684,132 @@ Keep it under 300 words. Write in first person."""
         Returns:
             Dictionary with journal content and metadata
         """
-        try:
-            print(device_app)
-            system_prompt = f"""You are {device_app.app.name}, an app with a {device_app.effective_personality} personality.
+        request = AIGenerationService.build_app_journal_request(
+            device_app, date, usage_stats, session_highlights
+        )
+        return AIGenerationService.generate(request)
+    
+    @staticmethod
+    def build_app_journal_request(
+        device_app,
+        date,
+        usage_stats: Dict,
+        session_highlights: List[str]
+    ) -> Dict:
+        """Build the chat completion request for an app journal entry"""
+        system_prompt = AIGenerationService.APP_JOURNAL_SYSTEM_PROMPT
+        
+        context_parts = [
+            f"You are {device_app.app.name}, an app with a {device_app.effective_personality} personality.",
+            f"Date: {date}"
+        ]
+        
+        if usage_stats.get('time_spent'):
+            minutes = usage_stats['time_spent']
+            context_parts.append(f"User spent {minutes} minutes with me")
+        
+        if usage_stats.get('launch_count'):
+            context_parts.append(f"Opened {usage_stats['launch_count']} times")
+        
+        if session_highlights:
+            context_parts.append(f"Highlights: {', '.join(session_highlights)}")
+        
+        user_prompt = "\n".join(context_parts) + "\n\nWrite your journal entry:"
+        
+        return {
+            'model': settings.AI_JOURNAL_MODEL,
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            'temperature': 0.8,
+            **completion_budget('app_journal', 250),
+            '_content_type': 'app_journal'
+        }
+    
+    # Moods an app may pick for itself in packed journals (AppJournal.mood choices)
+    APP_JOURNAL_MOODS = [
+        'satisfied', 'neglected', 'overused', 'appreciated', 'frustrated',
+        'excited', 'jealous', 'proud', 'worried', 'content'
+    ]
+    
+    @staticmethod
+    def build_app_journals_request(date, entries: List) -> Dict:
+        """
+        Build one request for the journals of several apps on a device
+        
+        entries is a list of (device_app, usage_stats, session_highlights).
+        The model answers with a JSON object holding one journal per app,
+        identified by its 1-based position; see parse_app_journals.
+        """
+        system_prompt = f"""You write journal entries for apps that have personalities.
 
-Write a brief journal entry (150 words max) about today from your perspective. Stay in character and be entertaining."""
-            
-            context_parts = [f"Date: {date}"]
-            
+For each app below, write a brief journal entry (150 words max) about today from that app's perspective. Stay in character and be entertaining.
+
+Respond with JSON only, in this format:
+{{"journals": [{{"id": 1, "mood": "<one of: {', '.join(AIGenerationService.APP_JOURNAL_MOODS)}>", "content": "<journal entry>"}}]}}
+Include exactly one journal per app, using the app's number as its id."""
+        
+        context_parts = [f"Date: {date}"]
+        for i, (device_app, usage_stats, session_highlights) in enumerate(entries, start=1):
+            context_parts.append(f"\n[{i}] {device_app.app.name} ({device_app.effective_personality} personality)")
             if usage_stats.get('time_spent'):
-                minutes = usage_stats['time_spent']
-                context_parts.append(f"User spent {minutes} minutes with me")
-            
+                context_parts.append(f"User spent {usage_stats['time_spent']} minutes with me")
             if usage_stats.get('launch_count'):
                 context_parts.append(f"Opened {usage_stats['launch_count']} times")
-            
             if session_highlights:
                 context_parts.append(f"Highlights: {', '.join(session_highlights)}")
-            
-            user_prompt = "\n".join(context_parts) + "\n\nWrite your journal entry:"
-            
-            response = client.chat.completions.create(
-                model=settings.AI_JOURNAL_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=250
-            )
-            
-            content = response.choices[0].message.content
-            
-            # logger.info(f"Generated app journal for {device_app.app.name}")
-            
-            return {
-                'content': content,
-                'model_used': response.model,
-                'generation_prompt': user_prompt,
-                'success': True
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating app journal: {str(e)}")
-            return {
-                'content': '',
-                'error': str(e),
-                'success': False
+        
+        user_prompt = "\n".join(context_parts) + "\n\nWrite the journal entries:"
+        
+        return {
+            'model': settings.AI_JOURNAL_MODEL,
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            'temperature': 0.8,
+            **completion_budget('app_journals', 250, units=len(entries)),
+            'response_format': {'type': 'json_object'},
+            '_content_type': 'app_journals',
+            '_units': len(entries)
+        }
+    
+    @staticmethod
+    def parse_app_journals(content: str, count: int) -> Dict[int, Dict]:
+        """
+        Parse a packed journal response into {position: {'content', 'mood'}}
+        
+        Positions are 0-based. Items that are missing or malformed are left
+        out so the caller can fall back to individual requests for them.
+        """
+        if not content:
+            return {}
+        text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', content)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logger.warning("Unparseable packed app journal response")
+            return {}
+        
+        items = data.get('journals') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return {}
+        
+        parsed = {}
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get('id', position + 1)) - 1
+            except (TypeError, ValueError):
+                continue
+            journal = item.get('content')
+            if not 0 <= index < count or index in parsed or not isinstance(journal, str) or not journal.strip():
+                continue
+            mood = item.get('mood')
+            parsed[index] = {
+                'content': journal.strip(),
+                'mood': mood if mood in AIGenerationService.APP_JOURNAL_MOODS else 'satisfied',
             }
+        return parsed
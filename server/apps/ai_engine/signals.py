@@ -0,0 +1,18 @@
+"""
+Prompt template invalidation
+
+Any change to ConversationPrompt or ConversationTemplate makes the saving
+process reload its compiled prompts right away; other processes notice the
+new version in the database within AI_PROMPT_VERSION_CHECK_INTERVAL.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.ai_engine.models import ConversationPrompt
+from apps.ai_engine.prompts import reset_prompt_set
+from apps.conversations.models import ConversationTemplate
+
+
+@receiver([post_save, post_delete], sender=ConversationPrompt)
+@receiver([post_save, post_delete], sender=ConversationTemplate)
+def invalidate_prompts(sender, instance, **kwargs):
+    reset_prompt_set()
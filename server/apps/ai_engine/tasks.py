@@ -1,266 +1,423 @@
 """
 Celery tasks for AI engine
+
+Nightly generation runs in three phases per batch: gather context and build
+requests (a fixed number of DB reads per batch, see ai_engine.context), fan
+the requests out concurrently through
+AIGenerationService.generate_many, then write the results in bulk. With
+AI_BATCH_MODE the requests are instead submitted to the provider's batch
+API and ingested by poll_generation_batches once the batch completes.
+
+Every saved conversation and journal records the fingerprint of its inputs.
+Targets whose inputs haven't changed since their last generation (e.g. a
+manual trigger followed by the nightly run) are skipped unless forced.
 """
+from asgiref.sync import sync_to_async
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from django.db import transaction
-from django.db.models import Sum, Avg, Count, F, Q
+from django.db import IntegrityError, transaction
+from django.db.models import Sum, Avg, Count, F, Q, Window
+from django.db.models.functions import RowNumber
 from apps.ai_engine.services import AIGenerationService
+from apps.ai_engine.models import GenerationRetry, GenerationBatch, GenerationJob, GenerationJobItem
+from apps.ai_engine.retries import schedule_retry, get_circuit_breaker
+from apps.ai_engine.context import (
+    ConversationContext, DeviceJournalContext, AppJournalContext,
+    load_conversation_contexts, load_device_journal_contexts, load_app_journal_contexts
+)
 from apps.conversations.models import Conversation, DeviceJournal, AppJournal
 from apps.devices.models import Device
 from apps.applications.models import DeviceApp
-from apps.usage.models import UsageData, AppUsage
+from apps.usage.models import AppUsage
+from apps.analytics.activity import active_user_chunks
 import logging
 
 logger = logging.getLogger('ai_engine')
 
+# Returned (truthy) by the single-target generators when the inputs haven't changed
+UNCHANGED = 'unchanged'
+
 
 @shared_task(name='apps.ai_engine.tasks.generate_daily_conversations')
-def generate_daily_conversations():
+def generate_daily_conversations(user_ids=None, date=None, force=False):
     """
-    Generate daily conversations for all active users
-    Runs at 6 AM daily
+    Generate yesterday's conversations for all active users, or for a
+    pipeline shard's users for their local day `date` (see
+    analytics.tasks.dispatch_daily_pipeline)
+    
+    Users who already have a conversation generated from the same inputs
+    are skipped unless force is set.
     """
     logger.info("Starting daily conversation generation")
     
     from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
     User = get_user_model()
     
-    yesterday = timezone.now().date() - timedelta(days=1)
+    date = parse_date(date) if isinstance(date, str) else date
+    yesterday = date or timezone.now().date() - timedelta(days=1)
+    if settings.AI_BATCH_MODE:
+        return submit_generation_batch('conversations', yesterday, user_ids, force)
+    
     generated_count = 0
+    skipped_count = 0
     error_count = 0
     
-    # Get users who had activity yesterday
-    active_users = User.objects.filter(
-        devices__usage_data__date=yesterday
-    ).distinct()
-    
-    for user in active_users:
+    # Users who had activity yesterday, straight from the activity bitmap
+    for chunk in active_user_chunks(yesterday, user_ids=user_ids):
+        # The whole chunk's context comes from a fixed number of queries
+        users = list(User.objects.filter(id__in=chunk))
         try:
-            result = generate_conversation_for_user(user, yesterday)
-            if result:
-                generated_count += 1
-            else:
-                error_count += 1
+            contexts = load_conversation_contexts(users, yesterday)
         except Exception as e:
-            logger.error(f"Error generating conversation for user {user.id}: {str(e)}")
-            error_count += 1
+            logger.error(f"Error preparing conversations for {len(users)} users: {str(e)}")
+            error_count += len(users)
+            continue
+        error_count += len(users) - len(contexts)
+        contexts, unchanged = split_unchanged('conversation', contexts, force)
+        skipped_count += len(unchanged)
+        
+        # Conversations are meant to differ on every run, so they skip the generation cache
+        results = AIGenerationService.generate_many([context.request for context in contexts], use_cache=False)
+        saved = save_conversations(list(zip(contexts, results)))
+        generated_count += saved
+        error_count += len(contexts) - saved
     
-    logger.info(f"Daily conversation generation complete: {generated_count} success, {error_count} errors")
+    logger.info(
+        f"Daily conversation generation complete: {generated_count} success, "
+        f"{skipped_count} unchanged, {error_count} errors"
+    )
     return {
         'success': generated_count,
+        'skipped': skipped_count,
         'errors': error_count,
         'date': str(yesterday)
     }
 
 
-def generate_conversation_for_user(user, date):
-    """Generate a conversation for a specific user and date"""
+def generate_conversation_for_user(user, date, conversation_type=None, mood=None, force=False):
+    """
+    Generate a conversation for a specific user and date
+    
+    Returns UNCHANGED without generating when the user already has one from
+    the same inputs, unless force is set.
+    """
     try:
-        # Get user's devices
-        devices = list(user.devices.filter(is_active=True)[:3])  # Limit to 3 devices
-        if not devices:
-            logger.info(f"No active devices for user {user.id}")
-            return False
-        
-        # Get most used apps from yesterday
-        top_apps = AppUsage.objects.filter(
-            device_app__device__user=user,
-            date=date
-        ).order_by('-time_spent_minutes')[:5]  # Top 5 apps
-        
-        device_apps = [au.device_app for au in top_apps if au.device_app]
-        
-        if not device_apps:
-            logger.info(f"No app usage for user {user.id} on {date}")
+        context = prepare_conversation(user, date, conversation_type, mood)
+        if not context:
             return False
-        
-        # Gather usage statistics
-        total_usage = UsageData.objects.filter(
-            device__user=user,
-            date=date
-        ).aggregate(
-            total_time=Sum('total_screen_time'),
-            total_unlocks=Sum('unlock_count')
-        )
-        
-        usage_data = {
-            'total_screen_time': total_usage['total_time'] or 0,
-            'unlock_count': total_usage['total_unlocks'] or 0,
-            'top_apps': [app.display_name for app in device_apps],
-            'patterns': []
-        }
-        
-        # Check for patterns
-        from apps.usage.models import UsagePattern
-        patterns = UsagePattern.objects.filter(
-            user=user,
-            start_date=date
-        ).values_list('pattern_type', flat=True)
-        usage_data['patterns'] = list(patterns)
-        
-        # Determine conversation type and mood
-        conversation_type = 'daily_recap'
-        mood = 'humorous'
-        
-        # Adjust based on usage
-        if usage_data['total_screen_time'] > 360:  # More than 6 hours
-            conversation_type = 'usage_intervention'
-            mood = 'concerned'
-        elif usage_data['patterns']:
-            conversation_type = 'pattern_discussion'
+        if not split_unchanged('conversation', [context], force)[0]:
+            logger.info(f"Conversation inputs unchanged for user {user.id} on {date}, skipping")
+            return UNCHANGED
         
         # Generate conversation using AI
-        ai_result = AIGenerationService.generate_conversation(
-            devices=devices,
-            apps=device_apps,
-            usage_data=usage_data,
-            conversation_type=conversation_type,
-            mood=mood
-        )
-        
-        if ai_result['success']:
-            # Save conversation
-            with transaction.atomic():
-                conversation = Conversation.objects.create(
-                    user=user,
-                    conversation_type=conversation_type,
-                    mood=mood,
-                    content=ai_result['content'],
-                    ai_model_used=ai_result['model_used'],
-                    generation_prompt=ai_result['generation_prompt'],
-                    generation_tokens=ai_result['tokens_used'],
-                    generation_cost=ai_result['cost'],
-                    generation_status='completed'
-                )
-                
-                # Link participants
-                conversation.participating_devices.set(devices)
-                conversation.participating_apps.set(device_apps)
-                
-                logger.info(f"Generated conversation {conversation.id} for user {user.id}")
-                return True
-        else:
-            logger.error(f"AI generation failed for user {user.id}: {ai_result.get('error')}")
-            return False
+        ai_result = AIGenerationService.generate(context.request, use_cache=False)
+        return save_conversations([(context, ai_result)]) == 1
             
     except Exception as e:
         logger.error(f"Error in generate_conversation_for_user for user {user.id}: {str(e)}")
         return False
 
 
+async def stream_conversation_for_user(user, date, outcome, conversation_type=None, mood=None, force=False):
+    """
+    Generate a conversation for a user, yielding its content as it streams in
+    
+    An async generator; once it is exhausted, `outcome` holds 'conversation'
+    (saved only after the full response has arrived) or 'error'. A failed
+    stream is only reported, never queued for a background retry: the user
+    is waiting on it and can simply ask again. Unless force is set, a
+    conversation already generated from the same inputs is yielded whole
+    instead.
+    """
+    context = await sync_to_async(prepare_conversation)(user, date, conversation_type, mood)
+    if not context:
+        outcome['error'] = 'No devices or app usage to talk about'
+        return
+    
+    if not force:
+        existing = await Conversation.objects.filter(
+            user=user, input_fingerprint=context.fingerprint, generation_status='completed'
+        ).order_by('-created_at').afirst()
+        if existing:
+            yield existing.content
+            outcome['conversation'] = existing
+            return
+    
+    ai_result = {}
+    async for delta in AIGenerationService.stream(context.request, ai_result):
+        yield delta
+    if not ai_result.get('success'):
+        outcome['error'] = ai_result.get('error', 'Generation failed')
+        return
+    await sync_to_async(save_conversations)([(context, ai_result)])
+    outcome['conversation'] = context.conversation
+
+
+def prepare_conversation(user, date, conversation_type=None, mood=None):
+    """
+    Gather the context and AI request for a user's conversation
+    
+    Returns None if the user has no devices or app usage for the date.
+    """
+    contexts = load_conversation_contexts([user], date, conversation_type, mood)
+    return contexts[0] if contexts else None
+
+
+def split_unchanged(kind, contexts, force=False):
+    """
+    Split contexts into (to_generate, unchanged) in one query
+    
+    A context is unchanged when its target already has a saved conversation
+    or journal with the same input fingerprint. With force nothing is.
+    """
+    contexts = list(contexts)
+    if force or not contexts:
+        return contexts, []
+    
+    dates = {context.date for context in contexts}
+    if kind == 'conversation':
+        saved = Conversation.objects.filter(
+            user__in=[context.user for context in contexts], generation_status='completed'
+        )
+    elif kind == 'device_journal':
+        saved = DeviceJournal.objects.filter(device__in=[context.device for context in contexts], date__in=dates)
+    else:
+        saved = AppJournal.objects.filter(device_app__in=[context.device_app for context in contexts], date__in=dates)
+    fingerprints = set(saved.filter(
+        input_fingerprint__in={context.fingerprint for context in contexts if context.fingerprint}
+    ).values_list('input_fingerprint', flat=True))
+    
+    changed, unchanged = [], []
+    for context in contexts:
+        (unchanged if context.fingerprint in fingerprints else changed).append(context)
+    return changed, unchanged
+
+
+def save_conversations(generated):
+    """
+    Persist (context, ai_result) pairs as conversations in bulk
+    
+    Failed generations are logged and skipped, and queued for retry if the
+    failure was transient. Returns the number saved.
+    """
+    from apps.usage.models import UsageAnomaly
+    
+    conversations = []
+    saved_contexts = []
+    for context, ai_result in generated:
+        if not ai_result['success']:
+            logger.error(f"AI generation failed for user {context.user.id}: {ai_result.get('error')}")
+            if ai_result.get('retryable'):
+                schedule_retry(
+                    'conversation', context.user.id, context.date, ai_result.get('error'),
+                    {'conversation_type': context.conversation_type, 'mood': context.mood}
+                )
+            continue
+        anomalies = context.anomalies
+        conversations.append(Conversation(
+            user=context.user,
+            conversation_type=context.conversation_type,
+            mood=context.mood,
+            content=ai_result['content'],
+            ai_model_used=ai_result['model_used'],
+            generation_prompt=ai_result['generation_prompt'],
+            generation_tokens=ai_result['tokens_used'],
+            generation_cost=ai_result['cost'],
+            generation_status='completed',
+            input_fingerprint=context.fingerprint,
+            trigger_data={
+                'anomalies': [
+                    {'metric': a.metric, 'value': a.value, 'expected': a.expected, 'z_score': a.z_score}
+                    for a in anomalies
+                ]
+            } if anomalies else {}
+        ))
+        saved_contexts.append(context)
+        context.conversation = conversations[-1]
+    
+    if not conversations:
+        return 0
+    
+    with transaction.atomic():
+        Conversation.objects.bulk_create(conversations)
+        
+        # Link participants
+        DeviceThrough = Conversation.participating_devices.through
+        AppThrough = Conversation.participating_apps.through
+        TriggerThrough = Conversation.triggers.through
+        DeviceThrough.objects.bulk_create([
+            DeviceThrough(conversation_id=conversation.id, device_id=device.id)
+            for conversation, context in zip(conversations, saved_contexts)
+            for device in context.devices
+        ])
+        AppThrough.objects.bulk_create([
+            AppThrough(conversation_id=conversation.id, deviceapp_id=device_app.id)
+            for conversation, context in zip(conversations, saved_contexts)
+            for device_app in context.device_apps
+        ])
+        TriggerThrough.objects.bulk_create([
+            TriggerThrough(conversation_id=conversation.id, conversationtrigger_id=trigger.id)
+            for conversation, context in zip(conversations, saved_contexts)
+            for trigger in context.triggers
+        ])
+        for conversation, context in zip(conversations, saved_contexts):
+            if context.anomalies:
+                UsageAnomaly.objects.filter(
+                    id__in=[a.id for a in context.anomalies]
+                ).update(conversation=conversation)
+    
+    for conversation in conversations:
+        logger.info(f"Generated conversation {conversation.id} for user {conversation.user_id}")
+    return len(conversations)
+
+
 @shared_task(name='apps.ai_engine.tasks.generate_daily_journals')
-def generate_daily_journals():
+def generate_daily_journals(user_ids=None, date=None, force=False):
     """
-    Generate device and app journals for previous day
-    Runs at 11 PM daily
+    Generate today's device and app journals for all users, or for a
+    pipeline shard's users for their local day `date` once it has ended
+    (see analytics.tasks.dispatch_daily_pipeline)
+    
+    Journals already generated from the same inputs are kept unless force
+    is set.
     """
     logger.info("Starting daily journal generation")
     
-    today = timezone.now().date()
-    generated_count = 0
-    error_count = 0
+    from django.utils.dateparse import parse_date
     
-    # Generate device journals
-    devices = Device.objects.filter(
-        is_active=True,
-        usage_data__date=today
-    ).distinct()
+    date = parse_date(date) if isinstance(date, str) else date
+    today = date or timezone.now().date()
+    if settings.AI_BATCH_MODE:
+        return submit_generation_batch('journals', today, user_ids, force)
     
-    for device in devices:
-        try:
-            result = generate_device_journal_entry(device, today)
-            if result:
-                generated_count += 1
-            else:
-                error_count += 1
-        except Exception as e:
-            logger.error(f"Error generating device journal for {device.id}: {str(e)}")
-            error_count += 1
+    generated_count = 0
+    skipped_count = 0
+    error_count = 0
     
-    # Generate app journals (for top apps only)
-    # Query AppUsage directly since there's no direct link through DeviceApp
-    top_app_usage = AppUsage.objects.filter(
-        date=today
-    ).values('device_app').annotate(
-        total_time=Sum('time_spent_minutes')
-    ).order_by('-total_time')[:50]
+    # Device journals for the devices of today's active users
+    for chunk in active_user_chunks(today, user_ids=user_ids):
+        devices = journal_devices(chunk, today)
+        
+        contexts = prepare_device_journals(devices, today)
+        error_count += len(devices) - len(contexts)
+        contexts, unchanged = split_unchanged('device_journal', contexts, force)
+        skipped_count += len(unchanged)
+        results = AIGenerationService.generate_many([context.request for context in contexts])
+        saved = save_device_journals(list(zip(contexts, results)))
+        generated_count += saved
+        error_count += len(contexts) - saved
     
-    device_app_ids = [item['device_app'] for item in top_app_usage]
-    top_device_apps = DeviceApp.objects.filter(id__in=device_app_ids)
+    # Generate app journals (for each user's top apps only)
+    top_device_apps = journal_device_apps(today, user_ids=user_ids)
     
-    for device_app in top_device_apps:
-        try:
-            result = generate_app_journal_entry(device_app, today)
-            if result:
-                generated_count += 1
-            else:
-                error_count += 1
-        except Exception as e:
-            logger.error(f"Error generating app journal for {device_app.id}: {str(e)}")
-            error_count += 1
+    contexts = prepare_app_journals(top_device_apps, today)
+    error_count += len(top_device_apps) - len(contexts)
+    contexts, unchanged = split_unchanged('app_journal', contexts, force)
+    skipped_count += len(unchanged)
+    saved = save_app_journals(generate_app_journals(contexts))
+    generated_count += saved
+    error_count += len(contexts) - saved
     
-    logger.info(f"Daily journal generation complete: {generated_count} success, {error_count} errors")
+    logger.info(
+        f"Daily journal generation complete: {generated_count} success, "
+        f"{skipped_count} unchanged, {error_count} errors"
+    )
     return {
         'success': generated_count,
+        'skipped': skipped_count,
         'errors': error_count,
         'date': str(today)
     }
 
 
-def generate_device_journal_entry(device, date):
-    """Generate a journal entry for a device"""
-    try:
-        # Get usage summary
-        print(f"task - started generating journal for device")
+def journal_devices(user_ids, date):
+    """Active devices of the given users with usage on a date"""
+    return list(Device.objects.filter(
+        user_id__in=user_ids,
+        is_active=True,
+        usage_data__date=date
+    ).distinct())
+
+
+JOURNAL_APPS_PER_USER = 3  # Most used apps of each user that get an app journal
+
 
-        usage = UsageData.objects.filter(device=device, date=date).first()
-        if not usage:
-            print(f"task usage false")
-            print(usage)
+def journal_device_apps(date, limit=JOURNAL_APPS_PER_USER, user_ids=None):
+    """
+    Each user's `limit` most used apps of a date (optionally of some users
+    only), which get app journals
+    
+    One query: the date's AppUsage rows (one per app) are ranked within each
+    user by time spent and the top ones kept.
+    """
+    # Query AppUsage directly since there's no direct link through DeviceApp
+    app_usage = AppUsage.objects.filter(date=date)
+    if user_ids is not None:
+        app_usage = app_usage.filter(device_app__device__user_id__in=user_ids)
+    top_app_usage = app_usage.annotate(rank=Window(
+        RowNumber(),
+        partition_by=F('device_app__device__user_id'),
+        order_by=[F('time_spent_minutes').desc(), F('device_app_id')]
+    )).filter(rank__lte=limit).values('device_app_id')
+    
+    return list(DeviceApp.objects.filter(id__in=top_app_usage).select_related('app'))
+
+
+def prepare_device_journals(devices, date):
+    """Gather journal context and AI requests for devices with usage on a date"""
+    return load_device_journal_contexts(devices, date)
+
+
+def save_device_journals(generated):
+    """Upsert (context, ai_result) pairs as device journals in one query, queueing transient failures for retry"""
+    journals = [
+        DeviceJournal(
+            device=context.device,
+            date=context.date,
+            content=ai_result['content'],
+            mood='satisfied',  # Valid choice from model
+            generation_prompt=ai_result['generation_prompt'],
+            input_fingerprint=context.fingerprint,
+            ai_generated=True
+        )
+        for context, ai_result in generated
+        if ai_result['success']
+    ]
+    for context, ai_result in generated:
+        if not ai_result['success']:
+            logger.error(f"Error generating device journal for {context.device.id}: {ai_result.get('error')}")
+            if ai_result.get('retryable'):
+                schedule_retry('device_journal', context.device.id, context.date, ai_result.get('error'))
+    if journals:
+        DeviceJournal.objects.bulk_create(
+            journals,
+            update_conflicts=True,
+            unique_fields=['device', 'date'],
+            update_fields=['content', 'mood', 'generation_prompt', 'input_fingerprint', 'ai_generated', 'updated_at']
+        )
+    return len(journals)
+
+
+def generate_device_journal_entry(device, date, force=False):
+    """
+    Generate a journal entry for a device
+    
+    Returns UNCHANGED without generating when the saved entry came from the
+    same inputs; force=True regenerates it, bypassing the generation cache too.
+    """
+    try:
+        contexts = prepare_device_journals([device], date)
+        if not contexts:
             return False
-        print(f"task usage")
-        usage_summary = {
-            'screen_time': usage.total_screen_time,
-            'unlocks': usage.unlock_count
-        }
-        
-        # Notable events
-        notable_events = []
-        if usage.unlock_count > 100:
-            notable_events.append("Very active day with lots of unlocks")
-        if usage.total_screen_time > 360:
-            notable_events.append("Heavy usage day")
+        if not split_unchanged('device_journal', contexts, force)[0]:
+            logger.info(f"Device journal inputs unchanged for {device.name} on {date}, skipping")
+            return UNCHANGED
         
-        # Get top apps used today
-        top_app_usage = AppUsage.objects.filter(
-            device_app__device=device,
-            date=date
-        ).order_by('-time_spent_minutes')[:3]
-        
-        top_apps = [au.device_app for au in top_app_usage]
-        
-        # Generate journal
-        ai_result = AIGenerationService.generate_device_journal(
-            device=device,
-            date=date,
-            usage_summary=usage_summary,
-            notable_events=notable_events,
-            mentioned_apps=list(top_apps)
-        )
-        if ai_result['success']:
-            # Use update_or_create to avoid duplicate entries
-            DeviceJournal.objects.update_or_create(
-                device=device,
-                date=date,
-                defaults={
-                    'content': ai_result['content'],
-                    'mood': 'satisfied',  # Valid choice from model
-                    'generation_prompt': ai_result['generation_prompt'],
-                    'ai_generated': True  # Correct field name
-                }
-            )
+        ai_result = AIGenerationService.generate(contexts[0].request, use_cache=not force)
+        if save_device_journals([(contexts[0], ai_result)]):
             logger.info(f"Generated/updated device journal for {device.name} on {date}")
             return True
         
@@ -271,48 +428,108 @@ def generate_device_journal_entry(device, date):
         return False
 
 
-def generate_app_journal_entry(device_app, date):
-    """Generate a journal entry for an app"""
+def prepare_app_journals(device_apps, date):
+    """Gather journal context and AI requests for apps with usage on a date"""
+    return load_app_journal_contexts(device_apps, date)
+
+
+def generate_app_journals(contexts, pack_size=None):
+    """
+    Generate app journals, packing several apps of a device into one request
+    
+    Apps are grouped by device in packs of up to AI_JOURNAL_PACK_SIZE. Packed
+    responses are split back into per-app results; apps whose entry is
+    missing or malformed (or whose pack failed) fall back to an individual
+    request. Returns (context, ai_result) pairs.
+    """
+    pack_size = pack_size or settings.AI_JOURNAL_PACK_SIZE
+    
+    by_device = {}
+    for context in contexts:
+        by_device.setdefault(context.device_app.device_id, []).append(context)
+    packs = []
+    singles = []
+    for device_contexts in by_device.values():
+        for i in range(0, len(device_contexts), pack_size):
+            pack = device_contexts[i:i + pack_size]
+            (packs if len(pack) > 1 else singles).append(pack)
+    
+    generated = []
+    fallback = [pack[0] for pack in singles]
+    requests = [
+        AIGenerationService.build_app_journals_request(
+            pack[0].date,
+            [(context.device_app, context.usage_stats, context.session_highlights) for context in pack]
+        )
+        for pack in packs
+    ]
+    for pack, result in zip(packs, AIGenerationService.generate_many(requests)):
+        items = AIGenerationService.parse_app_journals(result['content'], len(pack)) if result['success'] else {}
+        for i, context in enumerate(pack):
+            if i not in items:
+                fallback.append(context)
+                continue
+            generated.append((context, {
+                **items[i],
+                'model_used': result['model_used'],
+                'generation_prompt': context.request['messages'][-1]['content'],
+                'success': True
+            }))
+    
+    if len(fallback) > len(singles):
+        logger.info(f"Packed app journals: {len(fallback) - len(singles)} entries fell back to single requests")
+    results = AIGenerationService.generate_many([context.request for context in fallback])
+    generated.extend(zip(fallback, results))
+    return generated
+
+
+def save_app_journals(generated):
+    """Upsert (context, ai_result) pairs as app journals in one query, queueing transient failures for retry"""
+    journals = [
+        AppJournal(
+            device_app=context.device_app,
+            date=context.date,
+            content=ai_result['content'],
+            mood=ai_result.get('mood', 'satisfied'),  # Packed journals pick their own mood
+            generation_prompt=ai_result['generation_prompt'],
+            input_fingerprint=context.fingerprint,
+            ai_generated=True
+        )
+        for context, ai_result in generated
+        if ai_result['success']
+    ]
+    for context, ai_result in generated:
+        if not ai_result['success']:
+            logger.error(f"Error generating app journal for {context.device_app.id}: {ai_result.get('error')}")
+            if ai_result.get('retryable'):
+                schedule_retry('app_journal', context.device_app.id, context.date, ai_result.get('error'))
+    if journals:
+        AppJournal.objects.bulk_create(
+            journals,
+            update_conflicts=True,
+            unique_fields=['device_app', 'date'],
+            update_fields=['content', 'mood', 'generation_prompt', 'input_fingerprint', 'ai_generated', 'updated_at']
+        )
+    return len(journals)
+
+
+def generate_app_journal_entry(device_app, date, force=False):
+    """
+    Generate a journal entry for an app
+    
+    Returns UNCHANGED without generating when the saved entry came from the
+    same inputs; force=True regenerates it, bypassing the generation cache too.
+    """
     try:
-        # Get usage stats for this app
-        app_usage = AppUsage.objects.filter(
-            device_app=device_app,
-            date=date
-        ).first()
-        
-        if not app_usage:
+        contexts = prepare_app_journals([device_app], date)
+        if not contexts:
             return False
+        if not split_unchanged('app_journal', contexts, force)[0]:
+            logger.info(f"App journal inputs unchanged for {device_app.display_name} on {date}, skipping")
+            return UNCHANGED
         
-        usage_stats = {
-            'time_spent': app_usage.time_spent_minutes,
-            'launch_count': app_usage.launch_count
-        }
-        
-        session_highlights = []
-        if app_usage.time_spent_minutes > 120:
-            session_highlights.append("Power user session")
-        if app_usage.launch_count > 20:
-            session_highlights.append("Frequently opened")
-        
-        # Generate journal
-        ai_result = AIGenerationService.generate_app_journal(
-            device_app=device_app,
-            date=date,
-            usage_stats=usage_stats,
-            session_highlights=session_highlights
-        )
-        if ai_result['success']:
-            # Use update_or_create to avoid duplicate entries
-            AppJournal.objects.update_or_create(
-                device_app=device_app,
-                date=date,
-                defaults={
-                    'content': ai_result['content'],
-                    'mood': 'satisfied',  # Valid choice from model
-                    'generation_prompt': ai_result['generation_prompt'],
-                    'ai_generated': True  # Correct field name
-                }
-            )
+        ai_result = AIGenerationService.generate(contexts[0].request, use_cache=not force)
+        if save_app_journals([(contexts[0], ai_result)]):
             logger.info(f"Generated/updated app journal for {device_app.display_name} on {date}")
             return True
         
@@ -324,20 +541,21 @@ def generate_app_journal_entry(device_app, date):
 
 
 @shared_task(name='apps.ai_engine.tasks.generate_conversation_on_demand')
-def generate_conversation_on_demand(user_id, conversation_type='daily_recap', mood='humorous'):
+def generate_conversation_on_demand(user_id, conversation_type=None, mood=None, date=None, force=False):
     """
     Generate a conversation on demand for a specific user
-    Can be triggered manually or by specific events
+    Can be triggered manually or by specific events (e.g. usage anomalies)
     """
     from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
     User = get_user_model()
     
     try:
         user = User.objects.get(id=user_id)
-        date = timezone.now().date()
+        date = parse_date(date) if date else timezone.now().date()
         
-        result = generate_conversation_for_user(user, date)
-        return {'success': result, 'user_id': user_id}
+        result = generate_conversation_for_user(user, date, conversation_type, mood, force)
+        return {'success': bool(result), 'unchanged': result == UNCHANGED, 'user_id': user_id}
         
     except User.DoesNotExist:
         logger.error(f"User {user_id} not found")
@@ -345,3 +563,515 @@ def generate_conversation_on_demand(user_id, conversation_type='daily_recap', mo
     except Exception as e:
         logger.error(f"Error in on-demand conversation generation: {str(e)}")
         return {'success': False, 'error': str(e)}
+
+
+@shared_task(name='apps.ai_engine.tasks.retry_failed_generations')
+def retry_failed_generations(batch_size=None):
+    """
+    Retry due GenerationRetry jobs
+    Runs every 10 minutes at low priority, with reduced concurrency so
+    retries never crowd out fresh generation
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    
+    breaker = get_circuit_breaker()
+    if breaker.is_open():
+        logger.info(f"Skipping generation retries: circuit open for {breaker.name}")
+        return {'retried': 0, 'skipped': 'circuit open'}
+    
+    jobs = list(GenerationRetry.objects.filter(
+        status='pending',
+        next_attempt_at__lte=timezone.now()
+    ).order_by('next_attempt_at')[:batch_size or settings.AI_RETRY_BATCH_SIZE])
+    if not jobs:
+        return {'retried': 0}
+    
+    def ids(kind):
+        return [job.target_id for job in jobs if job.kind == kind]
+    
+    users = {str(user.id): user for user in User.objects.filter(id__in=ids('conversation'))}
+    devices = {str(device.id): device for device in Device.objects.filter(id__in=ids('device_journal'))}
+    device_apps = {
+        str(device_app.id): device_app
+        for device_app in DeviceApp.objects.filter(id__in=ids('app_journal')).select_related('app')
+    }
+    
+    # Rebuild each job's context; targets that vanished or have no data left are dropped
+    prepared = {'conversation': [], 'device_journal': [], 'app_journal': []}
+    finished = []
+    for job in jobs:
+        context = None
+        try:
+            if job.kind == 'conversation' and job.target_id in users:
+                context = prepare_conversation(
+                    users[job.target_id], job.date,
+                    job.options.get('conversation_type'), job.options.get('mood')
+                )
+            elif job.kind == 'device_journal' and job.target_id in devices:
+                context = next(iter(prepare_device_journals([devices[job.target_id]], job.date)), None)
+            elif job.kind == 'app_journal' and job.target_id in device_apps:
+                context = next(iter(prepare_app_journals([device_apps[job.target_id]], job.date)), None)
+        except Exception as e:
+            logger.error(f"Error preparing retry {job.id}: {str(e)}")
+        if context:
+            prepared[job.kind].append((job, context))
+        else:
+            job.status, job.last_error = 'failed', 'Nothing to generate'
+            finished.append(job)
+    
+    succeeded = 0
+    # Targets regenerated from the same inputs since the failure need nothing more
+    for kind, pairs in prepared.items():
+        changed = set(map(id, split_unchanged(kind, [context for _, context in pairs])[0]))
+        for job, context in pairs:
+            if id(context) not in changed:
+                job.status = 'succeeded'
+                finished.append(job)
+                succeeded += 1
+        prepared[kind] = [(job, context) for job, context in pairs if id(context) in changed]
+    
+    savers = {
+        'conversation': save_conversations,
+        'device_journal': save_device_journals,
+        'app_journal': save_app_journals,
+    }
+    for kind, pairs in prepared.items():
+        if not pairs:
+            continue
+        results = AIGenerationService.generate_many(
+            [context.request for _, context in pairs],
+            concurrency=settings.AI_RETRY_CONCURRENCY,
+            use_cache=kind != 'conversation'
+        )
+        # Failures are re-queued (bumping the pending job) by the save functions
+        savers[kind]([(context, result) for (_, context), result in zip(pairs, results)])
+        for (job, _), result in zip(pairs, results):
+            if result['success']:
+                job.status = 'succeeded'
+                finished.append(job)
+                succeeded += 1
+            elif not result.get('retryable'):
+                job.status, job.last_error = 'failed', result.get('error', '')
+                finished.append(job)
+    
+    GenerationRetry.objects.bulk_update(finished, ['status', 'last_error', 'updated_at'])
+    
+    logger.info(f"Generation retries complete: {succeeded} of {len(jobs)} succeeded")
+    return {'retried': len(jobs), 'succeeded': succeeded}
+
+
+BATCH_INGEST_CHUNK_SIZE = 500
+
+
+def submit_generation_batch(kind, date, user_ids=None, force=False):
+    """
+    Submit a night's conversation or journal requests (for all users, or
+    a pipeline shard's) as one provider batch
+    
+    The contexts are prepared as for the synchronous run, leaving out
+    unchanged targets unless forced; each request gets a custom_id and the
+    batch records what to save its result as, so ingestion can rebuild the
+    contexts without preparing them again.
+    """
+    from django.contrib.auth import get_user_model
+    from apps.ai_engine.batches import write_batch_file, get_batch_provider
+    User = get_user_model()
+    
+    entries = []
+    items = {}
+    
+    def add(custom_id, context, **item):
+        entries.append((custom_id, context.request))
+        items[custom_id] = {
+            **item,
+            'model': context.request['model'],
+            'prompt': context.request['messages'][-1]['content'],
+            'fingerprint': context.fingerprint,
+            # Below the built-in limit, so a truncated result is worth retrying
+            'capped': context.request.get('max_tokens', 0) < context.request.get('_max_tokens_limit', 0)
+        }
+    
+    for chunk in active_user_chunks(date, user_ids=user_ids):
+        if kind == 'conversations':
+            try:
+                contexts = load_conversation_contexts(User.objects.filter(id__in=chunk), date)
+            except Exception as e:
+                logger.error(f"Error preparing conversations for {len(chunk)} users: {str(e)}")
+                continue
+            for context in split_unchanged('conversation', contexts, force)[0]:
+                add(
+                    f"conversation:{context.user.id}", context,
+                    kind='conversation',
+                    target_id=str(context.user.id),
+                    conversation_type=context.conversation_type,
+                    mood=context.mood,
+                    device_ids=[str(device.id) for device in context.devices],
+                    device_app_ids=[str(device_app.id) for device_app in context.device_apps],
+                    trigger_ids=[str(trigger.id) for trigger in context.triggers],
+                    anomaly_ids=[str(anomaly.id) for anomaly in context.anomalies]
+                )
+        else:
+            contexts = prepare_device_journals(journal_devices(chunk, date), date)
+            for context in split_unchanged('device_journal', contexts, force)[0]:
+                add(
+                    f"device_journal:{context.device.id}", context,
+                    kind='device_journal', target_id=str(context.device.id)
+                )
+    if kind == 'journals':
+        contexts = prepare_app_journals(journal_device_apps(date, user_ids=user_ids), date)
+        for context in split_unchanged('app_journal', contexts, force)[0]:
+            add(
+                f"app_journal:{context.device_app.id}", context,
+                kind='app_journal', target_id=str(context.device_app.id)
+            )
+    
+    if not entries:
+        logger.info(f"No {kind} to submit for {date}")
+        return {'batch_id': None, 'requests': 0, 'date': str(date)}
+    
+    provider = get_batch_provider()
+    path = write_batch_file(entries)
+    batch = GenerationBatch.objects.create(
+        kind=kind,
+        date=date,
+        provider=provider.name,
+        items=items,
+        request_count=len(entries)
+    )
+    try:
+        batch.provider_batch_id = provider.submit(path)
+    except Exception as e:
+        logger.error(f"Error submitting {kind} batch {batch.id}: {str(e)}")
+        batch.status = 'failed'
+        batch.error_message = str(e)
+        batch.save(update_fields=['status', 'error_message'])
+        # Nothing was sent; fall back to per-target retries
+        for item in items.values():
+            schedule_retry(item['kind'], item['target_id'], date, str(e), _retry_options(item))
+        return {'batch_id': batch.id, 'requests': 0, 'error': str(e), 'date': str(date)}
+    batch.save(update_fields=['provider_batch_id'])
+    
+    logger.info(f"Submitted {kind} batch {batch.provider_batch_id} with {len(entries)} requests for {date}")
+    return {'batch_id': batch.id, 'requests': len(entries), 'date': str(date)}
+
+
+def _retry_options(item):
+    if item['kind'] == 'conversation':
+        return {'conversation_type': item['conversation_type'], 'mood': item['mood']}
+    return None
+
+
+def _batch_result(item, output):
+    """Generation result for one batch item from its output record (None if it has none)"""
+    from openai.types.chat import ChatCompletion
+    from apps.ai_engine.batches import BATCH_COST_FACTOR
+    
+    if output is None:
+        return {'content': '', 'error': 'No result in batch output', 'retryable': True, 'success': False}
+    status_code = output['status_code'] or 0
+    if status_code != 200 or not output['body']:
+        return {
+            'content': '',
+            'error': output['error'] or f"Batch request failed with status {status_code}",
+            'retryable': status_code == 429 or status_code >= 500 or not status_code,
+            'success': False
+        }
+    try:
+        response = ChatCompletion.model_validate(output['body'])
+        request = {'model': item['model'], 'messages': [{'role': 'user', 'content': item['prompt']}]}
+        result = AIGenerationService._build_result(request, response)
+    except Exception as e:
+        return {'content': '', 'error': f"Malformed batch response: {str(e)}", 'retryable': False, 'success': False}
+    if result['truncated'] and item.get('capped'):
+        # Cut short by the adaptive cap; the retry runs with the built-in limit
+        return {'content': '', 'error': 'Truncated by max_tokens', 'retryable': True, 'success': False}
+    result['cost'] *= BATCH_COST_FACTOR
+    return result
+
+
+def _batch_contexts(items, date):
+    """Rebuild save contexts for batch items with one query per model"""
+    from django.contrib.auth import get_user_model
+    from apps.conversations.models import ConversationTrigger
+    from apps.usage.models import UsageAnomaly
+    User = get_user_model()
+    
+    def ids(kind, field='target_id'):
+        values = set()
+        for item in items.values():
+            if item['kind'] == kind:
+                values.update(item[field] if isinstance(item[field], list) else [item[field]])
+        return values
+    
+    def by_id(queryset, id_list):
+        # Item ids are stored as strings (JSON)
+        return {str(pk): obj for pk, obj in queryset.in_bulk(id_list).items()}
+    
+    users = by_id(User.objects, ids('conversation'))
+    devices = by_id(Device.objects, ids('conversation', 'device_ids') | ids('device_journal'))
+    device_apps = by_id(
+        DeviceApp.objects.select_related('app'),
+        ids('conversation', 'device_app_ids') | ids('app_journal')
+    )
+    triggers = by_id(ConversationTrigger.objects, ids('conversation', 'trigger_ids'))
+    anomalies = by_id(UsageAnomaly.objects, ids('conversation', 'anomaly_ids'))
+    
+    contexts = {}
+    for custom_id, item in items.items():
+        if item['kind'] == 'conversation' and item['target_id'] in users:
+            contexts[custom_id] = ConversationContext(
+                users[item['target_id']], date,
+                [devices[i] for i in item['device_ids'] if i in devices],
+                [device_apps[i] for i in item['device_app_ids'] if i in device_apps],
+                item['conversation_type'],
+                item['mood'],
+                triggers=[triggers[i] for i in item['trigger_ids'] if i in triggers],
+                anomalies=[anomalies[i] for i in item['anomaly_ids'] if i in anomalies],
+                fingerprint=item.get('fingerprint', ''),
+            )
+        elif item['kind'] == 'device_journal' and item['target_id'] in devices:
+            contexts[custom_id] = DeviceJournalContext(
+                devices[item['target_id']], date, fingerprint=item.get('fingerprint', '')
+            )
+        elif item['kind'] == 'app_journal' and item['target_id'] in device_apps:
+            contexts[custom_id] = AppJournalContext(
+                device_apps[item['target_id']], date, fingerprint=item.get('fingerprint', '')
+            )
+    return contexts
+
+
+def ingest_generation_batch(batch, info):
+    """
+    Save a finished batch's results as conversations and journals
+    
+    Items without a successful response (including everything a failed or
+    expired batch never got to) go through the usual failure handling, so
+    transient ones are queued as GenerationRetry jobs. Each chunk is saved
+    together with its custom_ids in batch.ingested_ids, and items already
+    listed there are skipped, so ingesting a batch again never duplicates a
+    result. Returns the number saved.
+    """
+    from apps.ai_engine.batches import parse_batch_output, get_batch_provider
+    
+    provider = get_batch_provider()
+    outputs = {}
+    for file_id in (info.get('output_file_id'), info.get('error_file_id')):
+        if file_id:
+            outputs.update(parse_batch_output(provider.download(file_id)))
+    
+    savers = {
+        'conversation': save_conversations,
+        'device_journal': save_device_journals,
+        'app_journal': save_app_journals,
+    }
+    ingested = set(batch.ingested_ids)
+    custom_ids = [custom_id for custom_id in batch.items if custom_id not in ingested]
+    succeeded = batch.succeeded_count
+    for i in range(0, len(custom_ids), BATCH_INGEST_CHUNK_SIZE):
+        items = {custom_id: batch.items[custom_id] for custom_id in custom_ids[i:i + BATCH_INGEST_CHUNK_SIZE]}
+        contexts = _batch_contexts(items, batch.date)
+        generated = {kind: [] for kind in savers}
+        for custom_id, item in items.items():
+            if custom_id in contexts:
+                generated[item['kind']].append(
+                    (contexts[custom_id], _batch_result(item, outputs.get(custom_id)))
+                )
+        with transaction.atomic():
+            for kind, pairs in generated.items():
+                if pairs:
+                    succeeded += savers[kind](pairs)
+            batch.ingested_ids.extend(items)
+            batch.succeeded_count = succeeded
+            GenerationBatch.objects.filter(pk=batch.pk).update(
+                ingested_ids=batch.ingested_ids, succeeded_count=succeeded, claimed_at=timezone.now()
+            )
+    
+    batch.succeeded_count = succeeded
+    batch.failed_count = batch.request_count - succeeded
+    batch.completed_at = timezone.now()
+    return succeeded
+
+
+def fail_batch_ingestion(batch, error):
+    """
+    Mark a batch whose ingestion broke off as failed
+    
+    Chunks already saved stay saved; every item not in ingested_ids is queued
+    as a GenerationRetry job instead of being ingested again.
+    """
+    batch.refresh_from_db(fields=['ingested_ids', 'succeeded_count'])
+    ingested = set(batch.ingested_ids)
+    pending = [item for custom_id, item in batch.items.items() if custom_id not in ingested]
+    for item in pending:
+        schedule_retry(item['kind'], item['target_id'], batch.date, error, _retry_options(item))
+    
+    batch.status = 'failed'
+    batch.error_message = f"Ingestion failed: {error}"
+    batch.failed_count = batch.request_count - batch.succeeded_count
+    batch.completed_at = timezone.now()
+    batch.save(update_fields=['status', 'error_message', 'failed_count', 'completed_at'])
+    logger.info(f"Queued {len(pending)} items of batch {batch.provider_batch_id} for retry")
+
+
+@shared_task(name='apps.ai_engine.tasks.poll_generation_batches')
+def poll_generation_batches():
+    """
+    Check submitted generation batches and ingest the finished ones
+    Runs every 15 minutes
+    
+    A batch whose ingestion hasn't made progress for longer than a task may
+    run lost its worker, and is claimed again; ingested_ids keeps the second
+    attempt from saving anything twice.
+    """
+    from apps.ai_engine.batches import TERMINAL_FAILURE_STATUSES, get_batch_provider
+    
+    provider = get_batch_provider()
+    ingested = 0
+    stale_before = timezone.now() - timedelta(seconds=settings.CELERY_TASK_TIME_LIMIT)
+    batches = GenerationBatch.objects.filter(provider=provider.name).filter(
+        Q(status='submitted') | Q(status='ingesting', claimed_at__lt=stale_before)
+    ).order_by('created_at')
+    for batch in batches:
+        try:
+            info = provider.retrieve(batch.provider_batch_id)
+        except Exception as e:
+            logger.error(f"Error polling batch {batch.provider_batch_id}: {str(e)}")
+            continue
+        if info['status'] != 'completed' and info['status'] not in TERMINAL_FAILURE_STATUSES:
+            continue
+        
+        # Claim the batch so an overlapping poll doesn't ingest it twice
+        claimed_at = timezone.now()
+        if not GenerationBatch.objects.filter(
+            pk=batch.pk, status=batch.status, claimed_at=batch.claimed_at
+        ).update(status='ingesting', claimed_at=claimed_at):
+            continue
+        if batch.status == 'ingesting':
+            logger.warning(f"Resuming ingestion of batch {batch.provider_batch_id} claimed at {batch.claimed_at}")
+        batch.status, batch.claimed_at = 'ingesting', claimed_at
+        try:
+            saved = ingest_generation_batch(batch, info)
+        except Exception as e:
+            logger.error(f"Error ingesting batch {batch.provider_batch_id}: {str(e)}")
+            fail_batch_ingestion(batch, str(e))
+            continue
+        
+        if info['status'] == 'completed':
+            batch.status = 'ingested'
+        else:
+            batch.status = 'failed'
+            batch.error_message = f"Batch {info['status']}"
+        batch.save(update_fields=['status', 'error_message', 'succeeded_count', 'failed_count', 'completed_at'])
+        ingested += 1
+        logger.info(
+            f"Ingested {batch.kind} batch {batch.provider_batch_id}: "
+            f"{saved} of {batch.request_count} saved ({info['status']})"
+        )
+    
+    return {'ingested': ingested}
+
+
+def create_generation_job(user, kind, date, options=None):
+    """
+    Create a manual generation job for a user and queue one task per target
+    
+    A trigger while an identical job (same user, kind and date) is still
+    pending or running returns that job instead. Returns (job, created).
+    """
+    active = GenerationJob.objects.filter(user=user, kind=kind, date=date, status__in=['pending', 'running'])
+    # A job untouched for longer than a task may run lost its worker; don't coalesce onto it
+    stale_before = timezone.now() - timedelta(seconds=settings.CELERY_TASK_TIME_LIMIT)
+    active.filter(updated_at__lt=stale_before).update(status='failed', finished_at=timezone.now())
+    
+    job = active.first()
+    if job:
+        return job, False
+    
+    if kind == 'conversations':
+        targets = [('conversation', user.id, user.username)]
+    else:
+        devices = Device.objects.filter(user=user, is_active=True)
+        # The same apps the nightly run journals, so unchanged ones are skipped by either
+        top_apps = journal_device_apps(date, user_ids=[user.id])
+        targets = [('device_journal', device.id, device.name) for device in devices]
+        targets += [('app_journal', device_app.id, device_app.display_name) for device_app in top_apps]
+    
+    try:
+        with transaction.atomic():
+            job = GenerationJob.objects.create(
+                user=user,
+                kind=kind,
+                date=date,
+                options=options or {},
+                status='pending' if targets else 'completed',
+                finished_at=None if targets else timezone.now()
+            )
+            items = GenerationJobItem.objects.bulk_create([
+                GenerationJobItem(job=job, kind=item_kind, target_id=str(target_id), target_name=name)
+                for item_kind, target_id, name in targets
+            ])
+            transaction.on_commit(lambda: [run_generation_job_item.delay(item.id) for item in items])
+    except IntegrityError:
+        # A concurrent trigger created the job first; it may have finished already
+        return GenerationJob.objects.filter(user=user, kind=kind, date=date).first(), False
+    
+    logger.info(f"Queued {kind} job {job.id} for user {user.id} with {len(targets)} targets")
+    return job, True
+
+
+@shared_task(name='apps.ai_engine.tasks.run_generation_job_item')
+def run_generation_job_item(item_id):
+    """
+    Generate one target of a GenerationJob and update the job's status
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    
+    try:
+        item = GenerationJobItem.objects.select_related('job').get(id=item_id)
+    except GenerationJobItem.DoesNotExist:
+        logger.error(f"Generation job item {item_id} not found")
+        return {'success': False, 'error': 'Item not found'}
+    job = item.job
+    if item.status != 'pending':
+        return {'success': item.status in ('succeeded', 'skipped'), 'skipped': True}
+    
+    GenerationJobItem.objects.filter(id=item.id).update(status='running', updated_at=timezone.now())
+    GenerationJob.objects.filter(id=job.id, status='pending').update(status='running', updated_at=timezone.now())
+    
+    force = bool(job.options.get('force'))
+    success = False
+    try:
+        if item.kind == 'conversation':
+            success = generate_conversation_for_user(
+                User.objects.get(id=item.target_id), job.date,
+                job.options.get('conversation_type'), job.options.get('mood'), force
+            )
+        elif item.kind == 'device_journal':
+            success = generate_device_journal_entry(Device.objects.get(id=item.target_id), job.date, force)
+        elif item.kind == 'app_journal':
+            success = generate_app_journal_entry(
+                DeviceApp.objects.select_related('app').get(id=item.target_id), job.date, force
+            )
+        error = '' if success else 'Nothing was generated (no usage data, or the AI request failed)'
+    except Exception as e:
+        logger.error(f"Error running generation job item {item.id}: {str(e)}")
+        error = str(e)
+    
+    GenerationJobItem.objects.filter(id=item.id).update(
+        # skipped: nothing to do, the saved content came from the same inputs
+        status='skipped' if success == UNCHANGED else 'succeeded' if success else 'failed',
+        error_message=error,
+        updated_at=timezone.now()
+    )
+    
+    # The last item to finish settles the job
+    statuses = set(job.items.values_list('status', flat=True))
+    if not statuses & {'pending', 'running'}:
+        GenerationJob.objects.filter(id=job.id, status__in=['pending', 'running']).update(
+            status='completed' if statuses & {'succeeded', 'skipped'} else 'failed',
+            finished_at=timezone.now(),
+            updated_at=timezone.now()
+        )
+    return {'success': success, 'job_id': job.id}
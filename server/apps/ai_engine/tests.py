@@ -1,3 +1,285 @@
-from django.test import TestCase
+import json
+import random
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.ai_engine import client, prompts, tasks
+from apps.ai_engine.batches import LocalBatchProvider, write_batch_file
+from apps.ai_engine.fake_provider import FakeProvider, start_fake_provider
+from apps.ai_engine.ratelimit import LocalBucketStore, RateLimiter, RateLimitTimeout, parse_duration
+from apps.ai_engine.services import AIGenerationService
+from apps.conversations.models import DeviceJournal
+from apps.devices.models import Device, DeviceType
+from apps.usage.models import UsageData
+from apps.ai_engine.models import ConversationPrompt, GenerationBatch, GenerationJob
 
-# Create your tests here.
+
+@override_settings(AI_PROMPT_VERSION_CHECK_INTERVAL=0)
+class PromptVersionTests(TestCase):
+
+    def setUp(self):
+        prompts.reset_prompt_set()
+
+    def test_edit_from_another_process_is_picked_up(self):
+        prompt = ConversationPrompt.objects.create(name='conversation_base', template='first')
+        self.assertEqual(prompts.get_prompt_set().fragments['conversation_base'], 'first')
+
+        # A queryset update sends no signal, like a save in another process
+        ConversationPrompt.objects.filter(pk=prompt.pk).update(template='second', updated_at=timezone.now())
+        self.assertEqual(prompts.get_prompt_set().fragments['conversation_base'], 'second')
+
+    def test_delete_from_another_process_is_picked_up(self):
+        ConversationPrompt.objects.create(name='conversation_base', template='first')
+        self.assertIn('conversation_base', prompts.get_prompt_set().fragments)
+
+        ConversationPrompt.objects.all()._raw_delete(ConversationPrompt.objects.db)
+        self.assertNotIn('conversation_base', prompts.get_prompt_set().fragments)
+
+
+class PackedAppJournalTests(SimpleTestCase):
+
+    def test_items_are_matched_by_id(self):
+        content = json.dumps({'journals': [
+            {'id': 2, 'mood': 'proud', 'content': ' second '},
+            {'id': 1, 'mood': 'jealous', 'content': 'first'},
+        ]})
+        self.assertEqual(AIGenerationService.parse_app_journals(content, 2), {
+            0: {'content': 'first', 'mood': 'jealous'},
+            1: {'content': 'second', 'mood': 'proud'},
+        })
+
+    def test_code_fence_and_bare_list(self):
+        content = '```json\n[{"content": "first", "mood": "content"}]\n```'
+        self.assertEqual(AIGenerationService.parse_app_journals(content, 1), {0: {'content': 'first', 'mood': 'content'}})
+
+    def test_malformed_items_are_left_out(self):
+        content = json.dumps({'journals': [
+            {'id': 1, 'mood': 'ecstatic', 'content': 'first'},
+            {'id': 2, 'content': ''},
+            {'id': 7, 'content': 'out of range'},
+            {'id': 1, 'content': 'duplicate'},
+            'not an item',
+        ]})
+        self.assertEqual(AIGenerationService.parse_app_journals(content, 3), {0: {'content': 'first', 'mood': 'satisfied'}})
+
+    def test_unparseable_response(self):
+        self.assertEqual(AIGenerationService.parse_app_journals('Dear diary,', 2), {})
+        self.assertEqual(AIGenerationService.parse_app_journals('', 2), {})
+
+    def test_fake_provider_answers_with_valid_moods(self):
+        body = {
+            'response_format': {'type': 'json_object'},
+            'messages': [{'role': 'user', 'content': '[1] Chat\n[2] Feed\n[3] Maps'}],
+        }
+        content = FakeProvider(seed=1).content(random.Random(1), body, 90)
+        moods = [item['mood'] for item in json.loads(content)['journals']]
+        self.assertEqual(len(moods), 3)
+        self.assertTrue(set(moods) <= set(AIGenerationService.APP_JOURNAL_MOODS))
+
+
+@override_settings(AI_RATE_LIMIT_RPM=60, AI_RATE_LIMIT_TPM=6000, AI_RATE_LIMIT_DEFAULT_BACKOFF=3)
+class RateLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = LocalBucketStore()
+        self.limiter = RateLimiter(self.store)
+
+    def test_buckets_refill_over_time(self):
+        waits = [self.store.acquire('m', 60, 6000, 1, 10, 100.0) for _ in range(61)]
+        self.assertEqual(waits[:60], [0.0] * 60)
+        self.assertAlmostEqual(waits[60], 1.0)
+        self.assertEqual(self.store.acquire('m', 60, 6000, 1, 10, 101.0), 0.0)
+
+    def test_token_bucket_limits_large_requests(self):
+        self.assertEqual(self.store.acquire('m', 60, 6000, 1, 4500, 100.0), 0.0)
+        self.assertAlmostEqual(self.store.acquire('m', 60, 6000, 1, 3000, 100.0), 15.0)
+
+    def test_429_blocks_for_retry_after(self):
+        self.limiter.penalize('m', {'retry-after': '2'})
+        self.assertAlmostEqual(self.limiter._take('m', 10), 2.0, delta=0.1)
+        self.assertEqual(self.limiter._take('other', 10), 0.0)
+
+    def test_429_without_headers_uses_default_backoff(self):
+        self.limiter.penalize('m')
+        self.assertAlmostEqual(self.limiter._take('m', 10), 3.0, delta=0.1)
+
+    def test_shorter_retry_after_does_not_shorten_block(self):
+        self.limiter.penalize('m', {'retry-after': '5'})
+        self.limiter.penalize('m', {'retry-after': '1'})
+        self.assertAlmostEqual(self.limiter._take('m', 10), 5.0, delta=0.1)
+
+    @override_settings(AI_RATE_LIMIT_MAX_WAIT=1)
+    def test_acquire_gives_up_past_max_wait(self):
+        self.limiter.penalize('m', {'retry-after': '10'})
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire('m', 10)
+
+    def test_headers_lower_remaining_capacity(self):
+        self.limiter.observe_headers('m', {
+            'x-ratelimit-limit-requests': '120', 'x-ratelimit-remaining-requests': '0'
+        })
+        self.assertAlmostEqual(self.limiter._take('m', 10), 0.5, delta=0.01)
+
+    def test_settle_returns_unused_tokens(self):
+        self.store.acquire('m', 60, 6000, 1, 6000, 100.0)
+        self.store.adjust('m', 3000)
+        self.assertEqual(self.store.acquire('m', 60, 6000, 1, 3000, 100.0), 0.0)
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('2'), 2.0)
+        self.assertEqual(parse_duration('6m0s'), 360.0)
+        self.assertEqual(parse_duration('250ms'), 0.25)
+        self.assertIsNone(parse_duration('soon'))
+
+
+class BatchIngestionTests(TestCase):
+    """Batch results are saved once, however often ingestion runs"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(AI_BATCH_PROVIDER='local', AI_BATCH_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        device_type = DeviceType.objects.create(name='Phone', default_personality='anxious', platform_category='mobile')
+        self.devices = [
+            Device.objects.create(
+                user=user, name=f'Phone {i}', device_type=device_type, platform='ios', device_identifier=f'phone-{i}'
+            )
+            for i in range(2)
+        ]
+        self.day = date(2026, 10, 1)
+
+    def submit(self, **fields):
+        entries, items = [], {}
+        for i, device in enumerate(self.devices):
+            request = {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': f'Journal {i}'}]}
+            entries.append((f'device_journal-{i}', request))
+            items[f'device_journal-{i}'] = {
+                'kind': 'device_journal', 'target_id': str(device.id), 'model': 'deepseek-chat',
+                'prompt': f'Journal {i}', 'fingerprint': '', 'capped': False,
+            }
+        return GenerationBatch.objects.create(
+            kind='journals', date=self.day, provider='local',
+            provider_batch_id=LocalBatchProvider().submit(write_batch_file(entries)),
+            items=items, request_count=len(items), **fields
+        )
+
+    def ingest(self, batch):
+        return tasks.ingest_generation_batch(batch, LocalBatchProvider().retrieve(batch.provider_batch_id))
+
+    def test_ingesting_again_saves_nothing(self):
+        batch = self.submit()
+        self.assertEqual(self.ingest(batch), 2)
+        DeviceJournal.objects.update(content='edited')
+
+        batch = GenerationBatch.objects.get(pk=batch.pk)
+        self.assertEqual(self.ingest(batch), 2)
+        self.assertEqual(batch.succeeded_count, 2)
+        self.assertEqual(list(DeviceJournal.objects.values_list('content', flat=True)), ['edited', 'edited'])
+
+    def test_partly_ingested_batch_resumes(self):
+        batch = self.submit(ingested_ids=['device_journal-0'], succeeded_count=1)
+        self.assertEqual(self.ingest(batch), 2)
+        self.assertEqual(list(DeviceJournal.objects.values_list('device', flat=True)), [self.devices[1].id])
+        self.assertEqual(
+            sorted(GenerationBatch.objects.get(pk=batch.pk).ingested_ids), ['device_journal-0', 'device_journal-1']
+        )
+
+    def test_stale_claim_is_taken_over(self):
+        stale = self.submit(status='ingesting', claimed_at=timezone.now() - timedelta(hours=2))
+        live = self.submit(status='ingesting', claimed_at=timezone.now())
+
+        self.assertEqual(tasks.poll_generation_batches(), {'ingested': 1})
+        self.assertEqual(GenerationBatch.objects.get(pk=stale.pk).status, 'ingested')
+        self.assertEqual(GenerationBatch.objects.get(pk=live.pk).status, 'ingesting')
+        self.assertEqual(DeviceJournal.objects.count(), 2)
+
+
+class GenerationJobTriggerTests(TestCase):
+    """Triggering generation while an identical job is active returns that job"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        device_type = DeviceType.objects.create(name='Phone', default_personality='anxious', platform_category='mobile')
+        Device.objects.create(user=user, name='Phone', device_type=device_type, platform='ios')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(user)
+
+    def trigger(self):
+        return self.client.post('/api/ai-engine/generate-journals/', {}, format='json')
+
+    def test_repeated_trigger_returns_active_job(self):
+        first = self.trigger()
+        second = self.trigger()
+        self.assertEqual((first.status_code, second.status_code), (202, 200))
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_finished_job_is_not_reused(self):
+        first = self.trigger()
+        GenerationJob.objects.filter(id=first.data['id']).update(status='completed')
+        second = self.trigger()
+        self.assertEqual(second.status_code, 202)
+        self.assertNotEqual(first.data['id'], second.data['id'])
+
+    def test_stale_job_is_failed_and_replaced(self):
+        first = self.trigger()
+        GenerationJob.objects.filter(id=first.data['id']).update(updated_at=timezone.now() - timedelta(hours=2))
+        second = self.trigger()
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(GenerationJob.objects.get(id=first.data['id']).status, 'failed')
+
+
+class UnchangedInputJobTests(TestCase):
+    """A job item whose saved result came from the same inputs is skipped"""
+
+    def setUp(self):
+        server, url = start_fake_provider(latency='fixed', latency_mean=0.01, completion_tokens=40)
+        self.addCleanup(server.shutdown)
+        settings_override = override_settings(AI_BASE_URL=url, AI_CACHE_ENABLED=False, AI_GENERATION_LOG_ENABLED=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        client.reset_client()
+        self.addCleanup(client.reset_client)
+
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        device_type = DeviceType.objects.create(name='Phone', default_personality='anxious', platform_category='mobile')
+        device = Device.objects.create(user=user, name='Phone', device_type=device_type, platform='ios')
+        day = date.today() - timedelta(days=1)
+        UsageData.objects.create(device=device, date=day, weekday=day.weekday(), total_screen_time=240, unlock_count=80)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(user)
+
+    def run_job(self, **data):
+        with mock.patch.object(tasks.run_generation_job_item, 'delay', side_effect=tasks.run_generation_job_item), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ai-engine/generate-journals/', data, format='json')
+        job = GenerationJob.objects.get(id=response.data['id'])
+        return job, list(job.items.values_list('status', flat=True))
+
+    def test_unchanged_input_is_skipped(self):
+        job, statuses = self.run_job()
+        self.assertEqual((job.status, statuses), ('completed', ['succeeded']))
+        content = DeviceJournal.objects.get().content
+
+        job, statuses = self.run_job()
+        self.assertEqual((job.status, statuses), ('completed', ['skipped']))
+        self.assertEqual(DeviceJournal.objects.get().content, content)
+
+    def test_force_regenerates(self):
+        self.run_job()
+        job, statuses = self.run_job(force=True)
+        self.assertEqual((job.status, statuses), ('completed', ['succeeded']))
+
+    def test_changed_input_is_regenerated(self):
+        self.run_job()
+        UsageData.objects.update(total_screen_time=300)
+        job, statuses = self.run_job()
+        self.assertEqual(statuses, ['succeeded'])
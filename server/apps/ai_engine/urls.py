@@ -1,7 +1,15 @@
-from django.urls import path
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
 from . import views
 
+router = DefaultRouter()
+router.register('jobs', views.GenerationJobViewSet, basename='generationjob')
+
 urlpatterns = [
     path('generate-conversations/', views.generate_conversations_for_user, name='generate-conversations'),
+    path('stream-conversation/', views.stream_conversation, name='stream-conversation'),
     path('generate-journals/', views.generate_journals_for_user, name='generate-journals'),
+    path('cache-stats/', views.generation_cache_stats, name='generation-cache-stats'),
+    path('metrics/', views.generation_metrics, name='generation-metrics'),
+    path('', include(router.urls)),
 ]
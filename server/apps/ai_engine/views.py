@@ -1,90 +1,194 @@
+import json
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import status, viewsets
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import date, timedelta
-from .tasks import generate_conversation_on_demand, generate_device_journal_entry, generate_app_journal_entry
-from apps.devices.models import Device
-from apps.applications.models import DeviceApp
+from .tasks import create_generation_job, stream_conversation_for_user
+from .models import GenerationJob
+from .serializers import GenerationJobSerializer
+from .cache import get_stats as get_generation_cache_stats
+from .metrics import render_prometheus
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_conversations_for_user(request):
     """
-    Manually trigger conversation generation for the authenticated user
+    Queue conversation generation for the authenticated user
+    
+    Returns the GenerationJob to poll at jobs/<id>/; a repeated trigger
+    while a job is in progress returns that job. Nothing is generated when
+    the inputs haven't changed since the last conversation, unless
+    force=true; the job's item is then marked skipped.
     """
     user = request.user
+    options = {
+        key: request.data[key] for key in ('conversation_type', 'mood') if request.data.get(key)
+    }
+    options['force'] = _flag(request.data, 'force')
+    job, created = create_generation_job(user, 'conversations', timezone.now().date(), options)
+    return Response(
+        GenerationJobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
+    )
+
+
+def _flag(data, *names):
+    """Whether any of the named request fields is a true-ish flag"""
+    return any(str(data.get(name, '')).lower() in ('1', 'true', 'yes') for name in names)
+
+
+def _sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _authenticate(request):
+    """
+    Run DRF's authentication and parsing for a plain Django view
     
+    Returns (user, data), or (None, error response) if the request is
+    unauthenticated or its body can't be parsed.
+    """
+    drf_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
     try:
-        # Get yesterday's date for generating conversations
-        target_date = date.today() - timedelta(days=1)
-        
-        # Trigger conversation generation task
-        result = generate_conversation_on_demand(user.id)
+        user = drf_request.user
+        if not (user and user.is_authenticated):
+            return None, JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED
+            )
+        return user, drf_request.data
+    except APIException as e:
+        return None, JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+
+
+@csrf_exempt
+@require_POST
+async def stream_conversation(request):
+    """
+    Generate a conversation for the authenticated user and stream it as Server-Sent Events
+    
+    Emits `token` events ({"content": ...}) as the model writes, then a
+    `done` event with the saved conversation's id, or an `error` event.
+    Accepts optional conversation_type, mood and date (YYYY-MM-DD, default
+    today). A conversation already generated from the same inputs is sent
+    as a single token unless force=true.
+    
+    A plain async view rather than an @api_view, so clients can send
+    Accept: text/event-stream without failing content negotiation. Tokens
+    are only flushed as they arrive when served over ASGI (asgi.py); under
+    WSGI Django buffers an async stream into a single response.
+    """
+    user, data = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return data
+    
+    try:
+        target_date = parse_date(data.get('date') or '') or timezone.now().date()
+    except ValueError:  # Well formed but impossible, e.g. 2024-02-30
+        target_date = None
+    if target_date is None:
+        return JsonResponse({'error': 'date must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+    conversation_type = data.get('conversation_type') or None
+    mood = data.get('mood') or None
+    force = _flag(data, 'force')
+    
+    async def events():
+        outcome = {}
+        try:
+            async for delta in stream_conversation_for_user(
+                user, target_date, outcome, conversation_type, mood, force
+            ):
+                yield _sse('token', {'content': delta})
+        except Exception as e:
+            outcome = {'error': str(e)}
         
-        return Response({
-            'message': 'Conversation generation triggered successfully',
-            'user': user.username,
-            'date': str(target_date)
-        }, status=status.HTTP_200_OK)
+        conversation = outcome.get('conversation')
+        if conversation:
+            yield _sse('done', {
+                'conversation_id': str(conversation.id),
+                'conversation_type': conversation.conversation_type,
+                'mood': conversation.mood,
+                'tokens_used': conversation.generation_tokens
+            })
+        else:
+            yield _sse('error', {'error': outcome.get('error', 'Generation failed')})
     
-    except Exception as e:
-        return Response({
-            'error': str(e),
-            'detail': 'Failed to generate conversations. Make sure you have usage data and OpenAI API key configured.'
-        }, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_journals_for_user(request):
     """
-    Manually trigger journal generation for the authenticated user's devices and apps
+    Queue journal generation for the authenticated user's devices and apps
+    
+    One task per device and app; returns the GenerationJob to poll at
+    jobs/<id>/. Journals whose inputs haven't changed are kept and their
+    items marked skipped; force=true (or refresh=true) regenerates them,
+    bypassing the generation cache.
     """
     user = request.user
     
-    try:
-        # Get yesterday's date for generating journals
-        target_date = date.today() - timedelta(days=1)
-        
-        # Get user's active devices
-        devices = Device.objects.filter(user=user, is_active=True)
-        
-        device_count = 0
-        app_count = 0
-        
-        # Generate device journals
-        for device in devices:
-            print(f"started generating journal for device")
-            try:
-                generate_device_journal_entry(device, target_date)
-                device_count += 1
-            except Exception as e:
-                print(f"Error generating journal for device {device.id}: {str(e)}")
-        
-        # Generate app journals for top apps
-        top_apps = DeviceApp.objects.filter(
-            device__user=user,
-            device__is_active=True
-        ).select_related('app', 'device')[:10]  # Top 10 apps
-        
-        for device_app in top_apps:
-            try:
-                generate_app_journal_entry(device_app, target_date)
-                app_count += 1
-            except Exception as e:
-                print(f"Error generating journal for app {device_app.id}: {str(e)}")
-        
-        return Response({
-            'message': 'Journal generation triggered successfully',
-            'device_journals_generated': device_count,
-            'app_journals_generated': app_count,
-            'date': str(target_date)
-        }, status=status.HTTP_200_OK)
+    # Get yesterday's date for generating journals
+    target_date = date.today() - timedelta(days=1)
+    options = {'force': _flag(request.data, 'force', 'refresh')}
+    
+    job, created = create_generation_job(user, 'journals', target_date, options)
+    return Response(
+        GenerationJobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
+    )
+
+
+class GenerationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Status of the authenticated user's generation jobs
+    """
+    serializer_class = GenerationJobSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return GenerationJob.objects.filter(user=self.request.user).prefetch_related('items')
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def generation_cache_stats(request):
+    """
+    Hit/miss counts and token savings of the AI generation cache
+    """
+    return Response(get_generation_cache_stats(), status=status.HTTP_200_OK)
+
+
+def generation_metrics(request):
+    """
+    Generation latency, throughput and token metrics in the Prometheus text format
     
-    except Exception as e:
-        return Response({
-            'error': str(e),
-            'detail': 'Failed to generate journals. Make sure you have usage data and OpenAI API key configured.'
-        }, status=status.HTTP_400_BAD_REQUEST)
+    Scrapers authenticate with `Authorization: Bearer <AI_METRICS_TOKEN>`;
+    staff users with a session may read it too.
+    """
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    authorized = bool(settings.AI_METRICS_TOKEN) and hmac.compare_digest(token.encode(), settings.AI_METRICS_TOKEN.encode())
+    if not (authorized or request.user.is_staff):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,167 @@
+"""
+Per-day user activity bitmaps
+
+Every user gets a dense integer index (ActivityUser.pk). Ingestion adds
+that index to the day's 'active' bitmap, and to the 'new' bitmap of the
+user's first active day, so "who was active on X", DAU/WAU/MAU and cohort
+retention are answered with bitwise operations instead of usage table
+scans.
+"""
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import transaction
+from apps.analytics.models import ActivityUser, ActivityBitmap
+from apps.analytics.bitmaps import RoaringBitmap
+
+ACTIVITY_CACHE_TIMEOUT = 60 * 60 * 48  # 2 days
+ACTIVE_USER_CHUNK_SIZE = 1000
+
+
+def _member_cache_key(user_id):
+    return f"activity:member:{user_id}"
+
+
+def _seen_cache_key(index, day):
+    return f"activity:seen:{index}:{day.isoformat()}"
+
+
+def _update_bitmap(kind, day, add=(), remove=()):
+    """Add / remove indexes in one day's bitmap"""
+    with transaction.atomic():
+        row, _ = ActivityBitmap.objects.select_for_update().get_or_create(kind=kind, date=day)
+        bitmap = RoaringBitmap.from_bytes(row.data)
+        before = bitmap.to_bytes()
+        bitmap.update(add)
+        for index in remove:
+            bitmap.discard(index)
+        data = bitmap.to_bytes()
+        if data != before:
+            row.data = data
+            row.cardinality = len(bitmap)
+            row.save(update_fields=['data', 'cardinality', 'updated_at'])
+
+
+def get_member(user_id, day):
+    """Return (index, first_active_date) for a user, creating the index on first activity"""
+    key = _member_cache_key(user_id)
+    member = cache.get(key)
+    if member is None:
+        activity_user, created = ActivityUser.objects.get_or_create(
+            user_id=user_id,
+            defaults={'first_active_date': day}
+        )
+        if created:
+            _update_bitmap('new', day, add=[activity_user.pk])
+        member = (activity_user.pk, activity_user.first_active_date)
+        cache.set(key, member, ACTIVITY_CACHE_TIMEOUT)
+    return member
+
+
+def record_activity(user_id, day):
+    """Mark a user active on a day"""
+    index, first_active_date = get_member(user_id, day)
+    seen_key = _seen_cache_key(index, day)
+    if cache.get(seen_key):
+        return
+
+    if day < first_active_date:
+        # Late-synced earlier day: move the user to the earlier cohort
+        ActivityUser.objects.filter(pk=index).update(first_active_date=day)
+        _update_bitmap('new', first_active_date, remove=[index])
+        _update_bitmap('new', day, add=[index])
+        cache.set(_member_cache_key(user_id), (index, day), ACTIVITY_CACHE_TIMEOUT)
+
+    _update_bitmap('active', day, add=[index])
+    cache.set(seen_key, True, ACTIVITY_CACHE_TIMEOUT)
+
+
+def clear_activity(user_id, day):
+    """Unmark a user for a day (their last usage row for it was deleted)"""
+    index = ActivityUser.objects.filter(user_id=user_id).values_list('pk', flat=True).first()
+    if index is None:
+        return
+    _update_bitmap('active', day, remove=[index])
+    cache.delete(_seen_cache_key(index, day))
+
+
+def load_bitmaps(kind, start_date, end_date):
+    """Return {date: RoaringBitmap} for the days in a range that have one"""
+    rows = ActivityBitmap.objects.filter(
+        kind=kind,
+        date__gte=start_date,
+        date__lte=end_date
+    ).values_list('date', 'data')
+    return {day: RoaringBitmap.from_bytes(data) for day, data in rows}
+
+
+def active_users(start_date, end_date=None):
+    """Bitmap of user indexes active on any day in the range"""
+    return RoaringBitmap.union(load_bitmaps('active', start_date, end_date or start_date).values())
+
+
+def active_user_chunks(day, chunk_size=ACTIVE_USER_CHUNK_SIZE, user_ids=None):
+    """Yield lists of user ids active on a day (optionally only among user_ids), in index order"""
+    indexes = active_users(day).to_array().tolist()
+    for i in range(0, len(indexes), chunk_size):
+        members = ActivityUser.objects.filter(pk__in=indexes[i:i + chunk_size])
+        if user_ids is not None:
+            members = members.filter(user_id__in=user_ids)
+        chunk = list(members.values_list('user_id', flat=True))
+        if chunk:
+            yield chunk
+
+
+def activity_summary(day):
+    """DAU / WAU / MAU for the windows ending on a day"""
+    bitmaps = load_bitmaps('active', day - timedelta(days=29), day)
+    dau = len(bitmaps.get(day, RoaringBitmap()))
+    wau = len(RoaringBitmap.union(
+        bitmap for bitmap_day, bitmap in bitmaps.items() if bitmap_day > day - timedelta(days=7)
+    ))
+    mau = len(RoaringBitmap.union(bitmaps.values()))
+    return {
+        'date': str(day),
+        'dau': dau,
+        'wau': wau,
+        'mau': mau,
+        'stickiness': round(dau / mau, 3) if mau else 0.0,
+        'daily': [
+            {'date': str(day - timedelta(days=i)), 'active': len(bitmaps.get(day - timedelta(days=i), RoaringBitmap()))}
+            for i in range(29, -1, -1)
+        ]
+    }
+
+
+def cohort_retention(day, weeks=8):
+    """
+    Weekly retention of users by the week of their first activity
+
+    For each of the last `weeks` weeks (Monday start, the last one containing
+    day), retention[k] is the share of the cohort active in week k after it.
+    """
+    last_week = day - timedelta(days=day.weekday())
+    first_week = last_week - timedelta(weeks=weeks - 1)
+    week_starts = [first_week + timedelta(weeks=i) for i in range(weeks)]
+
+    def by_week(bitmaps):
+        grouped = {week: [] for week in week_starts}
+        for bitmap_day, bitmap in bitmaps.items():
+            grouped[bitmap_day - timedelta(days=bitmap_day.weekday())].append(bitmap)
+        return {week: RoaringBitmap.union(bitmaps) for week, bitmaps in grouped.items()}
+
+    cohorts = by_week(load_bitmaps('new', first_week, day))
+    active = by_week(load_bitmaps('active', first_week, day))
+
+    results = []
+    for i, week in enumerate(week_starts):
+        cohort = cohorts[week]
+        size = len(cohort)
+        results.append({
+            'week_start': str(week),
+            'size': size,
+            'retention': [
+                round(len(cohort & active[later]) / size, 3) if size else 0.0
+                for later in week_starts[i:]
+            ]
+        })
+    return results
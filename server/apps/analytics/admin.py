@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserStats, TrendAnalysis
+from .models import UserStats, TrendAnalysis, PopulationDistribution, ActivityBitmap
 
 
 @admin.register(UserStats)
@@ -20,7 +20,7 @@ class UserStatsAdmin(admin.ModelAdmin):
             'fields': ('social_media_time', 'productivity_time', 'entertainment_time', 'communication_time')
         }),
         ('Rankings', {
-            'fields': ('screen_time_rank', 'productivity_rank')
+            'fields': ('screen_time_rank', 'productivity_rank', 'screen_time_percentile')
         }),
         ('Insights', {
             'fields': ('weekly_trend', 'notable_patterns')
@@ -55,3 +55,17 @@ class TrendAnalysisAdmin(admin.ModelAdmin):
         }),
     )
 
+
+@admin.register(PopulationDistribution)
+class PopulationDistributionAdmin(admin.ModelAdmin):
+    list_display = ['metric', 'period_type', 'period_start', 'sample_count', 'updated_at']
+    list_filter = ['metric', 'period_type', 'period_start']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(ActivityBitmap)
+class ActivityBitmapAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'date', 'cardinality', 'updated_at']
+    list_filter = ['kind', 'date']
+    exclude = ['data']
+    readonly_fields = ['kind', 'date', 'cardinality', 'updated_at']
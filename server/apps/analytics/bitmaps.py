@@ -0,0 +1,216 @@
+"""
+Compressed integer sets for daily user activity
+
+A small roaring bitmap: 32-bit values are split into containers by their
+high 16 bits. Sparse containers are sorted uint16 arrays, dense ones
+(more than ARRAY_MAX members) are 65536-bit packed bitmaps, so union and
+intersection work on whole containers with numpy instead of per element.
+"""
+import struct
+from typing import Dict, Iterable, Iterator, Optional
+import numpy as np
+
+ARRAY_MAX = 4096
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+_HEADER = struct.Struct('<I')
+_CONTAINER_HEADER = struct.Struct('<HBI')
+
+
+def _is_array(container: np.ndarray) -> bool:
+    return container.dtype == np.uint16
+
+
+def _to_bits(container: np.ndarray) -> np.ndarray:
+    if not _is_array(container):
+        return container
+    bits = np.zeros(65536, dtype=bool)
+    bits[container] = True
+    return np.packbits(bits)
+
+
+def _to_values(container: np.ndarray) -> np.ndarray:
+    if _is_array(container):
+        return container
+    return np.flatnonzero(np.unpackbits(container)).astype(np.uint16)
+
+
+def _cardinality(container: np.ndarray) -> int:
+    if _is_array(container):
+        return len(container)
+    return int(_POPCOUNT[container].sum(dtype=np.int64))
+
+
+def _normalize(container: np.ndarray) -> Optional[np.ndarray]:
+    """Pick the smaller representation for a container, None if empty"""
+    cardinality = _cardinality(container)
+    if cardinality == 0:
+        return None
+    if cardinality <= ARRAY_MAX:
+        return _to_values(container)
+    return _to_bits(container)
+
+
+def _combine(a: np.ndarray, b: np.ndarray, op: str) -> Optional[np.ndarray]:
+    if _is_array(a) and _is_array(b):
+        result = {
+            'or': np.union1d,
+            'and': np.intersect1d,
+            'andnot': np.setdiff1d,
+        }[op](a, b).astype(np.uint16)
+    else:
+        a_bits, b_bits = _to_bits(a), _to_bits(b)
+        if op == 'or':
+            result = a_bits | b_bits
+        elif op == 'and':
+            result = a_bits & b_bits
+        else:
+            result = a_bits & ~b_bits
+    return _normalize(result)
+
+
+class RoaringBitmap:
+    """Set of non-negative 32-bit integers"""
+
+    def __init__(self, values: Optional[Iterable[int]] = None):
+        self.containers: Dict[int, np.ndarray] = {}
+        if values is not None:
+            self.update(values)
+
+    def __len__(self) -> int:
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.containers)
+
+    def __contains__(self, value: int) -> bool:
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if _is_array(container):
+            i = np.searchsorted(container, low)
+            return i < len(container) and container[i] == low
+        return bool(container[low >> 3] & (0x80 >> (low & 7)))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_array().tolist())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RoaringBitmap):
+            return NotImplemented
+        return self.containers.keys() == other.containers.keys() and all(
+            np.array_equal(_to_values(container), _to_values(other.containers[key]))
+            for key, container in self.containers.items()
+        )
+
+    def update(self, values: Iterable[int]):
+        """Add many values"""
+        values = np.unique(np.asarray(values if isinstance(values, np.ndarray) else list(values), dtype=np.uint32))
+        if not len(values):
+            return
+        highs = values >> 16
+        keys, starts = np.unique(highs, return_index=True)
+        for key, chunk in zip(keys.tolist(), np.split(values, starts[1:])):
+            lows = (chunk & 0xFFFF).astype(np.uint16)
+            existing = self.containers.get(key)
+            container = _normalize(lows) if existing is None else _combine(existing, lows, 'or')
+            self.containers[key] = container
+
+    def add(self, value: int):
+        self.update([value])
+
+    def discard(self, value: int):
+        key = value >> 16
+        container = self.containers.get(key)
+        if container is None:
+            return
+        container = _combine(container, np.array([value & 0xFFFF], dtype=np.uint16), 'andnot')
+        if container is None:
+            del self.containers[key]
+        else:
+            self.containers[key] = container
+
+    def to_array(self) -> np.ndarray:
+        """All values as a sorted uint32 array"""
+        if not self.containers:
+            return np.array([], dtype=np.uint32)
+        return np.concatenate([
+            (np.uint32(key) << np.uint32(16)) | _to_values(self.containers[key]).astype(np.uint32)
+            for key in sorted(self.containers)
+        ])
+
+    def _binary(self, other: 'RoaringBitmap', op: str) -> 'RoaringBitmap':
+        result = RoaringBitmap()
+        if op == 'or':
+            keys = self.containers.keys() | other.containers.keys()
+        elif op == 'and':
+            keys = self.containers.keys() & other.containers.keys()
+        else:
+            keys = self.containers.keys()
+        for key in keys:
+            a, b = self.containers.get(key), other.containers.get(key)
+            if a is None or b is None:
+                container = a if b is None else (b if op == 'or' else None)
+            else:
+                container = _combine(a, b, op)
+            if container is not None:
+                result.containers[key] = container
+        return result
+
+    def __or__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        return self._binary(other, 'or')
+
+    def __and__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        return self._binary(other, 'and')
+
+    def __sub__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        return self._binary(other, 'andnot')
+
+    @classmethod
+    def union(cls, bitmaps: Iterable['RoaringBitmap']) -> 'RoaringBitmap':
+        """Union of many bitmaps, OR-ing each container key once"""
+        grouped: Dict[int, list] = {}
+        for bitmap in bitmaps:
+            for key, container in bitmap.containers.items():
+                grouped.setdefault(key, []).append(container)
+
+        result = cls()
+        for key, containers in grouped.items():
+            if len(containers) == 1:
+                result.containers[key] = containers[0]
+            elif all(_is_array(container) for container in containers):
+                result.containers[key] = _normalize(np.unique(np.concatenate(containers)))
+            else:
+                result.containers[key] = _normalize(
+                    np.bitwise_or.reduce([_to_bits(container) for container in containers])
+                )
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serialize as: count, then (key, type, length, payload) per container"""
+        parts = [_HEADER.pack(len(self.containers))]
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            parts.append(_CONTAINER_HEADER.pack(key, 0 if _is_array(container) else 1, len(container)))
+            parts.append(container.astype('<u2' if _is_array(container) else np.uint8).tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data) -> 'RoaringBitmap':
+        bitmap = cls()
+        data = bytes(data or b'')
+        if not data:
+            return bitmap
+        (count,), offset = _HEADER.unpack_from(data), _HEADER.size
+        for _ in range(count):
+            key, kind, length = _CONTAINER_HEADER.unpack_from(data, offset)
+            offset += _CONTAINER_HEADER.size
+            if kind == 0:
+                container = np.frombuffer(data, dtype='<u2', count=length, offset=offset).astype(np.uint16)
+                offset += length * 2
+            else:
+                container = np.frombuffer(data, dtype=np.uint8, count=length, offset=offset).copy()
+                offset += length
+            bitmap.containers[key] = container
+        return bitmap
@@ -0,0 +1,182 @@
+"""
+Population usage distributions built from streaming quantile sketches
+
+Ingestion only records each user's daily values in UserStats.sketch_values
+(see analytics.signals), under that user's own row lock. The nightly
+rollup_population_distributions task folds them into one daily sketch per
+metric; days it hasn't reached yet (today, or a day whose timezones are
+still ingesting) are sketched from UserStats on read. Daily sketches are
+merged into weekly/monthly distributions on demand, so percentile lookups
+never sort or scan the usage tables.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from apps.analytics.models import UserStats, PopulationDistribution
+from apps.analytics.sketches import TDigest
+import logging
+
+logger = logging.getLogger('analytics')
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+def period_bounds(period_type, day):
+    """Return (start, end) dates of the period containing day"""
+    if period_type == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if period_type == 'monthly':
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    return day, day
+
+
+def update_user_day(user_id, day, values, totals=None):
+    """
+    Record a user's daily values for the population sketches
+
+    Re-synced usage replaces the day's old value; the sketches pick it up at
+    the next rollup.
+    """
+    with transaction.atomic():
+        stats, _ = UserStats.objects.select_for_update().get_or_create(user_id=user_id, date=day)
+        changed = False
+        for metric, value in values.items():
+            if stats.sketch_values.get(metric) != value:
+                stats.sketch_values[metric] = value
+                changed = True
+
+        for field, value in (totals or {}).items():
+            if getattr(stats, field) != value:
+                setattr(stats, field, value)
+                changed = True
+
+        if changed:
+            stats.save()
+
+
+def build_daily_digests(day, metric=None):
+    """The day's population sketches by metric (just `metric`'s if given), from UserStats"""
+    digests = {}
+    for values in UserStats.objects.filter(date=day).values_list('sketch_values', flat=True).iterator():
+        for name, value in values.items():
+            if metric is None or name == metric:
+                digests.setdefault(name, TDigest()).add(value)
+    return digests
+
+
+def rollup_daily_distributions(day):
+    """Replace the day's persisted sketches with ones built from UserStats; returns the metric count"""
+    digests = build_daily_digests(day)
+    with transaction.atomic():
+        PopulationDistribution.objects.filter(
+            period_type='daily', period_start=day
+        ).exclude(metric__in=list(digests)).delete()
+        for metric, digest in digests.items():
+            PopulationDistribution.objects.update_or_create(
+                metric=metric,
+                period_type='daily',
+                period_start=day,
+                defaults={'digest': digest.to_dict(), 'sample_count': int(digest.count)}
+            )
+    return len(digests)
+
+
+def get_window_distribution(metric, start, end):
+    """The merged daily sketches of the days from start to end, sketching days not rolled up yet"""
+    rows = dict(PopulationDistribution.objects.filter(
+        metric=metric,
+        period_type='daily',
+        period_start__gte=start,
+        period_start__lte=end
+    ).values_list('period_start', 'digest'))
+    digests = [TDigest.from_dict(digest) for digest in rows.values()]
+    day = start
+    while day <= min(end, timezone.now().date()):
+        if day not in rows:
+            digests.extend(build_daily_digests(day, metric).values())
+        day += timedelta(days=1)
+    return TDigest.merge_all(digests)
+
+
+def get_distribution(metric, period_type, day):
+    """Return the TDigest for the period containing day"""
+    start, end = period_bounds(period_type, day)
+    if period_type == 'daily':
+        return get_window_distribution(metric, start, end)
+
+    dailies = PopulationDistribution.objects.filter(
+        metric=metric,
+        period_type='daily',
+        period_start__gte=start,
+        period_start__lte=end
+    )
+
+    # Closed periods are merged once and kept; open ones are merged on read.
+    # Usage synced late is folded in when the nightly rollup rewrites its
+    # daily sketch, which makes the rollup stale, so it is rebuilt on the next read
+    is_closed = end < timezone.now().date()
+    if is_closed:
+        rollup = PopulationDistribution.objects.filter(
+            metric=metric, period_type=period_type, period_start=start
+        ).first()
+        if rollup and not dailies.filter(updated_at__gt=rollup.updated_at).exists():
+            return TDigest.from_dict(rollup.digest)
+
+    digest = get_window_distribution(metric, start, end)
+
+    if is_closed:
+        PopulationDistribution.objects.update_or_create(
+            metric=metric,
+            period_type=period_type,
+            period_start=start,
+            defaults={'digest': digest.to_dict(), 'sample_count': int(digest.count)}
+        )
+    return digest
+
+
+def get_user_values(user, metric, start, end):
+    """A user's daily values for the metric from start to end"""
+    rows = UserStats.objects.filter(
+        user=user, date__gte=start, date__lte=end
+    ).values_list('sketch_values', flat=True)
+    return [row[metric] for row in rows if metric in row]
+
+
+def daily_percentile(digest, values):
+    """
+    Percentile of a user's daily values in a sketch of daily values
+
+    Each day is ranked against the population's days and the ranks are
+    averaged, so daily values are never compared with a multi-day average.
+    """
+    if not values or not digest.count:
+        return None
+    return round(sum(digest.cdf(value) for value in values) / len(values) * 100, 1)
+
+
+def get_percentile(user, metric, period_type, day):
+    """Return the user's value, percentile and the population quantiles"""
+    start, end = period_bounds(period_type, day)
+    digest = get_distribution(metric, period_type, day)
+    values = get_user_values(user, metric, start, end)
+    # The average daily value for weekly/monthly periods
+    user_value = sum(values) / len(values) if values else None
+    percentile = daily_percentile(digest, values)
+
+    return {
+        'metric': metric,
+        'period_type': period_type,
+        'period_start': str(start),
+        'period_end': str(end),
+        'user_value': user_value,
+        'percentile': percentile,
+        'population': {
+            'count': int(digest.count),
+            'quantiles': {
+                f"p{int(q * 100)}": digest.quantile(q) for q in QUANTILES
+            } if digest.centroids else {},
+        }
+    }
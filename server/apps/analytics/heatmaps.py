@@ -0,0 +1,72 @@
+"""
+Weekday x hour usage heatmaps
+
+Each day's 24 hourly values are cached per scope (user, device or app) and
+invalidated individually when that day's usage changes (see
+analytics.signals). A window is assembled from one cache round trip and a
+vectorized sum into a 7 x 24 grid; only uncached days touch the database.
+"""
+from datetime import timedelta
+from django.core.cache import cache
+from apps.usage.models import UsageData, AppUsage
+import numpy as np
+
+HEATMAP_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
+
+
+def day_cache_key(scope, scope_id, day):
+    return f"heatmap:{scope}:{scope_id}:{day.isoformat()}"
+
+
+def invalidate_day(scope, scope_id, day):
+    cache.delete(day_cache_key(scope, scope_id, day))
+
+
+def _load_days(scope, scope_id, start_date, end_date):
+    """Sum hourly_usage per day for a scope from the usage tables"""
+    if scope == 'app':
+        queryset = AppUsage.objects.filter(device_app_id=scope_id)
+    elif scope == 'device':
+        queryset = UsageData.objects.filter(device_id=scope_id)
+    else:
+        queryset = UsageData.objects.filter(device__user_id=scope_id)
+
+    rows = queryset.filter(
+        date__gte=start_date,
+        date__lte=end_date
+    ).values_list('date', 'hourly_usage')
+
+    days = {}
+    for day, hourly_usage in rows:
+        if not hourly_usage or len(hourly_usage) != 24:
+            continue
+        values = np.asarray(hourly_usage, dtype=np.float64)
+        days[day] = days[day] + values if day in days else values
+    return days
+
+
+def get_heatmap(scope, scope_id, start_date, end_date):
+    """Return a 7 x 24 array of minutes (row 0 = Monday) for the window"""
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    keys = {day_cache_key(scope, scope_id, day): day for day in days}
+    cached = cache.get_many(list(keys))
+
+    hourly = {keys[key]: value for key, value in cached.items()}
+    missing = [day for day in days if day not in hourly]
+    if missing:
+        loaded = _load_days(scope, scope_id, min(missing), max(missing))
+        to_cache = {}
+        for day in missing:
+            values = loaded[day].tolist() if day in loaded else []
+            hourly[day] = values
+            to_cache[day_cache_key(scope, scope_id, day)] = values
+        cache.set_many(to_cache, HEATMAP_CACHE_TIMEOUT)
+
+    # Empty days are cached as [] and contribute nothing
+    active_days = [day for day in days if hourly[day]]
+    heatmap = np.zeros((7, 24))
+    if active_days:
+        matrix = np.array([hourly[day] for day in active_days], dtype=np.float64)
+        weekdays = np.array([day.weekday() for day in active_days])
+        np.add.at(heatmap, weekdays, matrix)
+    return heatmap
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='screen_time_percentile',
+            field=models.FloatField(blank=True, help_text='0-100 percentile among all users', null=True),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='sketch_values',
+            field=models.JSONField(blank=True, default=dict, help_text='Daily values currently counted in population distributions'),
+        ),
+        migrations.CreateModel(
+            name='PopulationDistribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('period_type', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('digest', models.JSONField(default=dict)),
+                ('sample_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('metric', 'period_type', 'period_start')},
+            },
+        ),
+    ]
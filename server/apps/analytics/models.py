@@ -29,6 +29,10 @@ class UserStats(models.Model):
     weekly_trend = models.CharField(max_length=20, blank=True)  # 'increasing', 'decreasing', 'stable'
     notable_patterns = models.JSONField(default=list, blank=True)
     
+    # Population comparison
+    screen_time_percentile = models.FloatField(null=True, blank=True, help_text="0-100 percentile among all users")
+    sketch_values = models.JSONField(default=dict, blank=True, help_text="Daily values currently counted in population distributions")
+    
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
@@ -60,3 +64,53 @@ class TrendAnalysis(models.Model):
     
     def __str__(self):
         return f"{self.user.username} {self.period_type} trends - {self.start_date}"
+
+class PopulationDistribution(models.Model):
+    """Quantile sketch of a daily usage metric across all users"""
+    metric = models.CharField(max_length=50)  # 'screen_time', 'unlocks', 'category:<slug>'
+    period_type = models.CharField(
+        max_length=10,
+        choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')]
+    )
+    period_start = models.DateField()
+    
+    # Serialized TDigest (see analytics.sketches)
+    digest = models.JSONField(default=dict)
+    sample_count = models.IntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['metric', 'period_type', 'period_start']
+    
+    def __str__(self):
+        return f"{self.metric} {self.period_type} distribution - {self.period_start}"
+
+class ActivityUser(models.Model):
+    """Dense integer index for a user in the activity bitmaps (the pk)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='activity_index')
+    first_active_date = models.DateField()
+    
+    def __str__(self):
+        return f"{self.user.username} #{self.pk}"
+
+class ActivityBitmap(models.Model):
+    """Compressed set of the ActivityUser indexes active (or new) on a day"""
+    kind = models.CharField(
+        max_length=10,
+        choices=[('active', 'Active'), ('new', 'First Active')]
+    )
+    date = models.DateField()
+    
+    # Serialized RoaringBitmap (see analytics.bitmaps)
+    data = models.BinaryField(default=bytes)
+    cardinality = models.IntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['kind', 'date']
+        ordering = ['date']
+    
+    def __str__(self):
+        return f"{self.kind} users - {self.date} ({self.cardinality})"
@@ -10,7 +10,7 @@ class UserStatsSerializer(serializers.ModelSerializer):
             'total_pickups_all_devices', 'social_media_time',
             'productivity_time', 'entertainment_time', 'communication_time',
             'screen_time_rank', 'productivity_rank', 'weekly_trend',
-            'notable_patterns', 'created_at'
+            'notable_patterns', 'screen_time_percentile', 'created_at'
         ]
         read_only_fields = ['id', 'user', 'created_at']
 
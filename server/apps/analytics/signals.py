@@ -0,0 +1,115 @@
+"""
+Ingestion hooks for analytics
+
+Keep per-day population sketches and UserStats totals current as usage
+data is written, instead of recomputing them from the usage tables, mark
+users in the daily activity bitmaps and drop cached heatmap days whose
+data changed.
+"""
+from datetime import timedelta
+from django.db.models import Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.text import slugify
+from apps.usage.models import UsageData, AppUsage
+from apps.applications.models import DeviceApp
+from apps.analytics.distributions import update_user_day
+from apps.analytics.heatmaps import invalidate_day
+from apps.analytics.activity import record_activity, clear_activity
+import logging
+
+logger = logging.getLogger('analytics')
+
+
+@receiver(post_save, sender=UsageData)
+def update_usage_distributions(sender, instance, **kwargs):
+    """Update the user's daily screen time / unlocks in population sketches"""
+    try:
+        user_id = instance.device.user_id
+        totals = UsageData.objects.filter(
+            device__user_id=user_id,
+            date=instance.date
+        ).aggregate(
+            screen_time=Sum('total_screen_time'),
+            unlocks=Sum('unlock_count'),
+            pickups=Sum('pickup_count')
+        )
+
+        update_user_day(
+            user_id,
+            instance.date,
+            values={
+                'screen_time': totals['screen_time'] or 0,
+                'unlocks': totals['unlocks'] or 0,
+            },
+            totals={
+                'total_screen_time_all_devices': timedelta(minutes=totals['screen_time'] or 0),
+                'total_pickups_all_devices': totals['pickups'] or 0,
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error updating usage distributions for {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=AppUsage)
+def update_category_distributions(sender, instance, **kwargs):
+    """Update the user's daily minutes for the app's category in population sketches"""
+    try:
+        device_app = DeviceApp.objects.filter(pk=instance.device_app_id).values(
+            'device__user_id', 'app__category_id', 'app__category__name'
+        ).first()
+        if not device_app:
+            return
+
+        user_id = device_app['device__user_id']
+        minutes = AppUsage.objects.filter(
+            device_app__device__user_id=user_id,
+            device_app__app__category_id=device_app['app__category_id'],
+            date=instance.date
+        ).aggregate(total=Sum('time_spent_minutes'))['total'] or 0
+
+        metric = f"category:{slugify(device_app['app__category__name'])}"
+        update_user_day(user_id, instance.date, values={metric: minutes})
+    except Exception as e:
+        logger.error(f"Error updating category distributions for {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=UsageData)
+def mark_user_active(sender, instance, **kwargs):
+    """Add the user to the day's activity bitmap"""
+    try:
+        record_activity(instance.device.user_id, instance.date)
+    except Exception as e:
+        logger.error(f"Error recording activity for usage {instance.pk}: {str(e)}")
+
+
+@receiver(post_delete, sender=UsageData)
+def unmark_user_active(sender, instance, **kwargs):
+    """Remove the user from the day's activity bitmap once no usage is left for it"""
+    try:
+        user_id = instance.device.user_id
+        if not UsageData.objects.filter(device__user_id=user_id, date=instance.date).exists():
+            clear_activity(user_id, instance.date)
+    except Exception as e:
+        logger.error(f"Error clearing activity for usage {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=UsageData)
+@receiver(post_delete, sender=UsageData)
+def invalidate_usage_heatmaps(sender, instance, **kwargs):
+    """Drop the cached user and device heatmap day"""
+    try:
+        invalidate_day('user', instance.device.user_id, instance.date)
+        invalidate_day('device', instance.device_id, instance.date)
+    except Exception as e:
+        logger.error(f"Error invalidating heatmaps for {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=AppUsage)
+@receiver(post_delete, sender=AppUsage)
+def invalidate_app_heatmaps(sender, instance, **kwargs):
+    """Drop the cached app heatmap day"""
+    try:
+        invalidate_day('app', instance.device_app_id, instance.date)
+    except Exception as e:
+        logger.error(f"Error invalidating heatmaps for {instance.pk}: {str(e)}")
@@ -0,0 +1,160 @@
+"""
+Mergeable quantile sketches for population usage distributions
+
+A small merging t-digest: values are buffered, then compressed into a
+sorted list of (mean, weight) centroids whose size is bounded by the
+compression factor. Digests serialize to plain JSON so they can be stored
+in a JSONField and merged into weekly/monthly distributions.
+"""
+from typing import Dict, Iterable, List, Optional
+
+
+class TDigest:
+    """Approximate quantile sketch (merging t-digest)"""
+
+    DEFAULT_COMPRESSION = 100
+    BUFFER_SIZE = 500
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION, centroids: Optional[List] = None,
+                 min_value: Optional[float] = None, max_value: Optional[float] = None):
+        self.compression = compression
+        self.centroids = [list(c) for c in (centroids or [])]  # [[mean, weight], ...] sorted by mean
+        self.min_value = min_value
+        self.max_value = max_value
+        self._buffer = []
+
+    @property
+    def count(self) -> float:
+        return sum(c[1] for c in self.centroids) + sum(w for _, w in self._buffer)
+
+    def add(self, value: float, weight: float = 1.0):
+        """Add a value to the sketch"""
+        value = float(value)
+        self._buffer.append((value, weight))
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = value if self.max_value is None else max(self.max_value, value)
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self.compress()
+
+    def merge(self, other: 'TDigest'):
+        """Merge another digest into this one"""
+        other.compress()
+        for mean, weight in other.centroids:
+            self._buffer.append((mean, weight))
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        if other.max_value is not None:
+            self.max_value = other.max_value if self.max_value is None else max(self.max_value, other.max_value)
+        self.compress()
+        return self
+
+    @classmethod
+    def merge_all(cls, digests: Iterable['TDigest'], compression: int = DEFAULT_COMPRESSION) -> 'TDigest':
+        merged = cls(compression=compression)
+        for digest in digests:
+            merged.merge(digest)
+        return merged
+
+    def compress(self):
+        """Fold buffered values into the centroid list"""
+        if not self._buffer:
+            return
+        points = sorted([tuple(c) for c in self.centroids] + self._buffer)
+        self._buffer = []
+
+        total = sum(w for _, w in points)
+        merged = []
+        cumulative = 0.0
+        mean, weight = points[0]
+        for next_mean, next_weight in points[1:]:
+            q = (cumulative + (weight + next_weight) / 2) / total
+            limit = 4 * total * q * (1 - q) / self.compression
+            if weight + next_weight <= max(limit, 1):
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append([mean, weight])
+                cumulative += weight
+                mean, weight = next_mean, next_weight
+        merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the value at quantile q (0.0 - 1.0)"""
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        q = min(max(q, 0.0), 1.0)
+        total = sum(c[1] for c in self.centroids)
+        target = q * total
+        cumulative = 0.0
+        for i, (mean, weight) in enumerate(self.centroids):
+            if cumulative + weight / 2 >= target:
+                if i == 0:
+                    lower, lower_pos = self.min_value, 0.0
+                else:
+                    prev_mean, prev_weight = self.centroids[i - 1]
+                    lower, lower_pos = prev_mean, cumulative - prev_weight / 2
+                upper_pos = cumulative + weight / 2
+                if upper_pos == lower_pos:
+                    return mean
+                return lower + (mean - lower) * (target - lower_pos) / (upper_pos - lower_pos)
+            cumulative += weight
+
+        last_mean, last_weight = self.centroids[-1]
+        last_pos = total - last_weight / 2
+        if total == last_pos:
+            return self.max_value
+        return last_mean + (self.max_value - last_mean) * (target - last_pos) / (total - last_pos)
+
+    def cdf(self, value: float) -> Optional[float]:
+        """
+        Estimate the fraction of values less than or equal to value
+
+        Values equal to a sample count half of it (mid-rank), so the minimum
+        is at 1/(2n) and the maximum at 1 - 1/(2n) rather than 0 and 1.
+        """
+        self.compress()
+        if not self.centroids:
+            return None
+        if value < self.min_value:
+            return 0.0
+        if value > self.max_value:
+            return 1.0
+
+        total = sum(c[1] for c in self.centroids)
+        cumulative = 0.0
+        prev_mean, prev_pos = self.min_value, 0.5
+        for mean, weight in self.centroids:
+            pos = max(cumulative + weight / 2, 0.5)
+            if value < mean:
+                return (prev_pos + (pos - prev_pos) * (value - prev_mean) / (mean - prev_mean)) / total
+            cumulative += weight
+            prev_mean, prev_pos = mean, pos
+
+        if self.max_value == prev_mean:
+            return prev_pos / total
+        end = total - 0.5
+        return (prev_pos + (end - prev_pos) * (value - prev_mean) / (self.max_value - prev_mean)) / total
+
+    def to_dict(self) -> Dict:
+        self.compress()
+        return {
+            'compression': self.compression,
+            'centroids': [[round(m, 4), w] for m, w in self.centroids],
+            'min': self.min_value,
+            'max': self.max_value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'TDigest':
+        data = data or {}
+        return cls(
+            compression=data.get('compression', cls.DEFAULT_COMPRESSION),
+            centroids=data.get('centroids'),
+            min_value=data.get('min'),
+            max_value=data.get('max'),
+        )
@@ -6,53 +6,261 @@ from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Sum, Avg, Count, Max, F, Q
 from apps.analytics.models import UserStats, TrendAnalysis
-from apps.usage.models import UsageData, AppUsageData, UsagePattern
+from apps.usage.models import UsageData, AppUsage, UsagePattern
 from apps.conversations.models import Conversation
 from apps.devices.models import Device
 from apps.social.models import FriendConnection, Challenge
+from apps.analytics.distributions import (
+    daily_percentile, get_user_values, get_window_distribution, rollup_daily_distributions
+)
+from apps.usage.leaderboards import get_top_device_apps
+from apps.applications.models import App
+import numpy as np
 import logging
 
 logger = logging.getLogger('analytics')
 
+# UserStats category fields, in lookup-table column order
+CATEGORY_FIELDS = ['social_media_time', 'productivity_time', 'entertainment_time', 'communication_time']
+CATEGORY_CHUNK_SIZE = 500
+
+PIPELINE_TICK_MINUTES = 30  # How often dispatch_daily_pipeline runs
+PIPELINE_SHARD_SIZE = 1000  # Users per pipeline DAG
+# Past local midnight, late devices are no longer waited for
+INGESTION_DEADLINE_MINUTES = 3 * 60
+# Days the nightly rollup rebuilds, so usage synced late is folded in
+POPULATION_ROLLUP_DAYS = 3
+
+
+def daily_pipeline(user_ids, date, deadline):
+    """
+    The daily pipeline for one shard of users, as a Celery canvas
+    
+    Each stage starts as soon as the stages it reads from have finished:
+    
+        ingestion ─┬─ journals
+                   └─ patterns + relationships ── stats + conversations
+    
+    Anomaly triggers are evaluated at ingestion (usage.anomalies) and read
+    by the conversation stage, so they need no stage of their own.
+    """
+    from celery import chain, group
+    from apps.usage.tasks import await_ingestion, detect_patterns
+    from apps.applications.tasks import update_app_relationships
+    from apps.ai_engine.tasks import generate_daily_conversations, generate_daily_journals
+    
+    shard = {'user_ids': user_ids, 'date': str(date)}
+    return chain(
+        await_ingestion.si(user_ids, str(date), deadline.isoformat()),
+        group(
+            generate_daily_journals.si(**shard),
+            chain(
+                group(detect_patterns.si(**shard), update_app_relationships.si(**shard)),
+                group(calculate_user_stats.si(**shard), generate_daily_conversations.si(**shard)),
+            ),
+        ),
+    )
+
+
+@shared_task(name='apps.analytics.tasks.dispatch_daily_pipeline')
+def dispatch_daily_pipeline():
+    """
+    Start the daily pipeline for the timezones whose local midnight passed
+    during the last tick
+    Runs every PIPELINE_TICK_MINUTES
+    
+    Their users are split into shards of PIPELINE_SHARD_SIZE, and each shard
+    runs the daily_pipeline DAG for the local day that just ended.
+    """
+    from django.contrib.auth import get_user_model
+    from apps.accounts.timezones import bucket_start, timezones_past_midnight
+    User = get_user_model()
+    
+    tick = bucket_start(timezone.now(), PIPELINE_TICK_MINUTES)
+    deadline = tick + timedelta(minutes=INGESTION_DEADLINE_MINUTES)
+    shards = 0
+    for date, timezones in sorted(timezones_past_midnight(tick - timedelta(minutes=PIPELINE_TICK_MINUTES), tick).items()):
+        user_ids = [str(pk) for pk in User.objects.filter(
+            is_active=True,
+            timezone__in=timezones
+        ).order_by('pk').values_list('id', flat=True)]
+        for i in range(0, len(user_ids), PIPELINE_SHARD_SIZE):
+            daily_pipeline(user_ids[i:i + PIPELINE_SHARD_SIZE], date, deadline).apply_async()
+            shards += 1
+        logger.info(f"Started the daily pipeline for {date} in {len(timezones)} timezones ({len(user_ids)} users)")
+    return {'shards': shards, 'tick': tick.isoformat()}
+
 
 @shared_task(name='apps.analytics.tasks.calculate_user_stats')
-def calculate_user_stats():
+def calculate_user_stats(user_ids=None, date=None):
     """
-    Calculate statistics for all users
-    Runs daily at 1 AM
+    Calculate statistics for all users, or for a pipeline shard's users once
+    their local day `date` has ended (see dispatch_daily_pipeline)
     """
     logger.info("Starting user statistics calculation")
     
     from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
     User = get_user_model()
     
+    date = parse_date(date) if isinstance(date, str) else date
+    # Stats are kept for the day the run falls on, category breakdowns for the day before
+    today = date + timedelta(days=1) if date else None
     updated_count = 0
     users = User.objects.filter(is_active=True)
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    
+    # Category breakdowns are computed in bulk, not per user
+    calculate_category_breakdowns(date, user_ids=user_ids)
+    
+    # The population's daily screen time over the stats window is the same for every user
+    end = today or timezone.now().date()
+    population = get_window_distribution('screen_time', end - timedelta(days=30), end)
     
     for user in users:
         try:
-            calculate_stats_for_user(user)
+            calculate_stats_for_user(user, today, population)
             updated_count += 1
         except Exception as e:
             logger.error(f"Error calculating stats for user {user.id}: {str(e)}")
     
     logger.info(f"User statistics calculation complete: {updated_count} users updated")
     
-    # Also calculate trends
-    calculate_trends()
+    # Trends are global; pipeline shards leave them to their own daily run
+    if user_ids is None:
+        calculate_trends()
     
     return {'users_updated': updated_count}
 
 
-def calculate_stats_for_user(user):
-    """Calculate comprehensive statistics for a user"""
-    now = timezone.now()
-    today = now.date()
+@shared_task(name='apps.analytics.tasks.rollup_population_distributions')
+def rollup_population_distributions(date=None, days=POPULATION_ROLLUP_DAYS):
+    """
+    Rebuild the daily population sketches of the `days` days up to `date`
+    (default yesterday) from the users' UserStats.sketch_values
+    """
+    from django.utils.dateparse import parse_date
+    
+    date = parse_date(date) if isinstance(date, str) else date
+    end = date or timezone.now().date() - timedelta(days=1)
+    metrics = 0
+    for offset in range(days):
+        metrics += rollup_daily_distributions(end - timedelta(days=offset))
+    logger.info(f"Rolled up population distributions for {days} days up to {end}")
+    return {'date': str(end), 'days': days, 'metrics': metrics}
+
+
+@shared_task(name='apps.analytics.tasks.calculate_category_breakdowns')
+def calculate_category_breakdowns(date=None, chunk_size=CATEGORY_CHUNK_SIZE, user_ids=None):
+    """
+    Fill UserStats category times for all users (or the given ones) for one
+    day (default yesterday)
+    
+    Loads an app-id -> category lookup table once, then per chunk of users
+    runs one grouped AppUsage scan and folds it into categories with numpy.
+    """
+    from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
+    User = get_user_model()
+    
+    date = parse_date(date) if isinstance(date, str) else date
+    date = date or timezone.now().date() - timedelta(days=1)
+    logger.info(f"Starting category breakdown calculation for {date}")
+    
+    lookup = build_category_lookup()
+    users = User.objects.filter(is_active=True)
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    user_ids = list(users.values_list('id', flat=True))
+    updated_count = 0
+    
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        try:
+            updated_count += calculate_category_breakdowns_for_users(chunk, date, lookup)
+        except Exception as e:
+            logger.error(f"Error calculating category breakdowns for chunk {i // chunk_size}: {str(e)}")
+    
+    logger.info(f"Category breakdown calculation complete: {updated_count} users updated")
+    return {'users_updated': updated_count, 'date': str(date)}
+
+
+def build_category_lookup():
+    """
+    Boolean table indexed by App id, one column per CATEGORY_FIELDS entry
+    """
+    apps = list(App.objects.values_list(
+        'id', 'is_social_media', 'is_productivity', 'is_entertainment', 'is_game', 'category__name'
+    ))
+    lookup = np.zeros((max((app[0] for app in apps), default=0) + 1, len(CATEGORY_FIELDS)), dtype=bool)
+    for app_id, is_social, is_productivity, is_entertainment, is_game, category_name in apps:
+        lookup[app_id] = [
+            is_social,
+            is_productivity,
+            is_entertainment or is_game,
+            category_name == 'Communication',
+        ]
+    return lookup
+
+
+def calculate_category_breakdowns_for_users(user_ids, date, lookup):
+    """Compute and bulk-write category minutes for a chunk of users"""
+    rows = list(AppUsage.objects.filter(
+        device_app__device__user_id__in=user_ids,
+        date=date
+    ).values_list('device_app__device__user_id', 'device_app__app_id').annotate(
+        minutes=Sum('time_spent_minutes')
+    ))
+    if not rows:
+        return 0
+    
+    user_index = {}
+    user_positions = np.array([user_index.setdefault(row[0], len(user_index)) for row in rows])
+    app_ids = np.array([row[1] for row in rows])
+    minutes = np.array([row[2] or 0 for row in rows], dtype=np.int64)
+    
+    # Apps created after the lookup was built count towards no category
+    known = app_ids < len(lookup)
+    flags = np.zeros((len(rows), len(CATEGORY_FIELDS)), dtype=bool)
+    flags[known] = lookup[app_ids[known]]
+    
+    totals = np.zeros((len(user_index), len(CATEGORY_FIELDS)), dtype=np.int64)
+    np.add.at(totals, user_positions, flags * minutes[:, None])
+    
+    stats = [
+        UserStats(
+            user_id=user_id,
+            date=date,
+            **{
+                field: timedelta(minutes=int(totals[position, column]))
+                for column, field in enumerate(CATEGORY_FIELDS)
+            }
+        )
+        for user_id, position in user_index.items()
+    ]
+    UserStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['user', 'date'],
+        update_fields=CATEGORY_FIELDS
+    )
+    return len(stats)
+
+
+def calculate_stats_for_user(user, today=None, population=None):
+    """
+    Calculate comprehensive statistics for a user as of a day (default today)
+    
+    population is the daily screen time sketch over the last 30 days, when
+    the caller has already built it.
+    """
+    today = today or timezone.now().date()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
     
     # Get or create UserStats
-    stats, created = UserStats.objects.get_or_create(user=user)
+    stats, created = UserStats.objects.get_or_create(user=user, date=today)
     
     # Total screen time
     total_usage = UsageData.objects.filter(device__user=user).aggregate(
@@ -83,7 +291,7 @@ def calculate_stats_for_user(user):
     ).values('date').distinct().count()
     
     # Current streak
-    stats.current_streak = calculate_current_streak(user)
+    stats.current_streak = calculate_current_streak(user, today)
     
     # Longest streak
     longest = calculate_longest_streak(user)
@@ -106,25 +314,23 @@ def calculate_stats_for_user(user):
     
     stats.avg_daily_unlocks = round(recent_unlocks, 1)
     
-    # Most used app
-    top_app = AppUsageData.objects.filter(
-        usage_data__device__user=user,
-        usage_data__date__gte=month_ago
-    ).values('device_app__app__name').annotate(
-        total_time=Sum('time_spent')
-    ).order_by('-total_time').first()
+    # Percentile of daily screen time among all users (last 30 days)
+    stats.screen_time_percentile = calculate_screen_time_percentile(user, month_ago, today, population)
+    
+    # Most used app (30-day leaderboard)
+    top_apps = get_top_device_apps(user.id, '30d', as_of=today, limit=1)
     
-    if top_app:
-        stats.most_used_app = top_app['device_app__app__name']
-        stats.most_used_app_time = top_app['total_time']
+    if top_apps:
+        stats.most_used_app = top_apps[0].app.name
+        stats.most_used_app_time = top_apps[0].minutes
     
     # Most productive app
-    productive_app = AppUsageData.objects.filter(
-        usage_data__device__user=user,
-        usage_data__date__gte=month_ago,
+    productive_app = AppUsage.objects.filter(
+        device_app__device__user=user,
+        date__gte=month_ago,
         device_app__app__category__name='Productivity'
     ).values('device_app__app__name').annotate(
-        total_time=Sum('time_spent')
+        total_time=Sum('time_spent_minutes')
     ).order_by('-total_time').first()
     
     if productive_app:
@@ -144,18 +350,18 @@ def calculate_stats_for_user(user):
     # Active patterns count
     stats.active_patterns = UsagePattern.objects.filter(
         user=user,
-        resolved=False
+        is_active=True
     ).count()
     
     # Friends count
     stats.friends_count = FriendConnection.objects.filter(
-        Q(user=user) | Q(friend=user),
-        status='accepted'
+        Q(user=user) | Q(friend_user=user),
+        is_active=True
     ).count()
     
     # Challenges completed
-    stats.challenges_completed = user.challenge_participants.filter(
-        status='completed'
+    stats.challenges_completed = user.challenges.filter(
+        end_date__lt=today
     ).count()
     
     # Achievements earned (placeholder - would need achievement system)
@@ -165,7 +371,7 @@ def calculate_stats_for_user(user):
     from apps.usage.models import UsageGoal
     stats.goals_achieved = UsageGoal.objects.filter(
         user=user,
-        status='achieved'
+        completion_percentage__gte=100
     ).count()
     
     # Week comparison (this week vs last week)
@@ -233,9 +439,25 @@ def calculate_stats_for_user(user):
     logger.info(f"Updated stats for user {user.id}")
 
 
-def calculate_current_streak(user):
+def calculate_screen_time_percentile(user, start_date, end_date, population=None):
+    """
+    Percentile of the user's daily screen time among all users' days
+
+    Uses the daily values kept in UserStats.sketch_values and the population
+    sketch over the same days (built here unless passed in), so no usage rows
+    are scanned or sorted.
+    """
+    values = get_user_values(user, 'screen_time', start_date, end_date)
+    if not values:
+        return None
+    if population is None:
+        population = get_window_distribution('screen_time', start_date, end_date)
+    return daily_percentile(population, values)
+
+
+def calculate_current_streak(user, today=None):
     """Calculate current consecutive days of usage"""
-    today = timezone.now().date()
+    today = today or timezone.now().date()
     streak = 0
     
     check_date = today
@@ -290,7 +512,15 @@ def calculate_wellness_score(user, stats):
     score = 100
     
     # Screen time penalty (lose up to 30 points)
-    if stats.avg_daily_screen_time > 360:  # 6+ hours
+    # Relative to the population when a percentile is available
+    if stats.screen_time_percentile is not None:
+        if stats.screen_time_percentile > 90:
+            score -= 30
+        elif stats.screen_time_percentile > 75:
+            score -= 20
+        elif stats.screen_time_percentile > 50:
+            score -= 10
+    elif stats.avg_daily_screen_time > 360:  # 6+ hours
         score -= 30
     elif stats.avg_daily_screen_time > 240:  # 4-6 hours
         score -= 20
@@ -330,8 +560,12 @@ def calculate_wellness_score(user, stats):
     return max(0, min(100, score))  # Clamp between 0-100
 
 
+@shared_task(name='apps.analytics.tasks.calculate_trends')
 def calculate_trends():
-    """Calculate trend analyses"""
+    """
+    Calculate trend analyses
+    Runs daily at 1 AM
+    """
     logger.info("Starting trend analysis")
     
     today = timezone.now().date()
@@ -353,11 +587,11 @@ def calculate_popular_apps_trend(date):
     week_ago = date - timedelta(days=7)
     
     # Get top apps by total usage
-    top_apps = AppUsageData.objects.filter(
-        usage_data__date__gte=week_ago
+    top_apps = AppUsage.objects.filter(
+        date__gte=week_ago
     ).values('device_app__app__name').annotate(
-        total_time=Sum('time_spent'),
-        user_count=Count('usage_data__device__user', distinct=True)
+        total_time=Sum('time_spent_minutes'),
+        user_count=Count('device_app__device__user', distinct=True)
     ).order_by('-total_time')[:10]
     
     trend_data = {
@@ -425,3 +659,66 @@ def calculate_conversation_topics_trend(date):
             'date': date
         }
     )
+
+
+@shared_task(name='apps.analytics.tasks.rebuild_activity_bitmaps')
+def rebuild_activity_bitmaps(days=90):
+    """
+    Rebuild daily activity bitmaps from UsageData
+    One-off backfill; bitmaps are maintained at ingestion afterwards
+    """
+    from django.core.cache import cache
+    from apps.analytics.models import ActivityUser, ActivityBitmap
+    from apps.analytics.bitmaps import RoaringBitmap
+    from apps.analytics.activity import _member_cache_key
+    
+    logger.info("Starting activity bitmap rebuild")
+    
+    today = timezone.now().date()
+    start_date = today - timedelta(days=days - 1)
+    
+    rows = list(UsageData.objects.filter(
+        date__gte=start_date,
+        date__lte=today
+    ).values_list('device__user_id', 'date').distinct())
+    
+    # Earliest activity per user, including days before the window
+    first_active = {}
+    for user_id, usage_date in rows:
+        if user_id not in first_active or usage_date < first_active[user_id]:
+            first_active[user_id] = usage_date
+    existing = dict(ActivityUser.objects.filter(
+        user_id__in=first_active
+    ).values_list('user_id', 'first_active_date'))
+    for user_id, first_date in existing.items():
+        first_active[user_id] = min(first_date, first_active[user_id])
+    
+    ActivityUser.objects.bulk_create(
+        [ActivityUser(user_id=user_id, first_active_date=first_date) for user_id, first_date in first_active.items()],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['first_active_date']
+    )
+    cache.delete_many([_member_cache_key(user_id) for user_id in first_active])
+    
+    index = dict(ActivityUser.objects.filter(user_id__in=first_active).values_list('user_id', 'pk'))
+    members = {('active', day): [] for day in (start_date + timedelta(days=i) for i in range(days))}
+    members.update({('new', day): [] for _, day in members})
+    for user_id, usage_date in rows:
+        members[('active', usage_date)].append(index[user_id])
+    for member in ActivityUser.objects.filter(first_active_date__gte=start_date, first_active_date__lte=today):
+        members[('new', member.first_active_date)].append(member.pk)
+    
+    bitmaps = []
+    for (kind, day), indexes in members.items():
+        bitmap = RoaringBitmap(indexes)
+        bitmaps.append(ActivityBitmap(kind=kind, date=day, data=bitmap.to_bytes(), cardinality=len(bitmap)))
+    ActivityBitmap.objects.bulk_create(
+        bitmaps,
+        update_conflicts=True,
+        unique_fields=['kind', 'date'],
+        update_fields=['data', 'cardinality', 'updated_at']
+    )
+    
+    logger.info(f"Activity bitmap rebuild complete: {len(first_active)} users over {days} days")
+    return {'users': len(first_active), 'days': days}
@@ -1,3 +1,149 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from apps.analytics.activity import active_user_chunks, activity_summary, cohort_retention, record_activity
+from apps.analytics.bitmaps import ARRAY_MAX, RoaringBitmap
+from apps.analytics.distributions import (
+    daily_percentile, get_distribution, rollup_daily_distributions, update_user_day
+)
+from apps.analytics.models import PopulationDistribution
+from apps.analytics.sketches import TDigest
 
-# Create your tests here.
+
+class TDigestCdfTests(SimpleTestCase):
+
+    def digest(self, values):
+        digest = TDigest()
+        for value in values:
+            digest.add(value)
+        return digest
+
+    def test_outside_range(self):
+        digest = self.digest(range(1, 101))
+        self.assertEqual(digest.cdf(0), 0.0)
+        self.assertEqual(digest.cdf(101), 1.0)
+
+    def test_min_and_max_are_mid_rank(self):
+        digest = self.digest(range(1, 101))
+        self.assertAlmostEqual(digest.cdf(1), 1 / 200)
+        self.assertAlmostEqual(digest.cdf(100), 1 - 1 / 200)
+
+    def test_single_value(self):
+        digest = self.digest([5])
+        self.assertEqual(digest.cdf(5), 0.5)
+
+    def test_monotonic(self):
+        digest = self.digest(range(1, 1001))
+        values = [digest.cdf(v) for v in range(1, 1001, 7)]
+        self.assertEqual(values, sorted(values))
+        self.assertAlmostEqual(digest.cdf(500), 0.5, delta=0.02)
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(email=f'u{i}@example.com', username=f'u{i}', password='x') for i in range(3)
+        ]
+
+    def test_ingestion_only_touches_user_rows(self):
+        update_user_day(self.users[0].id, timezone.now().date(), {'screen_time': 100})
+        self.assertFalse(PopulationDistribution.objects.exists())
+
+    def test_unrolled_day_is_sketched_on_read(self):
+        today = timezone.now().date()
+        update_user_day(self.users[0].id, today, {'screen_time': 100})
+        update_user_day(self.users[1].id, today, {'screen_time': 300})
+        self.assertEqual(get_distribution('screen_time', 'daily', today).count, 2)
+
+    def test_resynced_value_replaces_old_one(self):
+        day = timezone.now().date() - timedelta(days=1)
+        update_user_day(self.users[0].id, day, {'screen_time': 100})
+        update_user_day(self.users[0].id, day, {'screen_time': 150})
+        rollup_daily_distributions(day)
+        digest = get_distribution('screen_time', 'daily', day)
+        self.assertEqual(digest.count, 1)
+        self.assertEqual(digest.quantile(0.5), 150)
+
+    def test_closed_rollup_picks_up_late_usage(self):
+        day = timezone.now().date() - timedelta(days=40)
+        update_user_day(self.users[0].id, day, {'screen_time': 100})
+        rollup_daily_distributions(day)
+        self.assertEqual(get_distribution('screen_time', 'monthly', day).count, 1)
+
+        # Synced after the monthly rollup was persisted, folded in by the next nightly rollup
+        update_user_day(self.users[1].id, day, {'screen_time': 200})
+        rollup_daily_distributions(day)
+        self.assertEqual(get_distribution('screen_time', 'monthly', day).count, 2)
+
+    def test_daily_percentile_ranks_each_day(self):
+        digest = TDigest()
+        for value in range(1, 101):
+            digest.add(value)
+        self.assertAlmostEqual(daily_percentile(digest, [25.5, 75.5]), 50, delta=1)
+        self.assertIsNone(daily_percentile(digest, []))
+
+
+class RoaringBitmapTests(SimpleTestCase):
+
+    def test_set_operations(self):
+        a = RoaringBitmap([1, 5, 70000, 200000])
+        b = RoaringBitmap([5, 70000, 9])
+        self.assertEqual(list(a | b), [1, 5, 9, 70000, 200000])
+        self.assertEqual(list(a & b), [5, 70000])
+        self.assertEqual(list(a - b), [1, 200000])
+        self.assertEqual(list(RoaringBitmap.union([a, b, RoaringBitmap()])), list(a | b))
+
+    def test_dense_container_round_trip(self):
+        values = list(range(0, 3 * ARRAY_MAX, 2))
+        bitmap = RoaringBitmap(values)
+        self.assertEqual(len(bitmap), len(values))
+        restored = RoaringBitmap.from_bytes(bitmap.to_bytes())
+        self.assertEqual(restored, bitmap)
+        self.assertIn(2 * ARRAY_MAX, restored)
+        self.assertNotIn(1, restored)
+
+    def test_discard_back_to_sparse(self):
+        bitmap = RoaringBitmap(range(ARRAY_MAX + 1))
+        for value in range(1, ARRAY_MAX + 1):
+            bitmap.discard(value)
+        self.assertEqual(list(bitmap), [0])
+        self.assertEqual(RoaringBitmap.from_bytes(bitmap.to_bytes()), bitmap)
+
+
+class ActivityTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(email=f'u{i}@example.com', username=f'u{i}', password='x') for i in range(3)
+        ]
+        self.day = timezone.now().date()
+
+    def test_summary_counts_distinct_users(self):
+        record_activity(self.users[0].id, self.day)
+        record_activity(self.users[0].id, self.day)
+        record_activity(self.users[1].id, self.day - timedelta(days=3))
+        record_activity(self.users[2].id, self.day - timedelta(days=20))
+        summary = activity_summary(self.day)
+        self.assertEqual((summary['dau'], summary['wau'], summary['mau']), (1, 2, 3))
+
+    def test_active_user_chunks(self):
+        for user in self.users:
+            record_activity(user.id, self.day)
+        chunks = list(active_user_chunks(self.day, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(sorted(sum(chunks, [])), sorted(user.id for user in self.users))
+        self.assertEqual(list(active_user_chunks(self.day, user_ids=[self.users[1].id])), [[self.users[1].id]])
+
+    def test_late_synced_day_moves_cohort(self):
+        week = timedelta(weeks=1)
+        record_activity(self.users[0].id, self.day)
+        record_activity(self.users[0].id, self.day - week)
+        cohorts = cohort_retention(self.day, weeks=2)
+        self.assertEqual([cohort['size'] for cohort in cohorts], [1, 0])
+        self.assertEqual(cohorts[0]['retention'], [1.0, 1.0])
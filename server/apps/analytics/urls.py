@@ -5,6 +5,9 @@ from . import views
 router = DefaultRouter()
 router.register('stats', views.UserStatsViewSet, basename='userstats')
 router.register('trends', views.TrendAnalysisViewSet, basename='trendanalysis')
+router.register('population', views.PopulationViewSet, basename='population')
+router.register('heatmap', views.HeatmapViewSet, basename='heatmap')
+router.register('activity', views.ActivityViewSet, basename='activity')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,10 +1,32 @@
 from rest_framework import viewsets, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework import status
 from django_filters.rest_framework import DjangoFilterBackend
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.core.exceptions import ValidationError
 from .models import UserStats, TrendAnalysis
 from .serializers import UserStatsSerializer, TrendAnalysisSerializer
+from .distributions import get_percentile
+from .heatmaps import get_heatmap
+from .activity import activity_summary, cohort_retention
+from datetime import timedelta
+
+
+def _query_date(request, name):
+    """A YYYY-MM-DD query parameter as a date, None if absent; ValueError if it isn't a real date"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    day = parse_date(value)  # Raises ValueError for impossible dates such as 2024-02-30
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+_DATE_ERROR = {"error": "Dates must be valid and in YYYY-MM-DD format"}
 
 
 class UserStatsViewSet(viewsets.ReadOnlyModelViewSet):
@@ -56,3 +78,123 @@ class TrendAnalysisViewSet(viewsets.ReadOnlyModelViewSet):
             serializer = self.get_serializer(trend)
             return Response(serializer.data)
         return Response({"message": f"No {period_type} trends available yet"})
+
+
+class PopulationViewSet(viewsets.ViewSet):
+    """
+    Compare the user's usage with the population distribution
+    """
+    permission_classes = [IsAuthenticated]
+    
+    @action(detail=False, methods=['get'])
+    def percentile(self, request):
+        """Get the user's percentile and population quantiles for a metric"""
+        metric = request.query_params.get('metric', 'screen_time')
+        period_type = request.query_params.get('period_type', 'daily')
+        day = request.query_params.get('date')
+        
+        if period_type not in ('daily', 'weekly', 'monthly'):
+            return Response(
+                {"error": "period_type must be daily, weekly or monthly"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            day = parse_date(day) if day else timezone.now().date()
+        except ValueError:  # Well formed but impossible, e.g. 2024-02-30
+            day = None
+        if day is None:
+            return Response(
+                {"error": "date must be in YYYY-MM-DD format"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(get_percentile(request.user, metric, period_type, day))
+
+
+class HeatmapViewSet(viewsets.ViewSet):
+    """
+    Weekday x hour usage heatmaps for the user, a device or an app
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def list(self, request):
+        """Get a 7x24 heatmap (rows Monday-Sunday, columns hours) for a date range"""
+        from apps.devices.models import Device
+        from apps.applications.models import DeviceApp
+        
+        try:
+            end_date = _query_date(request, 'end_date') or timezone.now().date()
+            start_date = _query_date(request, 'start_date') or end_date - timedelta(days=29)
+        except ValueError:
+            return Response(_DATE_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        if start_date > end_date or (end_date - start_date).days > 365:
+            return Response(
+                {"error": "Date range must be between 1 and 366 days"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        device_id = request.query_params.get('device')
+        device_app_id = request.query_params.get('app')
+        scope, scope_id = 'user', request.user.id
+        
+        try:
+            if device_app_id:
+                scope, scope_id = 'app', DeviceApp.objects.values_list('id', flat=True).get(
+                    id=device_app_id, device__user=request.user
+                )
+            elif device_id:
+                scope, scope_id = 'device', Device.objects.values_list('id', flat=True).get(
+                    id=device_id, user=request.user
+                )
+        except (DeviceApp.DoesNotExist, Device.DoesNotExist, ValueError, ValidationError):
+            return Response({"error": "Device or app not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        heatmap = get_heatmap(scope, scope_id, start_date, end_date)
+        
+        return Response({
+            'scope': scope,
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+            'heatmap': heatmap.round(1).tolist(),
+            'weekday_totals': heatmap.sum(axis=1).round(1).tolist(),
+            'hour_totals': heatmap.sum(axis=0).round(1).tolist()
+        })
+
+
+class ActivityViewSet(viewsets.ViewSet):
+    """
+    Admin-only active user counts and retention from the activity bitmaps
+    """
+    permission_classes = [IsAdminUser]
+    
+    def list(self, request):
+        """Get DAU / WAU / MAU for the windows ending on a date"""
+        try:
+            day = _query_date(request, 'date') or timezone.now().date()
+        except ValueError:
+            return Response(_DATE_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        return Response(activity_summary(day))
+    
+    @action(detail=False, methods=['get'])
+    def retention(self, request):
+        """Get weekly cohort retention for the last N weeks"""
+        try:
+            day = _query_date(request, 'date') or timezone.now().date()
+        except ValueError:
+            return Response(_DATE_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            weeks = int(request.query_params.get('weeks', 8))
+        except ValueError:
+            weeks = 0
+        if not 1 <= weeks <= 52:
+            return Response(
+                {"error": "weeks must be between 1 and 52"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'date': str(day),
+            'weeks': weeks,
+            'cohorts': cohort_retention(day, weeks)
+        })
@@ -0,0 +1,194 @@
+"""
+Celery tasks for app relationships
+"""
+from celery import shared_task
+from django.utils import timezone
+from datetime import timedelta
+from itertools import groupby
+from apps.applications.models import DeviceApp, AppRelationship
+from apps.usage.models import AppUsage
+import numpy as np
+import logging
+
+logger = logging.getLogger('applications')
+
+CO_USAGE_WINDOW_DAYS = 14
+MAX_RELATIONSHIPS_PER_APP = 5
+MIN_CO_USAGE_SIMILARITY = 0.2
+
+
+@shared_task(name='apps.applications.tasks.update_app_relationships')
+def update_app_relationships(window_days=CO_USAGE_WINDOW_DAYS, user_ids=None, date=None):
+    """
+    Recompute app co-usage relationships for all users, or for a pipeline
+    shard's users over the window ending on their local day `date`
+    (see analytics.tasks.dispatch_daily_pipeline)
+
+    Computed relationships the run didn't refresh (the pair fell out of the
+    top neighbours or below the similarity floor, or the user had no usage
+    in the window) are reset to no co-usage.
+    """
+    from django.utils.dateparse import parse_date
+
+    logger.info("Starting app co-usage relationship update")
+
+    date = parse_date(date) if isinstance(date, str) else date
+    today = date + timedelta(days=1) if date else timezone.now().date()
+    start_date = today - timedelta(days=window_days)
+    started = timezone.now()
+    updated_count = 0
+    user_count = 0
+    failed_user_ids = []
+
+    # One ordered scan over the window, grouped by user
+    rows = AppUsage.objects.filter(
+        date__gte=start_date,
+        date__lt=today
+    )
+    if user_ids is not None:
+        rows = rows.filter(device_app__device__user_id__in=user_ids)
+    rows = rows.order_by('device_app__device__user_id').values_list(
+        'device_app__device__user_id', 'device_app_id', 'date', 'hourly_usage'
+    ).iterator(chunk_size=2000)
+
+    for user_id, user_rows in groupby(rows, key=lambda row: row[0]):
+        try:
+            updated_count += update_relationships_for_user(
+                user_id, [row[1:] for row in user_rows], start_date, window_days
+            )
+            user_count += 1
+        except Exception as e:
+            failed_user_ids.append(user_id)
+            logger.error(f"Error updating app relationships for user {user_id}: {str(e)}")
+
+    cleared_count = clear_stale_relationships(started, user_ids, exclude_user_ids=failed_user_ids)
+
+    logger.info(
+        f"App relationship update complete: {updated_count} relationships for {user_count} users, "
+        f"{cleared_count} cleared"
+    )
+    return {'relationships_updated': updated_count, 'relationships_cleared': cleared_count, 'users': user_count}
+
+
+def clear_stale_relationships(refreshed_since, user_ids=None, exclude_user_ids=()):
+    """
+    Reset the co-usage of computed relationships not refreshed since a time
+
+    User-created relationships are left alone.
+    """
+    stale = AppRelationship.objects.filter(
+        user_created=False,
+        updated_at__lt=refreshed_since
+    ).exclude(co_usage_frequency=0, interactions_count=0)
+    if user_ids is not None:
+        stale = stale.filter(app_a__device__user_id__in=user_ids)
+    if exclude_user_ids:
+        stale = stale.exclude(app_a__device__user_id__in=exclude_user_ids)
+    return stale.update(co_usage_frequency=0.0, interactions_count=0, updated_at=timezone.now())
+
+
+def build_usage_matrix(rows, start_date, window_days):
+    """
+    Build an apps x hour-slots matrix of minutes from AppUsage.hourly_usage
+
+    Returns (device_app_ids, matrix) where column d * 24 + h is hour h of
+    day d in the window.
+    """
+    device_app_ids = sorted({device_app_id for device_app_id, _, _ in rows})
+    index = {device_app_id: i for i, device_app_id in enumerate(device_app_ids)}
+    matrix = np.zeros((len(device_app_ids), window_days * 24), dtype=np.float32)
+
+    for device_app_id, date, hourly_usage in rows:
+        if not hourly_usage or len(hourly_usage) != 24:
+            continue
+        offset = (date - start_date).days * 24
+        matrix[index[device_app_id], offset:offset + 24] = hourly_usage
+
+    return device_app_ids, matrix
+
+
+def co_usage_similarity(matrix):
+    """
+    Cosine similarity and shared active hours between every pair of apps
+
+    Both come from one matrix product each over the normalized / binarized
+    usage matrix, instead of pairwise queries.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    normalized = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    similarity = normalized @ normalized.T
+
+    active = (matrix > 0).astype(np.float32)
+    shared_hours = active @ active.T
+
+    np.fill_diagonal(similarity, 0)
+    return similarity, shared_hours
+
+
+def update_relationships_for_user(user_id, rows, start_date, window_days=CO_USAGE_WINDOW_DAYS):
+    """Compute co-usage for one user's apps and bulk-upsert the top relationships"""
+    device_app_ids, matrix = build_usage_matrix(rows, start_date, window_days)
+    if len(device_app_ids) < 2:
+        return 0
+
+    similarity, shared_hours = co_usage_similarity(matrix)
+
+    # Top neighbours per app above the similarity floor, each pair once
+    k = min(MAX_RELATIONSHIPS_PER_APP, len(device_app_ids) - 1)
+    neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    pairs = {}
+    for i, row in enumerate(neighbours):
+        for j in row:
+            score = float(similarity[i, j])
+            if score >= MIN_CO_USAGE_SIMILARITY:
+                pairs[(min(i, j), max(i, j))] = score
+    if not pairs:
+        return 0
+
+    device_apps = DeviceApp.objects.filter(id__in=device_app_ids).select_related('app')
+    apps_by_id = {device_app.id: device_app for device_app in device_apps}
+
+    # Keep the orientation of relationships that already exist (possibly user-created)
+    existing = AppRelationship.objects.filter(
+        app_a_id__in=device_app_ids,
+        app_b_id__in=device_app_ids
+    ).values_list('app_a_id', 'app_b_id')
+    orientation = {frozenset(pair): pair for pair in existing}
+
+    relationships = []
+    for (i, j), score in pairs.items():
+        app_a, app_b = apps_by_id.get(device_app_ids[i]), apps_by_id.get(device_app_ids[j])
+        if not app_a or not app_b:
+            continue
+        a_id, b_id = orientation.get(frozenset((app_a.id, app_b.id)), (app_a.id, app_b.id))
+        relationships.append(AppRelationship(
+            app_a_id=a_id,
+            app_b_id=b_id,
+            relationship_type=infer_relationship_type(app_a.app, app_b.app),
+            same_device=app_a.device_id == app_b.device_id,
+            co_usage_frequency=round(score, 4),
+            interactions_count=int(shared_hours[i, j]),
+        ))
+
+    AppRelationship.objects.bulk_create(
+        relationships,
+        update_conflicts=True,
+        unique_fields=['app_a', 'app_b'],
+        update_fields=['co_usage_frequency', 'interactions_count', 'same_device', 'updated_at']
+    )
+    return len(relationships)
+
+
+def infer_relationship_type(app_a, app_b):
+    """Default relationship type for a newly discovered co-used pair"""
+    if app_a.is_social_media and app_b.is_social_media:
+        return 'gossip_buddies'
+    if app_a.is_productivity and app_b.is_productivity:
+        return 'productivity_team'
+    if app_a.is_productivity != app_b.is_productivity:
+        return 'rivals'
+    if (app_a.is_entertainment or app_a.is_game) and (app_b.is_entertainment or app_b.is_game):
+        return 'enablers'
+    if app_a.category_id == app_b.category_id:
+        return 'competitors'
+    return 'frenemies'
@@ -1,3 +1,71 @@
+from datetime import date, timedelta
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+from apps.applications.models import App, AppCategory, AppRelationship, DeviceApp
+from apps.applications.tasks import update_app_relationships
+from apps.devices.models import Device, DeviceType
+from apps.usage.models import AppUsage
 
-# Create your tests here.
+
+class StaleRelationshipTests(TestCase):
+    """Computed pairs the co-usage run no longer finds lose their co-usage"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        device_type = DeviceType.objects.create(name='Phone', default_personality='anxious', platform_category='mobile')
+        device = Device.objects.create(user=user, name='Phone', device_type=device_type, platform='ios')
+        category = AppCategory.objects.create(name='Social')
+        self.apps = [
+            DeviceApp.objects.create(
+                device=device,
+                app=App.objects.create(name=name, bundle_id=f'com.example.{name}', category=category)
+            )
+            for name in ('chat', 'feed', 'maps')
+        ]
+        self.day = date(2026, 10, 1)
+
+    def relate(self, app_a, app_b, **fields):
+        relationship = AppRelationship.objects.create(
+            app_a=app_a, app_b=app_b, relationship_type='rivals',
+            co_usage_frequency=0.9, interactions_count=12, **fields
+        )
+        AppRelationship.objects.filter(pk=relationship.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        return relationship
+
+    def use(self, device_app, hours):
+        return AppUsage(
+            device_app=device_app, date=self.day,
+            hourly_usage=[10 if hour in hours else 0 for hour in range(24)]
+        )
+
+    def test_pair_no_longer_co_used_is_cleared(self):
+        chat, feed, maps = self.apps
+        stale = self.relate(chat, maps)
+        AppUsage.objects.bulk_create([self.use(chat, {8, 9}), self.use(feed, {8, 9}), self.use(maps, {20})])
+
+        result = update_app_relationships(date=self.day)
+
+        stale.refresh_from_db()
+        self.assertEqual((stale.co_usage_frequency, stale.interactions_count), (0.0, 0))
+        self.assertEqual(result['relationships_cleared'], 1)
+        refreshed = AppRelationship.objects.get(app_a=chat, app_b=feed)
+        self.assertGreater(refreshed.co_usage_frequency, 0.9)
+
+    def test_user_without_usage_is_cleared(self):
+        chat, feed, _ = self.apps
+        stale = self.relate(chat, feed)
+
+        update_app_relationships(date=self.day)
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.co_usage_frequency, 0.0)
+
+    def test_user_created_pair_is_kept(self):
+        chat, feed, _ = self.apps
+        kept = self.relate(chat, feed, user_created=True)
+
+        update_app_relationships(date=self.day)
+
+        kept.refresh_from_db()
+        self.assertEqual(kept.co_usage_frequency, 0.9)
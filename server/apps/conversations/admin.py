@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import ConversationTrigger, Conversation, DeviceJournal, AppJournal, ConversationFeedback
+from .models import (
+    ConversationTrigger, Conversation, DeviceJournal, AppJournal, ConversationFeedback, ConversationTemplate
+)
 
 
 @admin.register(ConversationTrigger)
@@ -103,3 +105,9 @@ class ConversationFeedbackAdmin(admin.ModelAdmin):
     search_fields = ['conversation__id', 'what_worked', 'what_didnt_work', 'suggestions']
     readonly_fields = ['created_at']
 
+
+@admin.register(ConversationTemplate)
+class ConversationTemplateAdmin(admin.ModelAdmin):
+    list_display = ['name', 'conversation_type', 'version', 'is_active', 'updated_at']
+    list_filter = ['conversation_type', 'is_active']
+    search_fields = ['name', 'system_prompt', 'user_prompt_template']
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appjournal',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, help_text='Hash of the generation inputs', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, db_index=True, help_text='Hash of the generation inputs', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='devicejournal',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, help_text='Hash of the generation inputs', max_length=64),
+        ),
+    ]
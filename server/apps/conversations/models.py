@@ -98,6 +98,7 @@ class Conversation(models.Model):
     generation_prompt = models.TextField(blank=True)
     generation_tokens = models.IntegerField(null=True, blank=True)
     generation_cost = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
+    input_fingerprint = models.CharField(max_length=64, blank=True, db_index=True, help_text="Hash of the generation inputs")
     
     # User interaction
     user_rating = models.IntegerField(null=True, blank=True, help_text="1-5 star rating")
@@ -173,6 +174,7 @@ class DeviceJournal(models.Model):
     # AI generation details
     ai_generated = models.BooleanField(default=True)
     generation_prompt = models.TextField(blank=True)
+    input_fingerprint = models.CharField(max_length=64, blank=True, help_text="Hash of the generation inputs")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -222,6 +224,7 @@ class AppJournal(models.Model):
     # AI generation
     ai_generated = models.BooleanField(default=True)
     generation_prompt = models.TextField(blank=True)
+    input_fingerprint = models.CharField(max_length=64, blank=True, help_text="Hash of the generation inputs")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -5,6 +5,7 @@ from .models import (
 )
 from apps.devices.serializers import DeviceListSerializer
 from apps.applications.serializers import DeviceAppListSerializer
+from apps.ai_engine.prompts import compile_template, TemplateError, SYSTEM_FIELDS, USER_FIELDS
 
 
 class ConversationTriggerSerializer(serializers.ModelSerializer):
@@ -123,6 +124,19 @@ class ConversationTemplateSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def _validate_template(self, value, fields):
+        try:
+            compile_template(value, fields)
+        except TemplateError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
+    def validate_system_prompt(self, value):
+        return self._validate_template(value, SYSTEM_FIELDS)
+    
+    def validate_user_prompt_template(self, value):
+        return self._validate_template(value, USER_FIELDS)
 
 
 class ConversationFeedbackSerializer(serializers.ModelSerializer):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UsageData, AppUsage, UsagePattern, UsageGoal
+from .models import UsageData, AppUsage, UsagePattern, UsageGoal, UsageBaseline, UsageAnomaly, AppLeaderboard
 
 
 @admin.register(UsageData)
@@ -78,3 +78,27 @@ class UsageGoalAdmin(admin.ModelAdmin):
         }),
     )
 
+
+@admin.register(UsageBaseline)
+class UsageBaselineAdmin(admin.ModelAdmin):
+    list_display = ['device', 'device_app', 'metric', 'mean', 'variance', 'observations', 'last_date']
+    list_filter = ['metric']
+    search_fields = ['device__name', 'device__user__username']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(UsageAnomaly)
+class UsageAnomalyAdmin(admin.ModelAdmin):
+    list_display = ['user', 'device', 'device_app', 'date', 'metric', 'value', 'expected', 'z_score']
+    list_filter = ['metric', 'date']
+    search_fields = ['user__username', 'device__name']
+    readonly_fields = ['created_at', 'updated_at']
+    date_hierarchy = 'date'
+
+
+@admin.register(AppLeaderboard)
+class AppLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ['user', 'window', 'date', 'updated_at']
+    list_filter = ['window', 'date']
+    search_fields = ['user__username']
+    readonly_fields = ['updated_at']
@@ -0,0 +1,125 @@
+"""
+Online usage anomaly detection
+
+Each device (and each app on it) keeps an exponentially weighted mean and
+variance per metric. A new usage day is scored against the baseline before
+it is folded in, so detection is O(1) per day and needs no history rescan.
+"""
+from math import sqrt
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from apps.usage.models import UsageBaseline, UsageAnomaly
+import logging
+
+logger = logging.getLogger('usage')
+
+
+def ewma_update(mean, variance, value, alpha):
+    """Return the EWMA mean/variance after observing value"""
+    diff = value - mean
+    increment = alpha * diff
+    return mean + increment, (1 - alpha) * (variance + diff * increment)
+
+
+def observe(device, metric, day, value, device_app=None):
+    """
+    Fold a day's value into the baseline and return the z-score (or None)
+
+    The score is computed against the baseline before this day. A re-synced
+    day replaces its own earlier contribution; days older than the last one
+    seen are scored but not folded in.
+    """
+    alpha = settings.USAGE_ANOMALY_ALPHA
+
+    with transaction.atomic():
+        baseline, created = UsageBaseline.objects.select_for_update().get_or_create(
+            device=device,
+            device_app=device_app,
+            metric=metric
+        )
+
+        if baseline.last_date and day == baseline.last_date and baseline.previous_state:
+            baseline.mean = baseline.previous_state['mean']
+            baseline.variance = baseline.previous_state['variance']
+            baseline.observations = baseline.previous_state['observations']
+
+        z_score = None
+        if baseline.observations >= settings.USAGE_ANOMALY_MIN_DAYS:
+            std = max(sqrt(baseline.variance), 1.0)
+            z_score = (value - baseline.mean) / std
+        expected = baseline.mean
+
+        if baseline.last_date is None or day >= baseline.last_date:
+            baseline.previous_state = {
+                'mean': baseline.mean,
+                'variance': baseline.variance,
+                'observations': baseline.observations,
+            }
+            if baseline.observations == 0:
+                baseline.mean, baseline.variance = float(value), 0.0
+            else:
+                baseline.mean, baseline.variance = ewma_update(
+                    baseline.mean, baseline.variance, value, alpha
+                )
+            baseline.observations += 1
+            baseline.last_date = day
+            baseline.save()
+
+    return z_score, expected
+
+
+def record_observation(device, metric, day, value, device_app=None):
+    """Score a usage value and record (or clear) the anomaly for that day"""
+    z_score, expected = observe(device, metric, day, value, device_app)
+
+    lookup = {'device': device, 'device_app': device_app, 'date': day, 'metric': metric}
+    if z_score is None or z_score < settings.USAGE_ANOMALY_Z_THRESHOLD:
+        UsageAnomaly.objects.filter(**lookup).delete()
+        return None
+
+    anomaly, created = UsageAnomaly.objects.update_or_create(
+        **lookup,
+        defaults={
+            'user_id': device.user_id,
+            'value': value,
+            'expected': round(expected, 1),
+            'z_score': round(z_score, 2),
+        }
+    )
+    if created:
+        logger.info(f"Usage anomaly for user {device.user_id}: {metric} z={z_score:.2f} on {day}")
+        schedule_intervention(device.user_id, day)
+    return anomaly
+
+
+def schedule_intervention(user_id, day):
+    """Queue an intervention conversation unless one went out within the trigger cooldown"""
+    from apps.conversations.models import Conversation, ConversationTrigger
+    from apps.ai_engine.tasks import generate_conversation_on_demand
+
+    trigger = ConversationTrigger.objects.filter(
+        trigger_type='usage_threshold',
+        is_active=True
+    ).order_by('-priority').first()
+    if not trigger:
+        return
+
+    recent = Conversation.objects.filter(
+        user_id=user_id,
+        conversation_type='usage_intervention',
+        created_at__gte=timezone.now() - timedelta(hours=trigger.cooldown_hours)
+    ).exists()
+    if recent:
+        return
+
+    def enqueue():
+        try:
+            generate_conversation_on_demand.delay(
+                str(user_id), 'usage_intervention', 'concerned', str(day)
+            )
+        except Exception as e:
+            logger.error(f"Error queueing intervention for user {user_id}: {str(e)}")
+
+    transaction.on_commit(enqueue)
@@ -0,0 +1,143 @@
+"""
+Incrementally maintained per-user app leaderboards
+
+Each AppUsage write updates the user's daily board and the rolling 7/30 day
+boards by the change in minutes. Rolling boards expire old days on rollover
+by subtracting those days' daily boards, so readers never group and sort
+AppUsage themselves.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from apps.usage.models import AppLeaderboard
+from apps.applications.models import DeviceApp
+
+ROLLING_WINDOWS = ['7d', '30d']
+
+
+def rank_entries(entries, changes):
+    """Apply {device_app_id: (device_id, minutes_delta)} to a sorted entry list"""
+    totals = {entry[0]: [entry[1], entry[2]] for entry in entries}
+    for device_app_id, (device_id, delta) in changes.items():
+        current = totals.setdefault(device_app_id, [device_id, 0])
+        current[1] += delta
+    ranked = [
+        [device_app_id, device_id, minutes]
+        for device_app_id, (device_id, minutes) in totals.items()
+        if minutes > 0
+    ]
+    ranked.sort(key=lambda entry: -entry[2])
+    return ranked
+
+
+def _roll_forward(board, as_of):
+    """Expire the days that fall out of a rolling window when it moves to as_of"""
+    if as_of <= board.date:
+        return
+    days = AppLeaderboard.WINDOW_DAYS[board.window]
+    expired_start = board.date - timedelta(days=days - 1)
+    expired_end = as_of - timedelta(days=days)
+
+    if expired_end >= board.date:
+        board.entries = []
+    elif expired_end >= expired_start:
+        changes = {}
+        expired = AppLeaderboard.objects.filter(
+            user_id=board.user_id,
+            window='daily',
+            date__gte=expired_start,
+            date__lte=expired_end
+        ).values_list('entries', flat=True)
+        for entries in expired:
+            for device_app_id, device_id, minutes in entries:
+                change = changes.setdefault(device_app_id, [device_id, 0])
+                change[1] -= minutes
+        board.entries = rank_entries(board.entries, changes)
+    board.date = as_of
+
+
+def record_app_usage(user_id, device_id, device_app_id, day, minutes):
+    """Update the user's leaderboards for one AppUsage row"""
+    with transaction.atomic():
+        daily, _ = AppLeaderboard.objects.select_for_update().get_or_create(
+            user_id=user_id, window='daily', date=day
+        )
+        previous = next((entry[2] for entry in daily.entries if entry[0] == device_app_id), 0)
+        delta = minutes - previous
+        if delta == 0:
+            return
+        changes = {device_app_id: (device_id, delta)}
+        daily.entries = rank_entries(daily.entries, changes)
+        daily.save()
+
+        for window in ROLLING_WINDOWS:
+            board, _ = AppLeaderboard.objects.select_for_update().get_or_create(
+                user_id=user_id, window=window, defaults={'date': day}
+            )
+            _roll_forward(board, day)
+            window_start = board.date - timedelta(days=AppLeaderboard.WINDOW_DAYS[window] - 1)
+            if day >= window_start:
+                board.entries = rank_entries(board.entries, changes)
+            board.save()
+
+
+def get_leaderboard(user_id, window, as_of=None):
+    """
+    Return ranked [device_app_id, device_id, minutes] entries for a window
+
+    Daily boards are for the as_of day; rolling windows end on as_of
+    (today by default) and are rolled forward on read if no usage has
+    been written since the last rollover.
+    """
+    as_of = as_of or timezone.now().date()
+    if window == 'daily':
+        board = AppLeaderboard.objects.filter(user_id=user_id, window='daily', date=as_of).first()
+        return board.entries if board else []
+
+    board = AppLeaderboard.objects.filter(user_id=user_id, window=window).first()
+    if not board:
+        return []
+    if as_of > board.date:
+        with transaction.atomic():
+            board = AppLeaderboard.objects.select_for_update().get(pk=board.pk)
+            _roll_forward(board, as_of)
+            board.save()
+        return board.entries
+    if as_of == board.date:
+        return board.entries
+
+    # Past windows: merge the daily boards they cover
+    start = as_of - timedelta(days=AppLeaderboard.WINDOW_DAYS[window] - 1)
+    changes = {}
+    for entries in AppLeaderboard.objects.filter(
+        user_id=user_id, window='daily', date__gte=start, date__lte=as_of
+    ).values_list('entries', flat=True):
+        for device_app_id, device_id, minutes in entries:
+            change = changes.setdefault(device_app_id, [device_id, 0])
+            change[1] += minutes
+    return rank_entries([], changes)
+
+
+def get_top_device_apps(user_id, window, as_of=None, limit=5, device_id=None):
+    """
+    Return the top DeviceApp objects for a window, each with .minutes set
+
+    Optionally restricted to one device.
+    """
+    entries = get_leaderboard(user_id, window, as_of)
+    if device_id is not None:
+        entries = [entry for entry in entries if str(entry[1]) == str(device_id)]
+    entries = entries[:limit]
+
+    device_apps = DeviceApp.objects.filter(
+        id__in=[entry[0] for entry in entries]
+    ).select_related('app', 'app__category', 'device')
+    by_id = {device_app.id: device_app for device_app in device_apps}
+
+    top = []
+    for device_app_id, _, minutes in entries:
+        device_app = by_id.get(device_app_id)
+        if device_app:
+            device_app.minutes = minutes
+            top.append(device_app)
+    return top
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0001_initial'),
+        ('conversations', '0001_initial'),
+        ('devices', '0001_initial'),
+        ('usage', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('metric', models.CharField(choices=[('screen_time', 'Screen Time'), ('unlocks', 'Unlocks'), ('app_time', 'App Time')], max_length=20)),
+                ('value', models.FloatField()),
+                ('expected', models.FloatField()),
+                ('z_score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='anomalies', to='conversations.conversation')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_anomalies', to='devices.device')),
+                ('device_app', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='usage_anomalies', to='applications.deviceapp')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_anomalies', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date', '-z_score'],
+                'unique_together': {('device', 'device_app', 'date', 'metric')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageBaseline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('mean', models.FloatField(default=0.0)),
+                ('variance', models.FloatField(default=0.0)),
+                ('observations', models.IntegerField(default=0)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('previous_state', models.JSONField(default=dict, help_text='State before last_date was applied, for re-synced days')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_baselines', to='devices.device')),
+                ('device_app', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='usage_baselines', to='applications.deviceapp')),
+            ],
+            options={
+                'unique_together': {('device', 'device_app', 'metric')},
+            },
+        ),
+    ]
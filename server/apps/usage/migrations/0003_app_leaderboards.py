@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usage', '0002_usage_anomalies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('daily', 'Daily'), ('7d', 'Last 7 Days'), ('30d', 'Last 30 Days')], max_length=10)),
+                ('date', models.DateField(help_text='Day for daily boards, last day covered for rolling windows')),
+                ('entries', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='app_leaderboards', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('window', 'daily'), _negated=True), fields=('user', 'window'), name='unique_rolling_app_leaderboard')],
+                'unique_together': {('user', 'window', 'date')},
+            },
+        ),
+    ]
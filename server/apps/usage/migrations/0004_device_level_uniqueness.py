@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_device_level_duplicates(apps, schema_editor):
+    """Keep the most recently updated device-level baseline/anomaly of each key"""
+    for model_name, fields in (('UsageBaseline', ('device_id', 'metric')),
+                               ('UsageAnomaly', ('device_id', 'date', 'metric'))):
+        model = apps.get_model('usage', model_name)
+        seen = set()
+        duplicates = []
+        for row in model.objects.filter(device_app__isnull=True).order_by('-updated_at').values('pk', *fields):
+            key = tuple(row[field] for field in fields)
+            if key in seen:
+                duplicates.append(row['pk'])
+            seen.add(key)
+        model.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0001_initial'),
+        ('conversations', '0002_generation_fingerprints'),
+        ('devices', '0001_initial'),
+        ('usage', '0003_app_leaderboards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_device_level_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='usageanomaly',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagebaseline',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='usageanomaly',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_app__isnull', True)), fields=('device', 'date', 'metric'), name='unique_device_usage_anomaly'),
+        ),
+        migrations.AddConstraint(
+            model_name='usageanomaly',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_app__isnull', False)), fields=('device', 'device_app', 'date', 'metric'), name='unique_app_usage_anomaly'),
+        ),
+        migrations.AddConstraint(
+            model_name='usagebaseline',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_app__isnull', True)), fields=('device', 'metric'), name='unique_device_usage_baseline'),
+        ),
+        migrations.AddConstraint(
+            model_name='usagebaseline',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_app__isnull', False)), fields=('device', 'device_app', 'metric'), name='unique_app_usage_baseline'),
+        ),
+    ]
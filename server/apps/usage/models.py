@@ -273,4 +273,121 @@ class UsageGoal(models.Model):
     
     def __str__(self):
         target = self.device.name if self.device else (self.app.display_name if self.app else "Overall")
-        return f"{self.user.username}: {self.goal_type} for {target}"
\ No newline at end of file
+        return f"{self.user.username}: {self.goal_type} for {target}"
+
+class UsageBaseline(models.Model):
+    """Exponentially weighted mean/variance of a daily usage metric"""
+    device = models.ForeignKey('devices.Device', on_delete=models.CASCADE, related_name='usage_baselines')
+    device_app = models.ForeignKey('applications.DeviceApp', on_delete=models.CASCADE, null=True, blank=True, related_name='usage_baselines')
+    metric = models.CharField(max_length=20)  # 'screen_time', 'unlocks', 'app_time'
+    
+    # EWMA state
+    mean = models.FloatField(default=0.0)
+    variance = models.FloatField(default=0.0)
+    observations = models.IntegerField(default=0)
+    last_date = models.DateField(null=True, blank=True)
+    previous_state = models.JSONField(default=dict, help_text="State before last_date was applied, for re-synced days")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        # device_app is NULL for device-level baselines, and NULLs never collide in a unique index
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'metric'], condition=models.Q(device_app__isnull=True),
+                name='unique_device_usage_baseline'
+            ),
+            models.UniqueConstraint(
+                fields=['device', 'device_app', 'metric'], condition=models.Q(device_app__isnull=False),
+                name='unique_app_usage_baseline'
+            ),
+        ]
+    
+    def __str__(self):
+        target = self.device_app.display_name if self.device_app else self.device.name
+        return f"{target} {self.metric} baseline ({self.mean:.1f})"
+
+class UsageAnomaly(models.Model):
+    """Statistically unusual usage day flagged at ingestion"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='usage_anomalies')
+    device = models.ForeignKey('devices.Device', on_delete=models.CASCADE, related_name='usage_anomalies')
+    device_app = models.ForeignKey('applications.DeviceApp', on_delete=models.CASCADE, null=True, blank=True, related_name='usage_anomalies')
+    date = models.DateField()
+    
+    metric = models.CharField(
+        max_length=20,
+        choices=[
+            ('screen_time', 'Screen Time'),
+            ('unlocks', 'Unlocks'),
+            ('app_time', 'App Time')
+        ]
+    )
+    value = models.FloatField()
+    expected = models.FloatField()
+    z_score = models.FloatField()
+    
+    # Conversation that addressed this anomaly
+    conversation = models.ForeignKey('conversations.Conversation', on_delete=models.SET_NULL, null=True, blank=True, related_name='anomalies')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-date', '-z_score']
+        # device_app is NULL for device-level anomalies, and NULLs never collide in a unique index
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'date', 'metric'], condition=models.Q(device_app__isnull=True),
+                name='unique_device_usage_anomaly'
+            ),
+            models.UniqueConstraint(
+                fields=['device', 'device_app', 'date', 'metric'], condition=models.Q(device_app__isnull=False),
+                name='unique_app_usage_anomaly'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.metric} anomaly on {self.date} (z={self.z_score:.1f})"
+    
+    @property
+    def description(self):
+        target = self.device_app.display_name if self.device_app else self.device.name
+        labels = {
+            'screen_time': f"{target} screen time",
+            'unlocks': f"{target} unlocks",
+            'app_time': f"time in {target}"
+        }
+        return f"Unusual {labels.get(self.metric, self.metric)}: {self.value:.0f} vs usual {self.expected:.0f}"
+
+class AppLeaderboard(models.Model):
+    """Per-user app ranking by time spent, maintained as AppUsage is written"""
+    WINDOW_DAYS = {'daily': 1, '7d': 7, '30d': 30}
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='app_leaderboards')
+    window = models.CharField(
+        max_length=10,
+        choices=[
+            ('daily', 'Daily'),
+            ('7d', 'Last 7 Days'),
+            ('30d', 'Last 30 Days')
+        ]
+    )
+    date = models.DateField(help_text="Day for daily boards, last day covered for rolling windows")
+    
+    # [[device_app_id, device_id, minutes], ...] sorted by minutes, descending
+    entries = models.JSONField(default=list)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'window', 'date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'window'],
+                condition=~models.Q(window='daily'),
+                name='unique_rolling_app_leaderboard'
+            )
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} {self.window} app leaderboard - {self.date}"
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import UsageData, AppUsage, UsagePattern, UsageGoal
+from .models import UsageData, AppUsage, UsagePattern, UsageGoal, UsageAnomaly
 from apps.applications.serializers import DeviceAppListSerializer
 
 
@@ -124,6 +124,21 @@ class UsageGoalSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class UsageAnomalySerializer(serializers.ModelSerializer):
+    device_name = serializers.CharField(source='device.name', read_only=True)
+    app_name = serializers.CharField(source='device_app.display_name', read_only=True, allow_null=True)
+    description = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = UsageAnomaly
+        fields = [
+            'id', 'device', 'device_name', 'device_app', 'app_name', 'date',
+            'metric', 'value', 'expected', 'z_score', 'description',
+            'conversation', 'created_at'
+        ]
+        read_only_fields = fields
+
+
 class BulkUsageDataSerializer(serializers.Serializer):
     """Serializer for bulk upload of usage data"""
     device_id = serializers.UUIDField()
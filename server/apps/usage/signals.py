@@ -0,0 +1,50 @@
+"""
+Ingestion hooks for usage data
+
+Score each synced usage day against the device/app baselines as it arrives
+and keep the per-user app leaderboards current.
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from apps.usage.models import UsageData, AppUsage
+from apps.usage.anomalies import record_observation
+from apps.usage.leaderboards import record_app_usage
+import logging
+
+logger = logging.getLogger('usage')
+
+
+@receiver(post_save, sender=UsageData)
+def detect_device_anomalies(sender, instance, **kwargs):
+    """Check device screen time and unlocks for spikes"""
+    try:
+        record_observation(instance.device, 'screen_time', instance.date, instance.total_screen_time)
+        record_observation(instance.device, 'unlocks', instance.date, instance.unlock_count)
+    except Exception as e:
+        logger.error(f"Error detecting anomalies for usage {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=AppUsage)
+def detect_app_anomalies(sender, instance, **kwargs):
+    """Check a single app's daily time for spikes"""
+    try:
+        device_app = instance.device_app
+        record_observation(
+            device_app.device, 'app_time', instance.date,
+            instance.time_spent_minutes, device_app=device_app
+        )
+    except Exception as e:
+        logger.error(f"Error detecting anomalies for app usage {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=AppUsage)
+def update_app_leaderboards(sender, instance, **kwargs):
+    """Apply the change in minutes to the user's daily and rolling leaderboards"""
+    try:
+        device = instance.device_app.device
+        record_app_usage(
+            device.user_id, str(device.id), instance.device_app_id,
+            instance.date, instance.time_spent_minutes
+        )
+    except Exception as e:
+        logger.error(f"Error updating app leaderboards for app usage {instance.pk}: {str(e)}")
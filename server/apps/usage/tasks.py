@@ -4,31 +4,85 @@ Celery tasks for usage pattern detection and analysis
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta, datetime, time
-from django.db.models import Sum, Avg, Count, Q
-from apps.usage.models import UsageData, AppUsage, UsagePattern
+from django.db.models import Sum, Avg, Count, Max, Q
+from apps.usage.models import UsageData, AppUsage, UsagePattern, AppLeaderboard
 from apps.devices.models import Device
 import logging
 
 logger = logging.getLogger('usage')
 
+INGESTION_POLL_SECONDS = 5 * 60
+# Share of a shard's reporting devices that must have synced past the day before the pipeline moves on
+INGESTION_COMPLETE_SHARE = 0.95
+
+
+@shared_task(bind=True, name='apps.usage.tasks.await_ingestion', max_retries=None)
+def await_ingestion(self, user_ids, date, deadline):
+    """
+    First stage of the daily pipeline: wait until a shard's devices have
+    synced the local day `date`, or until the deadline (ISO datetime)
+    """
+    from django.utils.dateparse import parse_date, parse_datetime
+    
+    final, expected = ingestion_progress(user_ids, parse_date(date))
+    if final < expected * INGESTION_COMPLETE_SHARE and timezone.now() < parse_datetime(deadline):
+        raise self.retry(countdown=INGESTION_POLL_SECONDS)
+    if final < expected:
+        logger.warning(f"Ingestion for {date}: going ahead with {final} of {expected} devices synced")
+    return {'final': final, 'expected': expected}
+
+
+def ingestion_progress(user_ids, date):
+    """
+    (final, expected) device counts for the users' local day `date`
+    
+    Devices that reported usage in the week up to the day are expected; one
+    is final once it has synced or uploaded usage after the day ended in its
+    user's timezone.
+    """
+    from apps.accounts.timezones import get_zone
+    
+    rows = UsageData.objects.filter(
+        device__user_id__in=user_ids,
+        device__is_active=True,
+        date__gte=date - timedelta(days=6)
+    ).values('device_id', 'device__user__timezone', 'device__last_sync').annotate(
+        last_upload=Max('updated_at')
+    )
+    
+    final = expected = 0
+    midnights = {}
+    for row in rows:
+        name = row['device__user__timezone']
+        if name not in midnights:
+            midnights[name] = datetime.combine(date + timedelta(days=1), time.min, tzinfo=get_zone(name))
+        expected += 1
+        latest = max(row['last_upload'], row['device__last_sync'] or row['last_upload'])
+        final += latest >= midnights[name]
+    return final, expected
+
 
 @shared_task(name='apps.usage.tasks.detect_patterns')
-def detect_patterns():
+def detect_patterns(user_ids=None, date=None):
     """
-    Detect usage patterns for all users
-    Runs daily at 12:30 AM
+    Detect usage patterns for all users, or for a pipeline shard's users for
+    their local day that just ended (see analytics.tasks.dispatch_daily_pipeline)
     """
     logger.info("Starting usage pattern detection")
     
     from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
     User = get_user_model()
     
+    date = parse_date(date) if isinstance(date, str) else date
     detected_count = 0
     users = User.objects.filter(devices__is_active=True).distinct()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
     
     for user in users:
         try:
-            patterns = detect_patterns_for_user(user)
+            patterns = detect_patterns_for_user(user, date)
             detected_count += len(patterns)
         except Exception as e:
             logger.error(f"Error detecting patterns for user {user.id}: {str(e)}")
@@ -37,36 +91,37 @@ def detect_patterns():
     return {'patterns_detected': detected_count}
 
 
-def detect_patterns_for_user(user):
-    """Detect various usage patterns for a user"""
+def detect_patterns_for_user(user, as_of=None):
+    """Detect various usage patterns for a user in the week ending on as_of (default today)"""
     detected_patterns = []
-    now = timezone.now()
+    as_of = as_of or timezone.now().date()
     
     # Get usage data for last 7 days
-    week_ago = now - timedelta(days=7)
+    week_ago = as_of - timedelta(days=7)
     usage_data = UsageData.objects.filter(
         device__user=user,
-        date__gte=week_ago.date()
+        date__gte=week_ago,
+        date__lte=as_of
     )
     
     if not usage_data.exists():
         return detected_patterns
     
     # Check for various patterns
-    detected_patterns.extend(check_binge_pattern(user, usage_data))
-    detected_patterns.extend(check_night_owl_pattern(user, usage_data))
-    detected_patterns.extend(check_morning_person_pattern(user, usage_data))
-    detected_patterns.extend(check_weekend_warrior_pattern(user, usage_data))
-    detected_patterns.extend(check_distracted_pattern(user, usage_data))
-    detected_patterns.extend(check_doom_scrolling_pattern(user, usage_data))
-    detected_patterns.extend(check_phantom_vibration_pattern(user, usage_data))
-    detected_patterns.extend(check_app_switching_pattern(user, usage_data))
-    detected_patterns.extend(check_notification_addiction_pattern(user, usage_data))
+    detected_patterns.extend(check_binge_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_night_owl_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_morning_person_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_weekend_warrior_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_distracted_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_doom_scrolling_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_phantom_vibration_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_app_switching_pattern(user, usage_data, as_of))
+    detected_patterns.extend(check_notification_addiction_pattern(user, usage_data, as_of))
     
     return detected_patterns
 
 
-def check_binge_pattern(user, usage_data):
+def check_binge_pattern(user, usage_data, as_of):
     """Check for binge usage pattern (extended sessions)"""
     patterns = []
     
@@ -74,13 +129,12 @@ def check_binge_pattern(user, usage_data):
     high_usage_days = usage_data.filter(total_screen_time__gte=300)  # 5+ hours
     
     if high_usage_days.count() >= 3:  # 3 or more days in the week
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='binge_usage',
             defaults={
                 'description': 'Frequent extended usage sessions detected',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'moderate',
                 'confidence_score': 0.8,
@@ -95,7 +149,7 @@ def check_binge_pattern(user, usage_data):
     return patterns
 
 
-def check_night_owl_pattern(user, usage_data):
+def check_night_owl_pattern(user, usage_data, as_of):
     """Check for late night usage pattern"""
     patterns = []
     
@@ -116,13 +170,12 @@ def check_night_owl_pattern(user, usage_data):
             late_night_devices += 1
     
     if late_night_devices >= 1:
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='night_owl',
             defaults={
                 'description': 'Regular late-night device usage detected',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'weak',
                 'confidence_score': 0.6,
@@ -134,7 +187,7 @@ def check_night_owl_pattern(user, usage_data):
     return patterns
 
 
-def check_morning_person_pattern(user, usage_data):
+def check_morning_person_pattern(user, usage_data, as_of):
     """Check for early morning usage pattern"""
     patterns = []
     
@@ -147,13 +200,12 @@ def check_morning_person_pattern(user, usage_data):
             morning_devices += 1
     
     if morning_devices >= 1:
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='morning_person',
             defaults={
                 'description': 'Regular early morning device usage detected',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'weak',
                 'confidence_score': 0.6,
@@ -165,7 +217,7 @@ def check_morning_person_pattern(user, usage_data):
     return patterns
 
 
-def check_weekend_warrior_pattern(user, usage_data):
+def check_weekend_warrior_pattern(user, usage_data, as_of):
     """Check for increased weekend usage"""
     patterns = []
     
@@ -184,13 +236,12 @@ def check_weekend_warrior_pattern(user, usage_data):
     
     # Weekend usage is 50% higher than weekday
     if weekend_usage > weekday_usage * 1.5 and weekday_usage > 0:
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='weekend_warrior',
             defaults={
                 'description': 'Significantly higher usage on weekends',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'weekends',
                 'strength': 'moderate',
                 'confidence_score': 0.7,
@@ -206,7 +257,7 @@ def check_weekend_warrior_pattern(user, usage_data):
     return patterns
 
 
-def check_distracted_pattern(user, usage_data):
+def check_distracted_pattern(user, usage_data, as_of):
     """Check for distraction pattern (frequent unlocks, short sessions)"""
     patterns = []
     
@@ -215,13 +266,12 @@ def check_distracted_pattern(user, usage_data):
     avg_screen_time = usage_data.aggregate(Avg('total_screen_time'))['total_screen_time__avg'] or 0
     
     if avg_unlocks > 80 and avg_screen_time < 180:  # 80+ unlocks, less than 3 hours
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='distracted',
             defaults={
                 'description': 'Frequent phone checks with short sessions',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'moderate',
                 'confidence_score': 0.75,
@@ -237,18 +287,19 @@ def check_distracted_pattern(user, usage_data):
     return patterns
 
 
-def check_doom_scrolling_pattern(user, usage_data):
+def check_doom_scrolling_pattern(user, usage_data, as_of):
     """Check for doom scrolling (long sessions on social/news apps)"""
     patterns = []
     
     # Get social media and news app usage from last 7 days
     # Note: AppUsage is not directly linked to usage_data
-    week_ago = timezone.now() - timedelta(days=7)
+    week_ago = as_of - timedelta(days=7)
     
     social_usage = AppUsage.objects.filter(
         device_app__device__user=user,
         device_app__app__is_social_media=True,
-        date__gte=week_ago.date()
+        date__gte=week_ago,
+        date__lte=as_of
     ).aggregate(
         total_time=Sum('time_spent_minutes'),
         avg_session=Avg('time_spent_minutes')
@@ -259,13 +310,12 @@ def check_doom_scrolling_pattern(user, usage_data):
     
     # High social media usage with long sessions
     if total_social_time > 600 and avg_session > 30:  # 10+ hours total, 30+ min sessions
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='doom_scrolling',
             defaults={
                 'description': 'Extended social media and content scrolling sessions',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'strong',
                 'confidence_score': 0.8,
@@ -280,7 +330,7 @@ def check_doom_scrolling_pattern(user, usage_data):
     return patterns
 
 
-def check_phantom_vibration_pattern(user, usage_data):
+def check_phantom_vibration_pattern(user, usage_data, as_of):
     """Check for phantom vibration pattern (unlocking with no notifications)"""
     patterns = []
     
@@ -288,13 +338,12 @@ def check_phantom_vibration_pattern(user, usage_data):
     high_unlock_days = usage_data.filter(unlock_count__gte=100).count()
     
     if high_unlock_days >= 4:  # 4 or more days with 100+ unlocks
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='phantom_vibration',
             defaults={
                 'description': 'Frequent unlocking behavior detected',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'moderate',
                 'confidence_score': 0.65,
@@ -306,25 +355,25 @@ def check_phantom_vibration_pattern(user, usage_data):
     return patterns
 
 
-def check_app_switching_pattern(user, usage_data):
+def check_app_switching_pattern(user, usage_data, as_of):
     """Check for app switching pattern (using many different apps)"""
     patterns = []
     
     # Count unique apps used across the week
-    week_ago = timezone.now() - timedelta(days=7)
+    week_ago = as_of - timedelta(days=7)
     app_count = AppUsage.objects.filter(
         device_app__device__user=user,
-        date__gte=week_ago.date()
+        date__gte=week_ago,
+        date__lte=as_of
     ).values('device_app').distinct().count()
     
     if app_count > 30:  # Using 30+ different apps in a week
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='app_switching',
             defaults={
                 'description': 'Frequent switching between multiple apps',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'weak',
                 'confidence_score': 0.7,
@@ -336,7 +385,7 @@ def check_app_switching_pattern(user, usage_data):
     return patterns
 
 
-def check_notification_addiction_pattern(user, usage_data):
+def check_notification_addiction_pattern(user, usage_data, as_of):
     """Check for notification addiction (quick response to unlocks)"""
     patterns = []
     
@@ -344,13 +393,12 @@ def check_notification_addiction_pattern(user, usage_data):
     avg_unlocks = usage_data.aggregate(Avg('unlock_count'))['unlock_count__avg'] or 0
     
     if avg_unlocks > 120:  # 120+ unlocks per day on average
-        now_date = timezone.now().date()
         pattern, created = UsagePattern.objects.get_or_create(
             user=user,
             pattern_type='notification_addiction',
             defaults={
                 'description': 'Very frequent device checking behavior',
-                'start_date': now_date,
+                'start_date': as_of,
                 'frequency': 'daily',
                 'strength': 'very_strong',
                 'confidence_score': 0.85,
@@ -389,3 +437,57 @@ def cleanup_old_usage_data():
         'patterns_deleted': deleted_patterns[0],
         'cutoff_date': str(cutoff_date)
     }
+
+
+@shared_task(name='apps.usage.tasks.rebuild_app_leaderboards')
+def rebuild_app_leaderboards(days=30):
+    """
+    Rebuild app leaderboards from AppUsage
+    One-off backfill; boards are maintained incrementally afterwards
+    """
+    from apps.usage.leaderboards import ROLLING_WINDOWS, rank_entries
+    
+    logger.info("Starting app leaderboard rebuild")
+    
+    today = timezone.now().date()
+    start_date = today - timedelta(days=days - 1)
+    
+    rows = AppUsage.objects.filter(
+        date__gte=start_date,
+        date__lte=today
+    ).values_list(
+        'device_app__device__user_id', 'device_app__device_id', 'device_app_id',
+        'date', 'time_spent_minutes'
+    )
+    
+    # {user_id: {date: {device_app_id: (device_id, minutes)}}}
+    usage_by_user = {}
+    for user_id, device_id, device_app_id, usage_date, minutes in rows:
+        usage_by_user.setdefault(user_id, {}).setdefault(usage_date, {})[device_app_id] = (str(device_id), minutes)
+    
+    rebuilt_count = 0
+    for user_id, usage_by_date in usage_by_user.items():
+        for usage_date, changes in usage_by_date.items():
+            AppLeaderboard.objects.update_or_create(
+                user_id=user_id, window='daily', date=usage_date,
+                defaults={'entries': rank_entries([], changes)}
+            )
+            rebuilt_count += 1
+        
+        for window in ROLLING_WINDOWS:
+            window_start = today - timedelta(days=AppLeaderboard.WINDOW_DAYS[window] - 1)
+            changes = {}
+            for usage_date, day_changes in usage_by_date.items():
+                if usage_date < window_start:
+                    continue
+                for device_app_id, (device_id, minutes) in day_changes.items():
+                    change = changes.setdefault(device_app_id, [device_id, 0])
+                    change[1] += minutes
+            AppLeaderboard.objects.update_or_create(
+                user_id=user_id, window=window,
+                defaults={'date': today, 'entries': rank_entries([], changes)}
+            )
+            rebuilt_count += 1
+    
+    logger.info(f"App leaderboard rebuild complete: {rebuilt_count} boards")
+    return {'boards_rebuilt': rebuilt_count}
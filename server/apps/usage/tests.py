@@ -1,3 +1,102 @@
+from datetime import date, timedelta
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.devices.models import Device, DeviceType
+from apps.usage.leaderboards import get_leaderboard, record_app_usage
+from apps.usage.models import UsageAnomaly, UsageBaseline
 
-# Create your tests here.
+
+class DeviceLevelUniquenessTests(TestCase):
+    """Rows with device_app=NULL are unique per device too"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        device_type = DeviceType.objects.create(name='Phone', default_personality='anxious', platform_category='mobile')
+        self.device = Device.objects.create(user=user, name='Phone', device_type=device_type, platform='ios')
+
+    def test_duplicate_device_baseline_rejected(self):
+        UsageBaseline.objects.create(device=self.device, metric='screen_time')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UsageBaseline.objects.create(device=self.device, metric='screen_time')
+
+    def test_duplicate_device_anomaly_rejected(self):
+        fields = {
+            'user': self.device.user, 'device': self.device, 'date': date(2026, 10, 1),
+            'metric': 'unlocks', 'value': 300, 'expected': 80, 'z_score': 4.0,
+        }
+        UsageAnomaly.objects.create(**fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UsageAnomaly.objects.create(**fields)
+
+    def test_get_or_create_reuses_device_baseline(self):
+        UsageBaseline.objects.create(device=self.device, metric='screen_time')
+        self.assertEqual(
+            UsageBaseline.objects.get_or_create(device=self.device, device_app=None, metric='screen_time')[1], False
+        )
+
+
+class TopAppsParamsTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(user)
+
+    def test_impossible_date_rejected(self):
+        response = self.client.get('/api/usage/app-usage/top_apps/', {'end_date': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_date_rejected(self):
+        response = self.client.get('/api/usage/app-usage/top_apps/', {'end_date': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_integer_limit_rejected(self):
+        response = self.client.get('/api/usage/app-usage/top_apps/', {'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_valid_request(self):
+        response = self.client.get('/api/usage/app-usage/top_apps/', {'end_date': '2024-02-29', 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+
+
+class LeaderboardRollForwardTests(TestCase):
+    """Rolling boards drop the days that leave the window"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='u@example.com', username='u', password='x')
+        self.day = date(2026, 10, 1)
+
+    def record(self, device_app_id, days, minutes):
+        record_app_usage(self.user.id, 'phone', device_app_id, self.day + timedelta(days=days), minutes)
+
+    def test_write_expires_old_days(self):
+        self.record(1, 0, 30)
+        self.record(2, 7, 10)
+        self.assertEqual(get_leaderboard(self.user.id, '7d', self.day + timedelta(days=7)), [[2, 'phone', 10]])
+        self.assertEqual(
+            get_leaderboard(self.user.id, '30d', self.day + timedelta(days=7)),
+            [[1, 'phone', 30], [2, 'phone', 10]]
+        )
+
+    def test_read_expires_old_days(self):
+        self.record(1, 0, 30)
+        self.record(2, 2, 10)
+        self.assertEqual(get_leaderboard(self.user.id, '7d', self.day + timedelta(days=7)), [[2, 'phone', 10]])
+        self.assertEqual(get_leaderboard(self.user.id, '7d', self.day + timedelta(days=9)), [])
+
+    def test_rewrite_applies_the_change(self):
+        self.record(1, 0, 30)
+        self.record(2, 1, 40)
+        self.record(1, 0, 50)
+        self.assertEqual(
+            get_leaderboard(self.user.id, '7d', self.day + timedelta(days=1)),
+            [[1, 'phone', 50], [2, 'phone', 40]]
+        )
+        self.assertEqual(get_leaderboard(self.user.id, 'daily', self.day), [[1, 'phone', 50]])
+
+    def test_past_window_merges_daily_boards(self):
+        self.record(1, 0, 30)
+        self.record(2, 10, 10)
+        self.assertEqual(get_leaderboard(self.user.id, '7d', self.day + timedelta(days=3)), [[1, 'phone', 30]])
@@ -7,6 +7,7 @@ router.register('usage-data', views.UsageDataViewSet, basename='usagedata')
 router.register('app-usage', views.AppUsageViewSet, basename='appusage')
 router.register('patterns', views.UsagePatternViewSet, basename='usagepattern')
 router.register('goals', views.UsageGoalViewSet, basename='usagegoal')
+router.register('anomalies', views.UsageAnomalyViewSet, basename='usageanomaly')
 
 urlpatterns = [
     path('', include(router.urls)),
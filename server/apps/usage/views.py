@@ -4,14 +4,27 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Sum, Avg
+from django.utils.dateparse import parse_date
 from datetime import date, timedelta
-from .models import UsageData, AppUsage, UsagePattern, UsageGoal
+from .models import UsageData, AppUsage, UsagePattern, UsageGoal, UsageAnomaly, AppLeaderboard
+from .leaderboards import get_top_device_apps
 from .serializers import (
     UsageDataSerializer, AppUsageSerializer, UsagePatternSerializer,
-    UsageGoalSerializer, BulkUsageDataSerializer
+    UsageGoalSerializer, BulkUsageDataSerializer, UsageAnomalySerializer
 )
 
 
+def _query_date(request, name):
+    """A YYYY-MM-DD query parameter as a date, None if absent; ValueError if it isn't a real date"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    day = parse_date(value)  # Raises ValueError for impossible dates such as 2024-02-30
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
 class UsageDataViewSet(viewsets.ModelViewSet):
     """
     ViewSet for device usage data
@@ -149,12 +162,43 @@ class AppUsageViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def top_apps(self, request):
         """Get top apps by usage time"""
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', str(date.today()))
-        limit = int(request.query_params.get('limit', 10))
+        try:
+            start_date = _query_date(request, 'start_date')
+            end_date = _query_date(request, 'end_date') or date.today()
+        except ValueError:
+            return Response(
+                {"error": "Dates must be valid and in YYYY-MM-DD format"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= 100:
+            return Response(
+                {"error": "limit must be between 1 and 100"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         if not start_date:
-            start_date = str(date.today() - timedelta(days=7))
+            # Rolling windows come straight from the maintained leaderboard
+            window = request.query_params.get('window', '7d')
+            if window not in AppLeaderboard.WINDOW_DAYS:
+                return Response(
+                    {"error": "window must be daily, 7d or 30d"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            top_apps = get_top_device_apps(
+                request.user.id, window, as_of=end_date, limit=limit
+            )
+            return Response([
+                {
+                    'device_app': device_app.id,
+                    'device_app__display_name': device_app.display_name,
+                    'total_time': device_app.minutes
+                }
+                for device_app in top_apps
+            ])
         
         queryset = self.get_queryset().filter(
             date__gte=start_date,
@@ -162,14 +206,20 @@ class AppUsageViewSet(viewsets.ModelViewSet):
         )
         
         # Group by device_app and sum time spent
-        from django.db.models import Sum
         top_apps = queryset.values(
-            'device_app', 'device_app__display_name'
+            'device_app', 'device_app__custom_name', 'device_app__app__name'
         ).annotate(
             total_time=Sum('time_spent_minutes')
         ).order_by('-total_time')[:limit]
         
-        return Response(list(top_apps))
+        return Response([
+            {
+                'device_app': item['device_app'],
+                'device_app__display_name': item['device_app__custom_name'] or item['device_app__app__name'],
+                'total_time': item['total_time']
+            }
+            for item in top_apps
+        ])
 
 
 class UsagePatternViewSet(viewsets.ModelViewSet):
@@ -246,3 +296,19 @@ class UsageGoalViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(goal)
         return Response(serializer.data)
+
+
+class UsageAnomalyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for usage anomalies (read-only, flagged at ingestion)
+    """
+    serializer_class = UsageAnomalySerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['device', 'device_app', 'date', 'metric']
+    ordering_fields = ['date', 'z_score']
+    ordering = ['-date', '-z_score']
+    
+    def get_queryset(self):
+        user = self.request.user
+        return UsageAnomaly.objects.filter(user=user).select_related('device', 'device_app', 'device_app__app')
@@ -18,21 +18,28 @@ app.autodiscover_tasks()
 
 # Configure periodic tasks
 app.conf.beat_schedule = {
-    'generate-daily-conversations': {
-        'task': 'apps.ai_engine.tasks.generate_daily_conversations',
-        'schedule': crontab(hour=6, minute=0),  # 6 AM daily
+    # Starts the daily pipeline DAG (ingestion -> patterns -> stats -> generation)
+    # per timezone bucket at the users' local midnight (see analytics.tasks.daily_pipeline)
+    'dispatch-daily-pipeline': {
+        'task': 'apps.analytics.tasks.dispatch_daily_pipeline',
+        'schedule': crontab(minute='*/30'),  # Every 30 minutes (PIPELINE_TICK_MINUTES)
     },
-    'detect-usage-patterns': {
-        'task': 'apps.usage.tasks.detect_patterns',
-        'schedule': crontab(hour=0, minute=30),  # 12:30 AM daily
-    },
-    'calculate-analytics': {
-        'task': 'apps.analytics.tasks.calculate_user_stats',
+    'calculate-trends': {
+        'task': 'apps.analytics.tasks.calculate_trends',
         'schedule': crontab(hour=1, minute=0),  # 1 AM daily
     },
-    'generate-device-journals': {
-        'task': 'apps.ai_engine.tasks.generate_daily_journals',
-        'schedule': crontab(hour=23, minute=0),  # 11 PM daily
+    'rollup-population-distributions': {
+        'task': 'apps.analytics.tasks.rollup_population_distributions',
+        'schedule': crontab(hour=3, minute=30),  # 3:30 AM daily, after most timezones' ingestion deadline
+    },
+    'retry-failed-generations': {
+        'task': 'apps.ai_engine.tasks.retry_failed_generations',
+        'schedule': crontab(minute='*/10'),  # Every 10 minutes
+        'options': {'priority': 9},  # Behind fresh work (0 is highest)
+    },
+    'poll-generation-batches': {
+        'task': 'apps.ai_engine.tasks.poll_generation_batches',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
     },
     'cleanup-old-data': {
         'task': 'apps.usage.tasks.cleanup_old_usage_data',
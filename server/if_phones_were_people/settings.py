@@ -15,6 +15,7 @@ from pathlib import Path
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 
 
@@ -232,6 +233,68 @@ AI_API_KEY = config('AI_API_KEY', default='')
 AI_BASE_URL = config('AI_BASE_URL', default='https://api.deepseek.com')
 AI_MODEL = config('AI_MODEL', default='deepseek-chat')
 AI_JOURNAL_MODEL = config('AI_JOURNAL_MODEL', default='deepseek-chat')
+AI_MAX_CONCURRENCY = config('AI_MAX_CONCURRENCY', default=8, cast=int)  # In-flight requests for batch generation
+AI_JOURNAL_PACK_SIZE = config('AI_JOURNAL_PACK_SIZE', default=5, cast=int)  # Apps per packed journal request (1 disables)
+AI_CACHE_ENABLED = config('AI_CACHE_ENABLED', default=True, cast=bool)
+AI_CACHE_TTL = config('AI_CACHE_TTL', default=60 * 60 * 24 * 7, cast=int)  # 1 week
+AI_CACHE_MAX_ENTRIES = config('AI_CACHE_MAX_ENTRIES', default=2000, cast=int)  # Per-process LRU size
+AI_CACHE_SHARED = config('AI_CACHE_SHARED', default=False, cast=bool)  # Also store in the Django cache (e.g. Redis)
+AI_PROMPT_VERSION_CHECK_INTERVAL = config('AI_PROMPT_VERSION_CHECK_INTERVAL', default=30, cast=int)  # Seconds between prompt template version checks
+
+# Token budgets (see ai_engine.budget)
+AI_CONVERSATION_PROMPT_BUDGET = config('AI_CONVERSATION_PROMPT_BUDGET', default=400, cast=int)  # User prompt tokens before compaction
+AI_ADAPTIVE_MAX_TOKENS = config('AI_ADAPTIVE_MAX_TOKENS', default=True, cast=bool)  # max_tokens from observed completion lengths
+AI_MAX_TOKENS_PERCENTILE = config('AI_MAX_TOKENS_PERCENTILE', default=99, cast=float)
+AI_MAX_TOKENS_HEADROOM = config('AI_MAX_TOKENS_HEADROOM', default=0.2, cast=float)  # Added on top of the percentile
+AI_MAX_TOKENS_SAMPLE = config('AI_MAX_TOKENS_SAMPLE', default=500, cast=int)  # Most recent completions considered
+AI_MAX_TOKENS_MIN_SAMPLES = config('AI_MAX_TOKENS_MIN_SAMPLES', default=50, cast=int)  # Below this the built-in limits apply
+AI_MAX_TOKENS_REFRESH = config('AI_MAX_TOKENS_REFRESH', default=600, cast=int)  # Seconds between percentile reloads
+
+# AI provider HTTP connection pool (per process, see ai_engine.client)
+AI_HTTP_MAX_CONNECTIONS = config('AI_HTTP_MAX_CONNECTIONS', default=64, cast=int)
+AI_HTTP_MAX_KEEPALIVE = config('AI_HTTP_MAX_KEEPALIVE', default=32, cast=int)  # Idle connections kept open
+AI_HTTP_KEEPALIVE_EXPIRY = config('AI_HTTP_KEEPALIVE_EXPIRY', default=60, cast=float)  # Seconds an idle connection is kept
+AI_HTTP_CONNECT_TIMEOUT = config('AI_HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+AI_HTTP_READ_TIMEOUT = config('AI_HTTP_READ_TIMEOUT', default=120, cast=float)  # Long completions take a while
+AI_HTTP2 = config('AI_HTTP2', default=True, cast=bool)  # Used when the h2 package is installed
+
+# AI provider rate limits (per model); the provider's x-ratelimit-* headers override these once seen
+AI_RATE_LIMIT_RPM = config('AI_RATE_LIMIT_RPM', default=500, cast=int)
+AI_RATE_LIMIT_TPM = config('AI_RATE_LIMIT_TPM', default=1000000, cast=int)
+AI_RATE_LIMIT_REDIS_URL = config('AI_RATE_LIMIT_REDIS_URL', default='')  # Empty = per-process buckets
+AI_RATE_LIMIT_MAX_WAIT = config('AI_RATE_LIMIT_MAX_WAIT', default=300, cast=int)  # Seconds a caller may wait
+AI_RATE_LIMIT_RETRIES = config('AI_RATE_LIMIT_RETRIES', default=3, cast=int)  # Retries after a 429
+AI_RATE_LIMIT_DEFAULT_BACKOFF = config('AI_RATE_LIMIT_DEFAULT_BACKOFF', default=5, cast=float)  # 429 without retry-after
+
+# Failed generation retries and provider circuit breaker
+AI_RETRY_MAX_ATTEMPTS = config('AI_RETRY_MAX_ATTEMPTS', default=8, cast=int)
+AI_RETRY_BASE_DELAY = config('AI_RETRY_BASE_DELAY', default=60, cast=int)  # Seconds, doubled per attempt
+AI_RETRY_MAX_DELAY = config('AI_RETRY_MAX_DELAY', default=6 * 60 * 60, cast=int)
+AI_RETRY_BATCH_SIZE = config('AI_RETRY_BATCH_SIZE', default=200, cast=int)
+AI_RETRY_CONCURRENCY = config('AI_RETRY_CONCURRENCY', default=2, cast=int)
+AI_CIRCUIT_FAILURE_THRESHOLD = config('AI_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)  # Consecutive failures
+AI_CIRCUIT_RESET_TIMEOUT = config('AI_CIRCUIT_RESET_TIMEOUT', default=60, cast=int)  # Seconds before a probe
+
+# Offline batch generation (nightly runs submitted to the provider's batch API)
+AI_BATCH_MODE = config('AI_BATCH_MODE', default=False, cast=bool)
+AI_BATCH_PROVIDER = config('AI_BATCH_PROVIDER', default='openai')  # 'openai' or 'local' (file-based stand-in)
+AI_BATCH_DIR = config('AI_BATCH_DIR', default=str(BASE_DIR / 'batches'))  # Where batch input files are written
+AI_BATCH_COMPLETION_WINDOW = config('AI_BATCH_COMPLETION_WINDOW', default='24h')
+AI_BATCH_BASE_URL = config('AI_BATCH_BASE_URL', default='')  # Empty = AI_BASE_URL
+AI_BATCH_API_KEY = config('AI_BATCH_API_KEY', default='')  # Empty = AI_API_KEY
+
+# Record / replay of provider responses (see ai_engine.cassette); 'record', 'replay' or empty for off
+AI_CASSETTE_MODE = config('AI_CASSETTE_MODE', default='')
+AI_CASSETTE_PATH = config('AI_CASSETTE_PATH', default=str(BASE_DIR / 'cassettes' / 'ai.jsonl'))
+
+# Generation logging (buffered AIGenerationLog writes) and the Prometheus metrics endpoint
+AI_GENERATION_LOG_ENABLED = config('AI_GENERATION_LOG_ENABLED', default=True, cast=bool)
+AI_LOG_BATCH_SIZE = config('AI_LOG_BATCH_SIZE', default=200, cast=int)  # Rows per bulk insert
+AI_LOG_FLUSH_INTERVAL = config('AI_LOG_FLUSH_INTERVAL', default=2, cast=float)  # Seconds between flushes
+AI_LOG_QUEUE_SIZE = config('AI_LOG_QUEUE_SIZE', default=10000, cast=int)  # Rows buffered before new ones are dropped
+AI_LOG_CONTENT_SAMPLE_RATE = config('AI_LOG_CONTENT_SAMPLE_RATE', default=0.0, cast=float)  # Share of successful calls logged with their prompt and text
+AI_METRICS_WINDOW = config('AI_METRICS_WINDOW', default=300, cast=int)  # Seconds of logs the metrics summarise
+AI_METRICS_TOKEN = config('AI_METRICS_TOKEN', default='')  # Bearer token for scrapers; empty = staff only
 
 # App-specific settings
 CONVERSATION_GENERATION_SCHEDULE = config('CONVERSATION_GENERATION_SCHEDULE', default='0 6 * * *')  # Daily at 6 AM
@@ -239,6 +302,11 @@ MAX_DEVICES_PER_USER = config('MAX_DEVICES_PER_USER', default=10, cast=int)
 MAX_FRIEND_CONNECTIONS = config('MAX_FRIEND_CONNECTIONS', default=50, cast=int)
 TEMPORARY_CONNECTION_DEFAULT_HOURS = config('TEMPORARY_CONNECTION_DEFAULT_HOURS', default=24, cast=int)
 
+# Usage anomaly detection (EWMA baselines scored at ingestion)
+USAGE_ANOMALY_ALPHA = config('USAGE_ANOMALY_ALPHA', default=0.2, cast=float)
+USAGE_ANOMALY_Z_THRESHOLD = config('USAGE_ANOMALY_Z_THRESHOLD', default=3.0, cast=float)
+USAGE_ANOMALY_MIN_DAYS = config('USAGE_ANOMALY_MIN_DAYS', default=7, cast=int)
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -280,6 +348,26 @@ LOGGING = {
     },
 }
 
+# Cache, shared by the web and Celery processes: cache invalidation (heatmaps,
+# activity), the AI circuit breaker and the prompt version all rely on that.
+# Defaults to the Redis that Celery already needs (REDIS_URL); a per-process
+# LocMemCache is the DEBUG default and refused otherwise.
+LOCMEM_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default=LOCMEM_CACHE_BACKEND if DEBUG else 'django.core.cache.backends.redis.RedisCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default=config('REDIS_URL', default='redis://localhost:6379/0')),
+        'KEY_PREFIX': 'ifpwp',
+    }
+}
+if CACHES['default']['BACKEND'] == LOCMEM_CACHE_BACKEND and not DEBUG:
+    raise ImproperlyConfigured(
+        'CACHE_BACKEND is a per-process LocMemCache; set it to a shared cache (e.g. RedisCache) or enable DEBUG'
+    )
+
 # Celery Configuration
 CELERY_BROKER_URL = config('REDIS_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://localhost:6379/0')